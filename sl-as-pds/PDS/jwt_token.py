@@ -20,10 +20,11 @@ class JWT_token:
             claims['nbf'] = metadata['nbf']
         claims['jti'] = random.getrandbits(256)
         token = jwt.encode(claims,private_key, algorithm='RS256')
+        signed_token = token
         if enc_key:
             public_key = nacl.public.PublicKey(enc_key,nacl.encoding.HexEncoder)
             sealed_box = SealedBox(public_key)
             token = sealed_box.encrypt(token)
             token = base64.urlsafe_b64encode(token)
         #return 200, {'code':200,'message':token.decode('utf-8')}
-        return token, claims
\ No newline at end of file
+        return token, claims, signed_token
\ No newline at end of file
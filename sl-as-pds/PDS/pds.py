@@ -3,6 +3,7 @@ from erc721_token import ERC721_token
 from jwt_token import JWT_token
 from indy_pdp import Indy_pdp
 from token_logger import Token_logger
+from token_provisioner import Token_provisioner
 from auth_code_pdp import Auth_code_pdp
 import json
     
@@ -14,6 +15,7 @@ class PDS():
         self.indy_pdp  = Indy_pdp()
         self.jwt_token = JWT_token()
         self.logger    = Token_logger()
+        self.provisioner = Token_provisioner()
         self.auth_code = Auth_code_pdp()
 
     def wsgi_app(self, environ, start_response):
@@ -48,8 +50,9 @@ class PDS():
         if (code == 200):
             with open(self.conf['as_private_key'], mode='rb') as file: 
                 as_private_key = file.read()
-            token,claims = self.jwt_token.generate_token(as_private_key, metadata, enc_key)
+            token,claims,signed_token = self.jwt_token.generate_token(as_private_key, metadata, enc_key)
             output = token.decode('utf-8')
+            self.provisioner.provision(signed_token, claims, json.loads(metadata))
             if (log_token):
                 self.logger.log_token(log_token, output)
                 print("token logged")
@@ -0,0 +1,36 @@
+import json
+import hashlib
+import paho.mqtt.client as mqtt
+
+class Token_provisioner:
+    """Pushes issued tokens to the locker they are for (the aud claim),
+    so that the locker can allow them on first use without asking the
+    IAA. Only the SHA-256 digest of the token is sent, with its actions
+    and expiry."""
+    def __init__(self):
+        with open('conf/token_provisioner.conf') as f:
+            self.conf = json.load(f)
+        self.client = None
+        if not self.conf.get('mqtt_server'):
+            return
+        try:
+            # paho-mqtt 1.x API, 2.x needs a newer Python than the image has
+            self.client = mqtt.Client(protocol=mqtt.MQTTv5)
+            self.client.connect_async(self.conf['mqtt_server'], self.conf.get('mqtt_port', 1883))
+            self.client.loop_start()
+        except OSError:
+            print("Couldn't connect to MQTT server:" + self.conf['mqtt_server'])
+            self.client = None
+
+    def provision(self, token, claims, metadata):
+        if self.client is None or 'aud' not in claims:
+            return
+        if isinstance(token, str):
+            token = token.encode('utf-8')
+        message = {'digest': hashlib.sha256(token).hexdigest(), 'jti': str(claims['jti'])}
+        if 'exp' in claims:
+            message['expires'] = claims['exp']
+        if 'actions' in metadata:
+            message['actions'] = metadata['actions']
+        topic = self.conf['topic'].format(aud=claims['aud'])
+        self.client.publish(topic, json.dumps(message), qos=self.conf.get('qos', 1))
@@ -3,8 +3,14 @@ from rappor import Rappor
 import json
 
 class Provider:
-    def __init__(self):
-        self.rappor = Rappor()
+    def __init__(self, rappor = None, surveyContract_instance = None, account = None, instantaneous = False):
+        self.rappor = rappor or Rappor()
+        self.instantaneous = instantaneous
+        if surveyContract_instance is not None:
+            # e.g. a local stand-in for the survey contract
+            self.surveyContract_instance = surveyContract_instance
+            self.account = account
+            return
         with open('conf/privacy.conf') as f:
             self.conf = json.load(f)       
         try:
@@ -20,6 +26,8 @@ class Provider:
 
     def _generate_response(self, number_of_choices, correct_choice):
         response = self.rappor.permanent_randomized_response(number_of_choices, correct_choice)
+        if self.instantaneous:
+            response = self.rappor.instantaneous_randomized_response(response)
         return response
 
     def record_response(self, number_of_choices, correct_choice, survey_name):
@@ -0,0 +1,76 @@
+class Local_call:
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+
+    def call(self, transaction = None):
+        return self.fn(*self.args)
+
+    def transact(self, transaction = None):
+        self.fn(*self.args)
+
+
+class Local_functions:
+    def __init__(self, survey):
+        self.survey = survey
+
+    def __getattr__(self, name):
+        fn = getattr(self.survey, '_' + name)
+        return lambda *args: Local_call(fn, args)
+
+
+class Local_survey:
+    """In-memory stand-in for the survey contract. It is used in place of a
+    web3 contract instance (contract.functions.<name>(...).call() and
+    .transact()), and in place of a Survey_reader (snapshot() and read()).
+    Every transaction mines a new block."""
+
+    def __init__(self):
+        self.surveys = {}
+        self.surveyToCounter = {}
+        self.surveyToResponses = {}
+        self.block_number = 0
+        self.functions = Local_functions(self)
+
+    def _createSurvey(self, name, numberOfQuestions):
+        self.surveys[name] = numberOfQuestions
+        self.surveyToCounter[name] = 0
+        self.surveyToResponses[name] = [0] * numberOfQuestions
+        self.block_number = self.block_number + 1
+
+    def _recordResponses(self, name, responses):
+        if self.surveys.get(name, 0) == 0 or len(responses) != self.surveys[name]:
+            raise Exception("Transaction reverted: recordResponses")
+        self.surveyToCounter[name] = self.surveyToCounter[name] + 1
+        totals = self.surveyToResponses[name]
+        for i in range(len(totals)):
+            totals[i] = totals[i] + responses[i]
+        self.block_number = self.block_number + 1
+
+    def _resetSurvey(self, name):
+        self.surveyToCounter[name] = 0
+        self.surveyToResponses[name] = [0] * len(self.surveyToResponses.get(name, []))
+        self.block_number = self.block_number + 1
+
+    def _getResponses(self, name):
+        return list(self.surveyToResponses.get(name, []))
+
+    def _getNumberOfQuestions(self, name):
+        return self.surveys.get(name, 0)
+
+    def _getCounter(self, name):
+        return self.surveyToCounter.get(name, 0)
+
+    def merge(self, name, counter, responses):
+        """Adds the totals of another (e.g. sharded) survey instance"""
+        self.surveyToCounter[name] = self.surveyToCounter[name] + counter
+        totals = self.surveyToResponses[name]
+        for i in range(len(totals)):
+            totals[i] = totals[i] + responses[i]
+        self.block_number = self.block_number + 1
+
+    def snapshot(self, survey_names):
+        return {name: self.read(name) for name in survey_names}
+
+    def read(self, survey_name):
+        return self._getCounter(survey_name), self._getResponses(survey_name)
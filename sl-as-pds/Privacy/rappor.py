@@ -2,27 +2,49 @@ import secrets
 
 class Rappor:
 
-    def __init__(self):
-        self.rappor_f = 0.5
-        self.rappor_p = 0.5
-        self.rappor_q = 0.75
-        self.rGenerator = secrets.SystemRandom()
+    def __init__(self, f = 0.5, p = 0.5, q = 0.75, rGenerator = None):
+        self.rappor_f = f
+        self.rappor_p = p
+        self.rappor_q = q
+        self.rGenerator = rGenerator or secrets.SystemRandom()
+
 
-    
     def permanent_randomized_response(self,number_of_choices, correct_choice):
-        responses = [0] * number_of_choices  
+        responses = [0] * number_of_choices
         for x in range(number_of_choices):
             r = self.rGenerator.random()
-            if r < 0.5:
+            if r < 1 - self.rappor_f:
                 if x == correct_choice:
                     responses[x] = 1
                 else:
                     responses[x] = 0
             else:
-                if  r < 0.75:
+                if  r < 1 - self.rappor_f/2:
                     responses[x] = 1
                 else:
                     responses[x] = 0
         return responses
 
-    
\ No newline at end of file
+    def instantaneous_randomized_response(self, permanent_response):
+        responses = [0] * len(permanent_response)
+        for x in range(len(permanent_response)):
+            r = self.rGenerator.random()
+            if permanent_response[x]:
+                responses[x] = 1 if r < self.rappor_q else 0
+            else:
+                responses[x] = 1 if r < self.rappor_p else 0
+        return responses
+
+    def estimate(self, responses, total_responders, instantaneous = False):
+        # probability that a reported bit is set, given that the true bit is
+        # not set (false) or set (true)
+        false_positive = self.rappor_f/2
+        true_positive = 1 - self.rappor_f/2
+        if instantaneous:
+            false_positive = false_positive*self.rappor_q + (1 - false_positive)*self.rappor_p
+            true_positive = true_positive*self.rappor_q + (1 - true_positive)*self.rappor_p
+        estimations = [0] * len(responses)
+        for x in range(len(responses)):
+            propability = max(0, (responses[x]/total_responders - false_positive)/(true_positive - false_positive))
+            estimations[x] = propability
+        return estimations
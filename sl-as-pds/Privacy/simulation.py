@@ -0,0 +1,130 @@
+"""Simulates large RAPPOR surveys to help choosing the f/p/q parameters
+and cohort sizes. Synthetic respondents are drawn from a known ground
+truth distribution, encoded by Provider, recorded to a local in-memory
+survey contract and estimated by Consumer. Large runs are split into
+shards that are run in a process pool and merged afterwards.
+
+Example:
+    python3 Privacy/simulation.py --respondents 10000 1000000 --f 0.25 0.5 0.75
+"""
+from concurrent.futures import ProcessPoolExecutor
+from rappor import Rappor
+from data_provider import Provider
+from statistics_consumer import Consumer
+from local_survey import Local_survey
+import argparse
+import itertools
+import resource
+import random
+import time
+
+SURVEY_NAME = 'simulation'
+CHUNK_SIZE = 10000
+
+def ground_truth(number_of_choices, distribution):
+    if distribution == 'uniform':
+        weights = [1] * number_of_choices
+    elif distribution == 'zipf':
+        weights = [1/(x + 1) for x in range(number_of_choices)]
+    else:
+        weights = [float(w) for w in distribution.split(',')]
+        if len(weights) != number_of_choices:
+            raise ValueError("Distribution must have a weight for every choice")
+    total = sum(weights)
+    return [w/total for w in weights]
+
+def run_shard(job):
+    respondents, truth, f, p, q, instantaneous, seed = job
+    number_of_choices = len(truth)
+    rGenerator = random.Random(seed)
+    survey = Local_survey()
+    survey.functions.createSurvey(SURVEY_NAME, number_of_choices).transact()
+    provider = Provider(Rappor(f, p, q, rGenerator), survey, instantaneous = instantaneous)
+    true_counts = [0] * number_of_choices
+    remaining = respondents
+    while remaining > 0:
+        # draw the respondents in chunks to keep memory flat
+        chunk = rGenerator.choices(range(number_of_choices), weights = truth, k = min(CHUNK_SIZE, remaining))
+        for correct_choice in chunk:
+            true_counts[correct_choice] = true_counts[correct_choice] + 1
+            provider.record_response(number_of_choices, correct_choice, SURVEY_NAME)
+        remaining = remaining - len(chunk)
+    counter, responses = survey.read(SURVEY_NAME)
+    return counter, responses, true_counts
+
+def simulate(respondents, truth, f, p, q, instantaneous = False, workers = 1, shard_size = 100000, seed = 0):
+    number_of_choices = len(truth)
+    survey = Local_survey()
+    survey.functions.createSurvey(SURVEY_NAME, number_of_choices).transact()
+    jobs = []
+    for shard, start in enumerate(range(0, respondents, shard_size)):
+        jobs.append((min(shard_size, respondents - start), truth, f, p, q, instantaneous, seed*1000003 + shard))
+    true_counts = [0] * number_of_choices
+    start = time.perf_counter()
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(run_shard, jobs))
+    else:
+        results = [run_shard(job) for job in jobs]
+    for counter, responses, shard_counts in results:
+        survey.merge(SURVEY_NAME, counter, responses)
+        true_counts = [a + b for a, b in zip(true_counts, shard_counts)]
+    elapsed = time.perf_counter() - start
+    consumer = Consumer(Rappor(f, p, q), survey, survey, instantaneous)
+    estimations = consumer.estimate_responses(number_of_choices, SURVEY_NAME)
+    errors = [abs(e - t/respondents) for e, t in zip(estimations, true_counts)]
+    return {
+        'respondents': respondents,
+        'f': f, 'p': p, 'q': q,
+        'estimations': estimations,
+        'truth': [t/respondents for t in true_counts],
+        'mean_error': sum(errors)/len(errors),
+        'max_error': max(errors),
+        'responses_per_second': respondents/elapsed if elapsed > 0 else float('inf'),
+    }
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own/1024, children/1024
+
+def main():
+    parser = argparse.ArgumentParser('simulation', description = __doc__.split('\n\n')[0])
+    parser.add_argument('--respondents', '-n', type = int, nargs = '+', default = [100000],
+                        help = "Number of respondents, may list several cohort sizes (default: 100000)")
+    parser.add_argument('--choices', '-c', type = int, default = 4,
+                        help = "Number of choices in the survey (default: 4)")
+    parser.add_argument('--distribution', default = 'zipf',
+                        help = "Ground truth: uniform, zipf or comma separated weights (default: zipf)")
+    parser.add_argument('--f', type = float, nargs = '+', default = [0.5],
+                        help = "Permanent randomized response f values (default: 0.5)")
+    parser.add_argument('--p', type = float, nargs = '+', default = [0.5],
+                        help = "Instantaneous randomized response p values (default: 0.5)")
+    parser.add_argument('--q', type = float, nargs = '+', default = [0.75],
+                        help = "Instantaneous randomized response q values (default: 0.75)")
+    parser.add_argument('--instantaneous', action = 'store_true',
+                        help = "Also apply the instantaneous randomized response (p/q)")
+    parser.add_argument('--workers', '-w', type = int, default = 1,
+                        help = "Number of worker processes (default: 1)")
+    parser.add_argument('--shard-size', type = int, default = 100000,
+                        help = "Respondents per shard (default: 100000)")
+    parser.add_argument('--seed', type = int, default = 0,
+                        help = "Random seed (default: 0)")
+    args = parser.parse_args()
+
+    truth = ground_truth(args.choices, args.distribution)
+    print("ground truth: " + ', '.join('%.4f' % t for t in truth))
+    print('%10s %5s %5s %5s %10s %10s %12s' % ('n', 'f', 'p', 'q', 'mean err', 'max err', 'responses/s'))
+    # p and q only matter with the instantaneous response
+    pq = itertools.product(args.p, args.q) if args.instantaneous else [(args.p[0], args.q[0])]
+    for (p, q), f, respondents in itertools.product(list(pq), args.f, args.respondents):
+        result = simulate(respondents, truth, f, p, q, args.instantaneous,
+                          args.workers, args.shard_size, args.seed)
+        print('%10d %5.2f %5.2f %5.2f %10.5f %10.5f %12.0f' % (
+            respondents, f, p, q, result['mean_error'], result['max_error'], result['responses_per_second']))
+    own, children = max_rss_mb()
+    print("max rss: %.1f MB (workers %.1f MB)" % (own, children))
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,16 @@
 from web3 import Web3
+from rappor import Rappor
+from survey_reader import Survey_reader
 import json
 
 class Consumer:
-    def __init__(self):
+    def __init__(self, rappor = None, surveyContract_instance = None, reader = None, instantaneous = False):
+        self.rappor = rappor or Rappor()
+        self.instantaneous = instantaneous
+        if surveyContract_instance is not None:
+            self.surveyContract_instance = surveyContract_instance
+            self.reader = reader
+            return
         with open('conf/privacy.conf') as f:
             self.conf = json.load(f)       
         try:
@@ -11,22 +19,23 @@ class Consumer:
             with open('conf/contract/build/survey.abi', 'r') as myfile:
                 abi = myfile.read()
             self.surveyContract_instance = w3.eth.contract(abi = abi, address = Web3.toChecksumAddress(self.conf['survey_sc_address']))
+            self.reader = Survey_reader(self.conf['web3provider'], self.conf['survey_sc_address'], abi)
         except:
             print("Couldn't connect to Ethereum blockchain:" + self.conf['web3provider'])
             pass
 
     def _estimate_responses(self, responses, total_responders):
-        estimations = [0] * len(responses)
-        for x in range(len(responses)):
-            propability = max(0, 2*(responses[x]/total_responders - 0.25))
-            estimations[x]   = propability
-        return estimations
+        return self.rappor.estimate(responses, total_responders, self.instantaneous)
 
     def estimate_responses(self, number_of_choices, survey_name):
-        total_responders = self.surveyContract_instance.functions.getCounter(survey_name).call()
-        responses = self.surveyContract_instance.functions.getResponses(survey_name).call()
+        total_responders, responses = self.reader.read(survey_name)
         return self._estimate_responses(responses, total_responders)
 
+    def estimate_many(self, survey_names):
+        snapshot = self.reader.snapshot(survey_names)
+        return {name: self._estimate_responses(responses, total_responders)
+                for name, (total_responders, responses) in snapshot.items()}
+
 
 
 
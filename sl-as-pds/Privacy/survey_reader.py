@@ -0,0 +1,76 @@
+from web3 import Web3
+import requests
+import json
+
+class Survey_reader:
+    """Reads survey counters and responses for many surveys at once. All
+    calls are sent as a single batched JSON-RPC request pinned to one
+    block, so counter and responses are always consistent with each
+    other. Results are cached per (survey, block number) and are only
+    fetched again when a new block has been mined."""
+
+    def __init__(self, web3provider, survey_sc_address, abi):
+        self.web3provider = web3provider
+        self.w3 = Web3(Web3.HTTPProvider(web3provider))
+        self.address = Web3.toChecksumAddress(survey_sc_address)
+        self.surveyContract_instance = self.w3.eth.contract(abi = abi, address = self.address)
+        self.session = requests.Session()
+        self.cache = {}
+        self.block_number = None
+        self.request_id = 0
+
+    def _next_id(self):
+        self.request_id = self.request_id + 1
+        return self.request_id
+
+    def _rpc(self, payload):
+        reply = self.session.post(self.web3provider, json = payload, timeout = 10)
+        reply.raise_for_status()
+        return reply.json()
+
+    def _call(self, fn_name, survey_name, block):
+        data = self.surveyContract_instance.encodeABI(fn_name = fn_name, args = [survey_name])
+        return {'jsonrpc': '2.0', 'id': self._next_id(), 'method': 'eth_call',
+                'params': [{'to': self.address, 'data': data}, hex(block)]}
+
+    def _decode(self, output_type, result):
+        return self.w3.codec.decode_single(output_type, Web3.toBytes(hexstr = result))
+
+    def latest_block(self):
+        reply = self._rpc({'jsonrpc': '2.0', 'id': self._next_id(), 'method': 'eth_blockNumber', 'params': []})
+        return int(reply['result'], 16)
+
+    def _fetch(self, survey_names, block):
+        payload = []
+        calls = {}
+        for name in survey_names:
+            counter_call = self._call('getCounter', name, block)
+            responses_call = self._call('getResponses', name, block)
+            calls[name] = (counter_call['id'], responses_call['id'])
+            payload.append(counter_call)
+            payload.append(responses_call)
+        replies = {}
+        for reply in self._rpc(payload):
+            if 'error' in reply:
+                raise Exception("Survey read failed: " + json.dumps(reply['error']))
+            replies[reply['id']] = reply['result']
+        for name, (counter_id, responses_id) in calls.items():
+            counter = self._decode('uint256', replies[counter_id])
+            responses = list(self._decode('uint256[]', replies[responses_id]))
+            self.cache[(name, block)] = (counter, responses)
+
+    def snapshot(self, survey_names):
+        """Returns a dict of survey name -> (counter, responses), all read
+        at the latest block"""
+        block = self.latest_block()
+        if block != self.block_number:
+            # results from older blocks are never read again
+            self.cache = {key: value for key, value in self.cache.items() if key[1] == block}
+            self.block_number = block
+        missing = [name for name in dict.fromkeys(survey_names) if (name, block) not in self.cache]
+        if missing:
+            self._fetch(missing, block)
+        return {name: self.cache[(name, block)] for name in survey_names}
+
+    def read(self, survey_name):
+        return self.snapshot([survey_name])[survey_name]
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Memory and lookup cost of the provisioned token allowlist: memory per
+entry, provisioning rate and lookup time of provisioned and unknown
+tokens with 100000 entries. If PyJWT is installed, local verification
+of a JWT is measured for comparison.
+
+Run as: python benchmarks/bench_allowlist.py [--entries N]
+"""
+import argparse
+import base64
+import os
+import time
+import tracemalloc
+from smaug_iot.controllers.decisions import TokenAllowlist, token_digest
+
+ACTIONS = [("lock", "unlock", "state"), ("unlock",), ("state",)]
+
+
+def fake_token(i):
+    # about the size of a PDS issued JWT
+    return base64.urlsafe_b64encode(
+        i.to_bytes(8, 'little') + os.urandom(400)).decode()
+
+
+def measure(name, count, fn):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f"  {name:<28} {elapsed / count * 1e6:8.2f} us "
+          f"({count / elapsed:10.0f}/s)")
+
+
+def jwt_verify(count):
+    try:
+        import jwt
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from smaug_iot.controllers.tokens import JwtVerifier
+    except ImportError:
+        return
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    verifier = JwtVerifier([(None, key.public_key())], audience="locker")
+    token = jwt.encode({"jti": 2 ** 255, "exp": int(time.time()) + 3600,
+                        "aud": "locker"}, key, algorithm="RS256")
+    measure("JWT verification", count,
+            lambda: [verifier.verify(token) for _ in range(count)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--entries", "-n", type=int, default=100000,
+                        help="Provisioned tokens (default: 100000)")
+    parser.add_argument("--lookups", type=int, default=100000,
+                        help="Lookups per measurement (default: 100000)")
+    args = parser.parse_args()
+
+    now = time.time()
+    tokens = [fake_token(i) for i in range(args.entries)]
+    unknown = [fake_token(i) for i in range(args.lookups)]
+    provisioned = [tokens[i % args.entries] for i in range(args.lookups)]
+
+    def provision(jti=False):
+        allowlist = TokenAllowlist(args.entries)
+
+        for i, token in enumerate(tokens):
+            allowlist.add(token_digest(token), ACTIONS[i % 3],
+                          now + 3600 + i,
+                          str(2 ** 255 + i) if jti else None)
+
+        return allowlist
+
+    print(f"{args.entries} entries:")
+    measure("provision", args.entries, provision)
+
+    for jti in (False, True):
+        tracemalloc.start()
+        allowlist = provision(jti)
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        name = "memory with jti" if jti else "memory"
+        print(f"  {name:<28} {size / 2 ** 20:8.2f} MiB "
+              f"({size / args.entries:.0f} bytes/entry)")
+
+    measure("lookup, provisioned", args.lookups,
+            lambda: [allowlist.get(token) for token in provisioned])
+    measure("lookup, unknown", args.lookups,
+            lambda: [allowlist.get(token) for token in unknown])
+    measure("provision at capacity", args.lookups, lambda: [
+        allowlist.add(token_digest(token), ACTIONS[0], now + 7200, None)
+        for token in unknown])
+
+    jwt_verify(min(args.lookups, 2000))
+
+
+if __name__ == "__main__":
+    main()
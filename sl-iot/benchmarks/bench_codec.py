@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of per-message payload decoding and validation in the
+handler decorator, using /access messages: the previous json.loads and
+schema.load path, the prepared Codec with full validation and with
+trusted (type check only) validation, and publish-side encoding.
+
+Run as: python benchmarks/bench_codec.py [--messages N]
+"""
+import argparse
+import json
+import time
+from smaug_iot.controllers.access import AccessSchema
+from smaug_iot.controllers.codec import Codec, codec_for, orjson
+
+
+MESSAGE = {
+    "id": "6f9b4c1e-7a43-4bd4-9a9f-4b2c9d1c2f11",
+    "token": "eyJ0eXAiOiJKV1QiLCJhbGciOiJSUzI1NiJ9." + "x" * 300,
+    "actions": ["lock", "unlock", "state"],
+    "allowed": True,
+    "valid": True,
+}
+
+
+def measure(name, count, fn):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"  {name:<32} {elapsed / count * 1e6:8.2f} us/msg")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", "-n", type=int, default=20000,
+                        help="Messages per measurement (default: 20000)")
+    args = parser.parse_args()
+    count = args.messages
+
+    payload = json.dumps(MESSAGE).encode()
+    schema = AccessSchema()
+    full = Codec(AccessSchema)
+    trusted = Codec(AccessSchema, trusted=True)
+
+    print(f"JSON backend: {'orjson' if orjson else 'json'}")
+    print("decode + validate:")
+    measure("json.loads + schema.load", count,
+            lambda: schema.load(json.loads(payload.decode())))
+    measure("codec (full validation)", count,
+            lambda: full.decode(payload))
+    measure("codec (trusted)", count,
+            lambda: trusted.decode(payload))
+    print("encode:")
+    measure("AccessSchema().dumps", count,
+            lambda: AccessSchema().dumps(MESSAGE).encode('utf-8'))
+    measure("codec_for(AccessSchema).encode", count,
+            lambda: codec_for(AccessSchema).encode(MESSAGE))
+
+
+if __name__ == "__main__":
+    main()
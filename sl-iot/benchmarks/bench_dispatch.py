@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Micro-benchmark of incoming MQTT message dispatch in Main: messages
+per second with 1, 10 and 1000 subscriptions, comparing the previous
+linear scan over all subscriptions against the Dispatcher lookups by
+subscription identifier and by topic name.
+
+Run as: python benchmarks/bench_dispatch.py [--messages N]
+"""
+import argparse
+import asyncio
+import time
+from smaug_iot.controllers.dispatch import Dispatcher
+
+
+async def handler(payload, properties):
+    pass
+
+
+async def linear(subscriptions, topic, payload, properties):
+    # the dispatch loop Main.on_message used before Dispatcher
+    for subid in properties['subscription_identifier']:
+        for topic, (fns, sub, subid2) in subscriptions.items():
+            if subid == subid2:
+                await asyncio.wait([asyncio.ensure_future(fn(payload,
+                                                             properties))
+                                    for fn in fns])
+
+
+async def measure(name, count, fn):
+    start = time.perf_counter()
+    for _ in range(count):
+        await fn()
+    elapsed = time.perf_counter() - start
+    print(f"  {name:<24} {count / elapsed:12.0f} msg/s")
+
+
+async def run(subscription_counts, count):
+    for n in subscription_counts:
+        dispatcher = Dispatcher()
+        subscriptions = {}
+
+        for i in range(n):
+            topic = f"/locker/{i}/lock"
+            route = dispatcher.add(topic, handler)
+            subscriptions[topic] = ([handler], None, route.subid)
+
+        # the message matches the last subscription
+        topic = f"/locker/{n - 1}/lock"
+        properties = {'subscription_identifier': [n]}
+        print(f"{n} subscriptions:")
+
+        await measure("linear scan", count, lambda: linear(
+            subscriptions, topic, b"1", properties))
+        await measure("subscription identifier", count,
+                      lambda: dispatcher.dispatch(topic, b"1", properties))
+        await measure("topic trie", count,
+                      lambda: dispatcher.dispatch(topic, b"1", {}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", "-n", type=int, default=20000,
+                        help="Messages per measurement (default: 20000)")
+    parser.add_argument("--subscriptions", type=int, nargs="+",
+                        default=[1, 10, 1000],
+                        help="Subscription counts (default: 1 10 1000)")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.subscriptions, args.messages))
+
+
+if __name__ == "__main__":
+    main()
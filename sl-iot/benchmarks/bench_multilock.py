@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Memory and CPU use of driving the doors of a locker cabinet with one
+lock-controller process per door versus a single multi-lock-controller
+process, both with mock locks: resident and proportional set size
+(RSS, PSS) and CPU time of the processes once all doors have published
+their state, and their CPU time and the command to state update latency
+while lock commands are sent to random doors at --rate per second.
+
+Needs a MQTT 5 server (--server) and Linux, as memory and CPU usage are
+read from /proc.
+
+Run as: python benchmarks/bench_multilock.py [--doors N] [--rate R]
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+from gmqtt import Client as MQTTClient
+from smaug_iot.controllers.main import parse_host
+from smaug_iot.controllers.metrics import Histogram
+
+RUN = "from smaug_iot.controllers import {0}; {0}()"
+
+
+def memory(pid):
+    """Return (RSS, PSS) of the process in bytes"""
+    values = {}
+
+    for path in (f"/proc/{pid}/status", f"/proc/{pid}/smaps_rollup"):
+        try:
+            with open(path) as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+
+                    if key in ('VmRSS', 'Pss'):
+                        values[key] = int(value.split()[0]) * 1024
+        except FileNotFoundError:
+            pass
+
+    return values.get('VmRSS', 0), values.get('Pss', values.get('VmRSS', 0))
+
+
+def cpu(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+
+    # utime and stime, fields 14 and 15
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def start(args, multi, prefix):
+    common = ['--mock', '--quiet',
+              '--server', f"{args.server[0]}:{args.server[1]}"]
+
+    if multi:
+        commands = [[sys.executable, '-c', RUN.format('multilock')] + common
+                    + ['--prefix', prefix, '--doors', str(args.doors),
+                       '--mqtt-client-id', f"{prefix}-multilock"]]
+    else:
+        commands = [[sys.executable, '-c', RUN.format('lock')] + common
+                    + ['--prefix', f"{prefix}/{i}", '--small-lock',
+                       '--mqtt-client-id', f"{prefix}-lock-{i}"]
+                    for i in range(args.doors)]
+
+    return [subprocess.Popen(command, stdout=subprocess.DEVNULL)
+            for command in commands]
+
+
+async def measure(args, multi):
+    name = "multi-lock" if multi else "process per lock"
+    # fresh topics, so that retained states of earlier runs are not seen
+    prefix = f"/bench-{os.getpid()}-{int(multi)}"
+    states = {}
+    commands = {}
+    latency = Histogram()
+    ready = asyncio.Event()
+
+    def on_message(client, topic, payload, qos, properties):
+        door = topic[len(prefix) + 1:].split('/')[0]
+        states[door] = int(payload)
+
+        if door in commands and commands[door][0] == states[door]:
+            latency.observe(time.monotonic() - commands.pop(door)[1])
+
+        if len(states) == args.doors:
+            ready.set()
+
+        return 0
+
+    client = MQTTClient(f"{prefix}-bench")
+    client.on_message = on_message
+    await client.connect(*args.server)
+    client.subscribe(f"{prefix}/+/lock/status")
+
+    processes = start(args, multi, prefix)
+    started = time.monotonic()
+
+    try:
+        await asyncio.wait_for(ready.wait(), args.timeout)
+        startup = time.monotonic() - started
+        rss, pss = (sum(values) for values in zip(*(memory(p.pid)
+                                                    for p in processes)))
+        before = sum(cpu(p.pid) for p in processes)
+        end = time.monotonic() + args.duration
+        sent = 0
+
+        while time.monotonic() < end:
+            door = str(random.randrange(args.doors))
+
+            if door not in commands:
+                locked = 1 - states[door]
+                commands[door] = (locked, time.monotonic())
+                client.publish(f"{prefix}/{door}/lock", str(locked))
+                sent += 1
+
+            await asyncio.sleep(random.expovariate(args.rate))
+
+        await asyncio.sleep(1)
+        used = sum(cpu(p.pid) for p in processes) - before
+    finally:
+        for p in processes:
+            p.terminate()
+
+        for p in processes:
+            p.wait()
+
+        await client.disconnect()
+
+    print(f"{name}: {len(processes)} processes, ready in {startup:.1f} s "
+          f"using {before:.2f} s CPU")
+    print(f"  memory      RSS {rss / 2 ** 20:8.1f} MiB, PSS "
+          f"{pss / 2 ** 20:8.1f} MiB ({pss / args.doors / 2 ** 20:.2f} "
+          f"MiB/door)")
+    print(f"  CPU         {used:8.2f} s for {sent} commands "
+          f"({100 * used / args.duration:.1f}% of one core)")
+    print(f"  latency ms  p50 {latency.percentile(50) * 1000:.1f} "
+          f"p99 {latency.percentile(99) * 1000:.1f}, "
+          f"{len(commands)} unanswered")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--doors", "-n", type=int, default=40,
+                        help="Number of doors (default: 40)")
+    parser.add_argument("--rate", type=float, default=20,
+                        help="Lock commands per second (default: 20)")
+    parser.add_argument("--duration", "-t", type=float, default=20,
+                        help="Seconds to send commands (default: 20)")
+    parser.add_argument("--timeout", type=float, default=120,
+                        help=("Seconds to wait for the doors to start "
+                              "(default: 120)"))
+    parser.add_argument("--mqtt-server", "--server", "-s",
+                        type=parse_host, dest="server",
+                        default=parse_host("localhost:1883"),
+                        help=("Address of the MQTT server "
+                              "(default: localhost:1883)"))
+    args = parser.parse_args()
+
+    for multi in (False, True):
+        asyncio.run(measure(args, multi))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Cost of the NFC message codec and framing. Typical messages are
+encoded and decoded with the previous message class (a dict of values
+per message and a linear search of the message types) and with the
+current one in both protocol versions (msgpack map and array). Then an
+Announce with a growing list of image URLs is encoded, decoded, split
+into frames and reassembled with the previous concatenation (quadratic
+in the message size) and with the Reassembler.
+
+Run as: python benchmarks/bench_nfc.py [--frame-size N]
+"""
+import argparse
+import time
+import msgpack
+from smaug_iot.nfc.framing import CONTINUATION, FRAME_SIZE, Reassembler, \
+    fragment
+from smaug_iot.nfc.messages import Announce, CloseFailure, DecodeError, \
+    Message, OpenSuccess, Verify, PROTOCOL_ARRAY, PROTOCOL_MAP
+
+URLS = (1, 10, 100, 1000)
+
+MESSAGES = (
+    Verify(token="eyJ0eXAiOiJKV1QiLCJhbGciOiJSUzI1NiJ9." + "x" * 600),
+    OpenSuccess(state="open"),
+    CloseFailure(message="Close operation not allowed", state="open"),
+    Announce(contract_address="0x" + "0" * 40, locker_id="locker-1",
+             name="Smart locker", open_close_type="open-tap-close",
+             image_urls=["https://example.com/lockers/1/image.jpg"] * 3),
+)
+
+
+class PreviousMessage(object):
+    # the message class before the type table and slots
+    TYPES = []
+
+    def __init__(self, **kwargs):
+        object.__setattr__(self, '_values', {})
+
+        for field, value in kwargs.items():
+            if field not in self.FIELDS:
+                raise DecodeError(field)
+
+            self._values[field] = value
+
+        if len(self._values.keys()) != len(self.FIELDS):
+            raise DecodeError(kwargs)
+
+    def __getattr__(self, field):
+        if field not in self._values:
+            raise DecodeError(field)
+        return self._values[field]
+
+    def encode(self):
+        return bytes([self.TYPE]) + msgpack.packb(self._values)
+
+    @classmethod
+    def decode(cls, data):
+        type_value = int(data[0])
+
+        for cls in PreviousMessage.TYPES:
+            if cls.TYPE == type_value:
+                return cls(**msgpack.unpackb(data[1:]))
+
+        raise DecodeError(type_value)
+
+
+# in the order of definition, as before
+PreviousMessage.TYPES = [
+    type(cls.__name__, (PreviousMessage,),
+         {"TYPE": cls.TYPE, "FIELDS": cls.FIELDS})
+    for cls in Message._TYPES.values()]
+
+
+def previous(frames):
+    # the reassembly loop of Nfc.send before Reassembler
+    data = bytearray()
+
+    for frame in frames:
+        type = frame[0]
+
+        if type & CONTINUATION:
+            data = data + frame[1:]
+            continue
+
+        return bytearray([type]) + data + frame[1:]
+
+
+def reassemble(reassembler, frames):
+    reassembler.reset()
+
+    for frame in frames:
+        if reassembler.add(frame):
+            return reassembler.message()
+
+
+def measure(fn, count):
+    start = time.perf_counter()
+
+    for _ in range(count):
+        fn()
+
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def codec(args):
+    print(f"{'message':<13} {'map':>5} {'array':>5} bytes, "
+          f"{'previous':>9} {'map':>7} {'array':>7} "
+          f"encode / decode us")
+
+    for message in MESSAGES:
+        previous_cls = next(cls for cls in PreviousMessage.TYPES
+                            if cls.TYPE == message.TYPE)
+        previous = previous_cls(**dict(zip(message.FIELDS,
+                                           message.values())))
+        data = previous.encode()
+        encoded = message.encode(PROTOCOL_ARRAY)
+        assert message.encode(PROTOCOL_MAP) == data
+        count = max(1, int(args.time * 1e6 / measure(
+            lambda: PreviousMessage.decode(data), 1)))
+
+        encode = [measure(fn, count) for fn in (
+            previous.encode,
+            lambda: message.encode(PROTOCOL_MAP),
+            lambda: message.encode(PROTOCOL_ARRAY))]
+        decode = [measure(fn, count) for fn in (
+            lambda: PreviousMessage.decode(data),
+            lambda: Message.decode(data),
+            lambda: Message.decode(encoded))]
+        print(f"{message.__class__.__name__:<13} {len(data):5d} "
+              f"{len(encoded):5d}       "
+              + " ".join(f"{e:4.1f}/{d:4.1f}"
+                         for e, d in zip(encode, decode)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--frame-size", type=int, default=FRAME_SIZE,
+                        help=f"Frame size (default: {FRAME_SIZE})")
+    parser.add_argument("--time", type=float, default=0.5,
+                        help="Seconds per measurement (default: 0.5)")
+    args = parser.parse_args()
+
+    codec(args)
+    print()
+
+    reassembler = Reassembler()
+    print(f"{'urls':>6} {'bytes':>8} {'frames':>6} {'encode':>9} "
+          f"{'decode':>9} {'fragment':>9} {'previous':>9} "
+          f"{'reassemble':>10}  (us per message)")
+
+    for urls in URLS:
+        announce = Announce(
+            contract_address="0x" + "0" * 40, locker_id="locker-1",
+            name="Smart locker", open_close_type="open-tap-close",
+            image_urls=[f"https://example.com/lockers/1/image-{i}.jpg"
+                        for i in range(urls)])
+        data = announce.encode()
+        frames = fragment(data, args.frame_size)
+        assert previous(frames) == data
+        assert reassemble(reassembler, frames) == data
+
+        # size the repetitions to the time per measurement
+        count = max(1, int(args.time * 1e6 / measure(
+            lambda: previous(frames), 1)))
+        times = [measure(fn, count) for fn in (
+            announce.encode,
+            lambda: Message.decode(data),
+            lambda: fragment(data, args.frame_size),
+            lambda: previous(frames),
+            lambda: reassemble(reassembler, frames))]
+        print(f"{urls:6d} {len(data):8d} {len(frames):6d} "
+              + " ".join(f"{t:9.1f}" for t in times[:-1])
+              + f" {times[-1]:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Compares the payload formats selectable with --payload-format
+(JSON, msgpack and, if cbor2 is installed, CBOR) for the inter-controller
+messages: encoded size and encode/decode CPU time per message. Run this
+on the target (Raspberry Pi class) hardware to get meaningful numbers.
+
+Run as: python benchmarks/bench_payload.py [--messages N]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+import pytz
+from smaug_iot.controllers.access import AccessSchema
+from smaug_iot.controllers.codec import Codec, FORMATS
+
+TOKEN = "eyJ0eXAiOiJKV1QiLCJhbGciOiJSUzI1NiJ9." + "x" * 300
+
+MESSAGES = (
+    ("/access", AccessSchema,
+     {"id": "6f9b4c1e-7a43-4bd4-9a9f-4b2c9d1c2f11", "token": TOKEN,
+      "actions": ["unlock"]}),
+    ("/access_result", AccessSchema,
+     {"id": "6f9b4c1e-7a43-4bd4-9a9f-4b2c9d1c2f11", "token": TOKEN,
+      "valid": True, "allowed": True,
+      "actions": ["lock", "unlock", "state"],
+      "expires": datetime.now(tz=pytz.utc) + timedelta(hours=1)}),
+    ("/lock", int, 1),
+    ("/lock/state", None, 1),
+)
+
+
+def measure(count, fn):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--messages", "-n", type=int, default=10000,
+                        help="Messages per measurement (default: 10000)")
+    args = parser.parse_args()
+
+    print(f"{'topic':<16} {'format':<8} {'bytes':>6} "
+          f"{'encode us':>10} {'decode us':>10}")
+
+    for topic, schema, data in MESSAGES:
+        codec = Codec(schema)
+
+        for name, content_type in FORMATS.items():
+            payload = codec.encode(data, content_type)
+            encode = measure(args.messages,
+                             lambda: codec.encode(data, content_type))
+            decode = measure(args.messages,
+                             lambda: codec.decode(payload, content_type))
+            print(f"{topic:<16} {name:<8} {len(payload):>6} "
+                  f"{encode:>10.2f} {decode:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
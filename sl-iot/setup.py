@@ -21,6 +21,12 @@ setup(
          '#egg=sofie_pd_component')
     ],
     extras_require={
+        'fast': [
+            'orjson',
+            ],
+        'jwt': [
+            'PyJWT[crypto]',
+            ],
         'dev': [
             'pytest',
             'sphinx',
@@ -30,11 +36,14 @@ setup(
     entry_points={
         'console_scripts': [
             'lock-controller=smaug_iot.controllers:lock',
+            'multi-lock-controller=smaug_iot.controllers:multilock',
             'wot-controller=smaug_iot.controllers:wot',
             'access-controller=smaug_iot.controllers:access',
             'nfc-controller=smaug_iot.controllers:nfc',
             'mega-mock-controller=smaug_iot.controllers:mega_mock',
             'mega-controller=smaug_iot.controllers:mega',
+            'fleet-simulator=smaug_iot.controllers.fleet:main',
+            'revocation-publisher=smaug_iot.controllers:revocation',
             "beacon-controller=smaug_iot.controllers:beacon",
         ],
     },
@@ -1,17 +1,22 @@
 # entry points for different controllers
 from .lock import LockController, MockLockController
+from .multilock import MultiLockController, MockMultiLockController
 from .wot import WotController
 from .access import AccessController, MockAccessController
 from .main import Main as _Main
 from .nfc import NfcController
 from .beacon import BeaconController
+from .revocation import RevocationPublisher
 from .abstract import MultiController
 
 lock = _Main("lock-controller", LockController, MockLockController)
+multilock = _Main("multi-lock-controller", MultiLockController,
+                  MockMultiLockController)
 wot = _Main("w3c-wot-controller", WotController)
 access = _Main("access", AccessController, MockAccessController)
 nfc = _Main("nfc", NfcController)
 beacon = _Main("beacon", BeaconController)
+revocation = _Main("revocation", RevocationPublisher)
 mega_mock = _Main("mega-mock", MultiController(MockLockController,
                                                WotController,
                                                MockAccessController))
@@ -1,8 +1,14 @@
 import abc
+import asyncio
 import logging
-import json
 import marshmallow
 import functools
+import time
+import uuid
+from .codec import codec_for, content_type, FORMATS, JSON
+from .metrics import Histogram
+from .scheduler import NORMAL
+from .state import StateCache
 
 
 class Response(object):
@@ -10,31 +16,59 @@ class Response(object):
         self.data = data
 
 
-def handler(topic, schema=None, response_schema=None):
+def handler(topic, schema=None, response_schema=None, trusted=False,
+            priority=NORMAL, concurrency=None, share=None,
+            optional_response=False):
+    """Decorator marking a controller method as a handler for messages on
+    the topic. The payload is decoded and validated with the schema
+    (see codec.Codec), and if the handler returns a Response, its data is
+    encoded with the response schema and published to the response
+    topic of the message.
+
+    Set trusted for topics where messages come only from other
+    controllers, this reduces validation to field type checks.
+
+    The payload encoding (JSON, msgpack or CBOR) is selected by the MQTT
+    5 content type of the message, and the response is encoded the same
+    way. The correlation data of the message is copied to the response.
+    A response to a message without response topic is dropped with a
+    warning, unless optional_response is set for handlers that reply
+    only to senders that ask for it.
+
+    Messages are run by the Scheduler of Main: priority is the priority
+    class of the topic (scheduler.ACTUATION, NORMAL or QUERY) and
+    concurrency limits the number of messages handled at the same time.
+
+    Handlers of requests that any one of several instances of the
+    controller can answer can declare a share group. When Main runs with
+    --shared, the topic is subscribed as the MQTT 5 shared subscription
+    $share/<group>/<topic>, and the broker delivers each message to only
+    one of the instances subscribed in the group.
+
+    """
     response_schema = response_schema or schema
+    decoder = codec_for(schema, trusted)
+    encoder = codec_for(response_schema)
 
     def wrap(fn):
         @functools.wraps(fn)
         async def call(self, payload, properties):
-            raw_data = json.loads(payload.decode()) if len(payload) else None
-
-            logging.debug("handle_message: topic=%r schema=%r fn=%r "
-                          "raw_data=%r",
-                          topic, schema, fn, raw_data)
+            message_type = content_type(properties)
 
             try:
-                if schema is None:
-                    data = raw_data
-                elif isinstance(schema, marshmallow.Schema):
-                    data = schema.load(raw_data)
-                else:
-                    data = schema(raw_data)
+                data = decoder.decode(payload, message_type)
             except marshmallow.exceptions.ValidationError as ex:
                 logging.warn("Received validation error, "
                              "dropping request: %s", ex)
                 return
+            except ValueError as ex:
+                logging.warn("Received invalid payload, "
+                             "dropping request: %s", ex)
+                return
 
-            logging.debug("schema=%r data=%r fn=%r", schema, data, fn)
+            logging.debug("handle_message: topic=%r schema=%r fn=%r "
+                          "data=%r",
+                          topic, schema, fn, data)
 
             if isinstance(data, dict):
                 result = await fn(self, **data)
@@ -47,26 +81,133 @@ def handler(topic, schema=None, response_schema=None):
 
             if isinstance(result, Response):
                 if 'response_topic' not in properties:
+                    if optional_response:
+                        return
+
                     logging.warn("Response without response topic, "
                                  "response silently dropped")
                 else:
-                    if response_schema:
-                        raw_result = response_schema.dumps(
-                            result.data).encode('utf-8')
-                    else:
-                        raw_result = json.dumps(result.data)
+                    raw_result = encoder.encode(result.data, message_type)
 
                     logging.debug("result=%r raw_result=%r",
                                   result, raw_result)
 
-                    self.publish(properties['response_topic'][0], raw_result)
+                    kwargs = {}
+
+                    if message_type != JSON:
+                        kwargs['content_type'] = message_type
+
+                    if 'correlation_data' in properties:
+                        kwargs['correlation_data'] = \
+                            properties['correlation_data'][0]
+
+                    self.publish(properties['response_topic'][0],
+                                 raw_result, absolute=True, **kwargs)
 
         call.topic = topic
+        call.codec = decoder
+        call.priority = priority
+        call.concurrency = concurrency
+        call.share = share
 
         return call
     return wrap
 
 
+class RpcError(Exception):
+    pass
+
+
+class RpcClient(object):
+    """Request/response calls over MQTT 5. Requests carry a per-client
+    response topic and unique correlation data, and the response (see
+    handler) is matched back to the waiting call by the correlation
+    data, so replies are delivered only to the client that made the
+    request.
+
+    Use Controller.create_rpc_client to create one, it also subscribes
+    to the response topic.
+
+    """
+
+    def __init__(self, controller, timeout=60):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.controller = controller
+        self.timeout = timeout
+        self.response_topic = (f"/rpc/{controller.__class__.__name__}"
+                               f"/{uuid.uuid4().hex}")
+        self.pending = {}
+        self.latency = Histogram()
+        self.timeouts = 0
+        self.cancelled = 0
+        self.errors = 0
+
+    @property
+    def in_flight(self):
+        return len(self.pending)
+
+    async def call(self, topic, data=None, schema=None,
+                   response_schema=None, timeout=None):
+        """Publish data to the topic and wait for the response. Raises
+        asyncio.TimeoutError if there is no response within the timeout
+        (or default timeout of the client), and RpcError if the response
+        cannot be decoded."""
+        timeout = self.timeout if timeout is None else timeout
+        correlation_data = uuid.uuid4().bytes
+        future = asyncio.get_event_loop().create_future()
+        self.pending[correlation_data] = (
+            future, codec_for(response_schema or schema, trusted=True))
+        start = time.monotonic()
+
+        try:
+            self.controller.publish_data(
+                topic, data, schema,
+                response_topic=self.response_topic,
+                correlation_data=correlation_data)
+
+            result = await asyncio.wait_for(future, timeout)
+            self.latency.observe(time.monotonic() - start)
+            return result
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        except RpcError:
+            self.errors += 1
+            raise
+        finally:
+            del self.pending[correlation_data]
+
+    async def receive(self, payload, properties):
+        correlation_data = properties.get('correlation_data', [None])[0]
+
+        if correlation_data not in self.pending:
+            self.log.debug("response for %r received, not pending "
+                           "(late or unknown)", correlation_data)
+            return
+
+        future, codec = self.pending[correlation_data]
+
+        if future.done():
+            return
+
+        try:
+            future.set_result(codec.decode(payload, content_type(properties)))
+        except (marshmallow.exceptions.ValidationError, ValueError) as ex:
+            future.set_exception(RpcError(f"Invalid response: {ex}"))
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "timeouts": self.timeouts,
+            "cancelled": self.cancelled,
+            "errors": self.errors,
+            "latency": self.latency.snapshot(),
+        }
+
+
 class Controller(abc.ABC):
     """Abstract class that represents a controller that will only receive
     commands via the message bus.
@@ -91,11 +232,14 @@ class Controller(abc.ABC):
 
     subscriptions -- a list of (topic, handler)
 
+    stats(self) -- return a dict of runtime statistics
+
     """
 
     def __init__(self, args):
         self.log = logging.getLogger(self.__class__.__name__)
         self._publish = None
+        self.content_type = FORMATS[getattr(args, 'payload_format', 'json')]
 
         subscriptions = set()
 
@@ -103,15 +247,21 @@ class Controller(abc.ABC):
             if name == 'subscriptions':
                 continue
 
-            method = getattr(self, name)
+            # do not evaluate properties, they may depend on state set
+            # up only after this
+            method = getattr(type(self), name, None)
 
             if isinstance(method, property):
                 method = method.fget
+            else:
+                method = getattr(self, name)
 
             if hasattr(method, 'topic'):
                 subscriptions.add((method.topic, method))
 
         self._subscriptions = list(subscriptions)
+        self._rpc_clients = []
+        self._state_caches = []
 
     @classmethod
     def augment_parser(cls, parser):
@@ -129,6 +279,48 @@ class Controller(abc.ABC):
     def publish(self, *args, **kwargs):
         self._publisher(*args, **kwargs)
 
+    def publish_data(self, topic, data, schema=None, **kwargs):
+        """Encode data with the schema in the configured payload format
+        and publish it, None is sent as an empty payload"""
+        if data is None:
+            payload = b''
+        else:
+            payload = codec_for(schema).encode(data, self.content_type)
+
+            if self.content_type != JSON:
+                kwargs['content_type'] = self.content_type
+
+        self.publish(topic, payload, **kwargs)
+
+    def create_rpc_client(self, timeout=60):
+        """Create a RpcClient for this controller and subscribe to its
+        response topic. Call this from the constructor."""
+        client = RpcClient(self, timeout)
+        self._subscriptions.append((client.response_topic, client.receive))
+        self._rpc_clients.append(client)
+        return client
+
+    def create_state_cache(self, topic, schema=None):
+        """Create a StateCache for the retained state topic and subscribe
+        to it. Call this from the constructor."""
+        cache = StateCache(topic, schema)
+        self._subscriptions.append((topic, cache.receive))
+        self._state_caches.append(cache)
+        return cache
+
+    def stats(self):
+        """Return a dict of runtime statistics, logged periodically by
+        Main (see --stats-interval)"""
+        stats = {}
+
+        for client in self._rpc_clients:
+            stats[f"rpc {client.response_topic}"] = client.stats()
+
+        for cache in self._state_caches:
+            stats[f"state {cache.topic}"] = cache.stats()
+
+        return stats
+
     @property
     def subscriptions(self):
         return self._subscriptions
@@ -147,6 +339,13 @@ class MultiController(object):
             self.log = logging.getLogger(self.__class__.__name__)
             self.controllers = controllers
             self.subscriptions = []
+            self.loopback = getattr(args, 'loopback', False)
+            self.loopback_mirror = getattr(args, 'loopback_mirror', False)
+
+            # with loopback, Main delivers messages between the
+            # controllers (see Loopback) and the broker must not echo
+            # back our own messages
+            self.no_local = self.loopback
 
             for c in self.controllers:
                 self.subscriptions.extend(c.subscriptions)
@@ -162,6 +361,15 @@ class MultiController(object):
             for c in self.controllers:
                 c.initialize()
 
+        def stats(self):
+            stats = {}
+
+            for c in self.controllers:
+                stats.update({f"{c.__class__.__name__} {name}": value
+                              for name, value in c.stats().items()})
+
+            return stats
+
         def uninitialize(self):
             for c in self.controllers:
                 c.uninitialize()
@@ -181,5 +389,14 @@ class MultiController(object):
         return impl
 
     def augment_parser(self, parser):
+        parser.add_argument(
+            '--loopback', action='store_true', default=False,
+            help=("Deliver messages between the controllers in this "
+                  "process directly, without the broker"))
+        parser.add_argument(
+            '--loopback-mirror', action='store_true', default=False,
+            help=("With --loopback, also publish locally delivered "
+                  "messages to the broker"))
+
         for cls in self.classes:
             cls.augment_parser(parser)
@@ -1,11 +1,19 @@
 import abc
+import asyncio
+import functools
+import time
 import iso8601
 import pytz
-import aiohttp
 from urllib.parse import urljoin
-from aiohttp.client_exceptions import \
-    ClientResponseError, ClientConnectionError
 from .abstract import Controller, handler, Response
+from .audit import AuditLog, AuditQuerySchema, AuditRecordSchema
+from .decisions import DecisionCache, SingleFlight, TokenAllowlist, \
+    token_digest
+from .iaa import CircuitBreaker, IaaClient, IaaError
+from .scheduler import QUERY
+from .revocation import DeltaSchema, FilterSchema, RevocationList, \
+    REVOCATION_DELTA_TOPIC, REVOCATION_FILTER_TOPIC, REVOKED, NOT_REVOKED
+from .tokens import DEFAULT_VALIDITY, JwtVerifier, TokenError
 from marshmallow import Schema, fields
 from datetime import datetime, timedelta
 
@@ -19,27 +27,196 @@ class AccessSchema(Schema):
     expires = fields.DateTime(allow_none=True)
 
 
+class InvalidateSchema(Schema):
+    token = fields.String(missing=None)
+
+
+class ProvisionSchema(Schema):
+    # hex encoded SHA-256 digest of the token
+    digest = fields.String(required=True)
+    actions = fields.List(fields.String, missing=None)
+    # UNIX timestamp
+    expires = fields.Number(missing=None)
+    jti = fields.String(missing=None)
+
+
 all_actions = ("lock", "unlock", "state")
 
 
+class CheckError(Exception):
+    """check_token could not decide whether the token is valid"""
+    pass
+
+
 class AbstractAccessController(Controller):
+    """Answers /access requests with the result of check_token. Results
+    are cached (see DecisionCache), a message on /access/invalidate
+    with a token removes its cached result, or all results without
+    one. Concurrent requests for the same token share a single
+    check_token call (see SingleFlight).
+
+    If check_token raises CheckError, a valid result that is at most
+    --cache-stale seconds past its cache lifetime is used instead, and
+    otherwise the token is denied. These fallback results are not
+    cached.
+
+    Every decision is recorded in an AuditLog, which is written to
+    --audit-file and/or published on --audit-topic in the background.
+    The audit trail is queried with requests on /access/audit."""
+
+    @classmethod
+    def augment_parser(cls, parser):
+        parser.add_argument(
+            "--cache-entries", type=int, default=10000,
+            help=("Maximum number of cached token check results, 0 "
+                  "disables caching (default: 10000)"))
+        parser.add_argument(
+            "--cache-bytes", type=int, default=4 * 1024 * 1024,
+            help=("Maximum estimated size of the cached results in bytes "
+                  "(default: 4 MiB)"))
+        parser.add_argument(
+            "--cache-ttl", type=float, default=300,
+            help=("Maximum time to cache a valid token in seconds, it is "
+                  "never cached past its expiry (default: 300)"))
+        parser.add_argument(
+            "--cache-negative-ttl", type=float, default=5,
+            help=("Time to cache a denied token in seconds "
+                  "(default: 5)"))
+        parser.add_argument(
+            "--cache-stale", type=float, default=0,
+            help=("Use a valid cached result this many seconds past its "
+                  "cache lifetime (but never past the token expiry) when "
+                  "the token cannot be checked (default: 0)"))
+        parser.add_argument(
+            "--audit-file", default=None,
+            help=("Append access decisions as gzip compressed JSON lines "
+                  "to this file"))
+        parser.add_argument(
+            "--audit-topic", default=None,
+            help="Publish batches of access decisions on this topic")
+        parser.add_argument(
+            "--audit-size", type=int, default=10000,
+            help=("Maximum number of decisions waiting to be written "
+                  "(default: 10000)"))
+        parser.add_argument(
+            "--audit-batch", type=int, default=500,
+            help="Maximum decisions per write (default: 500)")
+        parser.add_argument(
+            "--audit-interval", type=float, default=1,
+            help="Seconds between writes (default: 1)")
+        parser.add_argument(
+            "--audit-max-bytes", type=int, default=10 * 1024 * 1024,
+            help=("Rotate the audit file when it grows beyond this "
+                  "(default: 10 MiB)"))
+        parser.add_argument(
+            "--audit-backups", type=int, default=5,
+            help="Number of rotated audit files to keep (default: 5)")
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.cache = DecisionCache(args.cache_entries, args.cache_bytes,
+                                   args.cache_ttl, args.cache_negative_ttl,
+                                   args.cache_stale)
+        self.flights = SingleFlight()
+        self.audit = AuditLog(
+            args.audit_size, args.audit_file, args.audit_max_bytes,
+            args.audit_backups, args.audit_interval, args.audit_batch,
+            self.publish_audit if args.audit_topic else None)
+        self.audit_topic = args.audit_topic
+
+    def initialize(self):
+        super().initialize()
+        self.audit.start()
+
+    def uninitialize(self):
+        super().uninitialize()
+        self.audit.stop()
+
+    def publish_audit(self, records):
+        self.publish_data(self.audit_topic, records,
+                          AuditRecordSchema(many=True))
+
+    async def decide(self, token):
+        """Return the cached or checked (valid, allowed_actions, expires)
+        of the token"""
+        decision = self.cache.get(token)
+
+        if decision is None:
+            try:
+                decision = await self.flights.run(
+                    token_digest(token), self.check_and_cache, token)
+            except CheckError as ex:
+                decision = self.cache.get_stale(token)
+                self.log.warning("Cannot check token, %s: %s",
+                                 "denied" if decision is None
+                                 else "using stale result", ex)
+
+                if decision is None:
+                    decision = (False, (), None)
+
+        return decision
+
+    async def check_and_cache(self, token):
+        decision = await self.check_token(token)
+        self.cache.put(token, decision)
+        return decision
+
+    @handler("/access/invalidate", InvalidateSchema())
+    async def invalidate_message(self, token=None):
+        self.log.info("invalidating cached results: %s",
+                      "all" if token is None else "one token")
+        self.cache.invalidate(token)
+
+    def stats(self):
+        stats = super().stats()
+        stats["decision cache"] = self.cache.stats()
+        stats["token checks"] = self.flights.stats()
+        stats["audit"] = self.audit.stats()
+        return stats
+
+    @handler("/access/audit", AuditQuerySchema(),
+             AuditRecordSchema(many=True), priority=QUERY)
+    async def audit_message(self, since=None, until=None, limit=100,
+                            token=None, **match):
+        """Return the latest matching audit records, the token is
+        matched by digest"""
+        if token is not None:
+            match['token'] = token_digest(token).hex()
+
+        match = {key: value for key, value in match.items()
+                 if value is not None}
+
+        records = await asyncio.get_event_loop().run_in_executor(
+            None, functools.partial(self.audit.query, since, until, limit,
+                                    **match))
+        return Response(records)
+
     @abc.abstractmethod
     async def check_token(self, token):
         """Check the given token and return a tuple of (valid,
-        allowed_actions, expires)"""
+        allowed_actions, expires), raises CheckError if the token
+        cannot be checked now"""
         ...
 
-    @handler("/access", AccessSchema())
+    @handler("/access", AccessSchema(), concurrency=8, share="access")
     async def access_message(self, id, token, actions, **kwargs):
-        valid, allowed_actions, expires = await self.check_token(token)
+        start = time.monotonic()
+        valid, allowed_actions, expires = await self.decide(token)
 
         allowed = (valid
                    and set(actions) <= set(allowed_actions)
                    and expires >= datetime.now(tz=pytz.utc))
 
-        print(f"{'ALLOWED' if allowed else 'DENIED'}: "
-              f"{token} -- {id} "
-              f"-- {','.join(allowed_actions)}")
+        self.audit.record({"time": time.time(),
+                           "id": id,
+                           "token": token_digest(token).hex(),
+                           "actions": list(actions),
+                           "allowed_actions": list(allowed_actions),
+                           "valid": valid,
+                           "allowed": allowed,
+                           "latency": time.monotonic() - start})
+        self.log.debug("%s: %s -- %s", "ALLOWED" if allowed else "DENIED",
+                       id, ",".join(allowed_actions))
 
         return Response({"id": id,
                          "token": token,
@@ -93,56 +270,210 @@ class MockAccessController(AbstractAccessController):
 
 
 class AccessController(AbstractAccessController):
-    """This uses the IAA validation component to validate the token"""
+    """This uses the IAA validation component to validate the token.
+    If AS public keys are given, JWTs signed with them are verified
+    locally (see tokens.JwtVerifier) and the IAA is used only for
+    tokens that cannot be verified locally. IAA requests are made by
+    an IaaClient, and the IAA being unreachable, slow or failing
+    raises CheckError.
+
+    Revoked token ids published by a RevocationPublisher are checked
+    before a locally verified token is allowed, and tokens that may be
+    revoked are checked with the IAA. Cached results are dropped when
+    the revocations change.
+
+    Tokens can be provisioned by the PDS when they are issued, see
+    provision_message. These are allowed without any other checks,
+    unless their id is revoked. Provisioning is ignored when serving
+    several lockers with a wildcard prefix."""
 
     @classmethod
     def augment_parser(cls, parser):
+        super().augment_parser(parser)
         parser.add_argument(
             "--iaa-server",
             default="http://localhost:9000/secure/jwt-noproxy",
             help=("IAA server address (default: "
                   "http://localhost:9000/secure/jwt-noproxy"))
+        parser.add_argument(
+            "--as-public-key", default=[], action='append',
+            help=("Verify JWTs locally with the AS public key in this PEM "
+                  "file (e.g. as_public_key.pem), may be given more than "
+                  "once"))
+        parser.add_argument(
+            "--jwks", default=[], action='append',
+            help=("Verify JWTs locally with the RSA keys of this JWKS "
+                  "file, may be given more than once"))
+        parser.add_argument(
+            "--jwt-audience", default=None,
+            help=("Audience (aud) of locally verified JWTs, usually the "
+                  "locker id, required with --as-public-key and --jwks"))
+        parser.add_argument(
+            "--jwt-leeway", type=float, default=0,
+            help=("Allowed clock skew in seconds when checking exp and "
+                  "nbf (default: 0)"))
+        parser.add_argument(
+            "--no-iaa-fallback", action='store_false', dest='iaa_fallback',
+            default=True,
+            help=("Deny tokens that cannot be verified locally instead "
+                  "of checking them with the IAA"))
+        parser.add_argument(
+            "--iaa-pool-size", type=int, default=10,
+            help="Maximum number of IAA connections (default: 10)")
+        parser.add_argument(
+            "--iaa-keepalive", type=float, default=30,
+            help=("Seconds to keep idle IAA connections open "
+                  "(default: 30)"))
+        parser.add_argument(
+            "--iaa-timeout", type=float, default=2,
+            help=("Deadline of an IAA check in seconds, including "
+                  "retries (default: 2)"))
+        parser.add_argument(
+            "--iaa-attempts", type=int, default=2,
+            help=("Maximum number of IAA requests per check, for "
+                  "retries and hedging (default: 2)"))
+        parser.add_argument(
+            "--iaa-hedge-delay", type=float, default=0.5,
+            help=("Send another IAA request if none has answered in this "
+                  "many seconds, 0 only retries failed requests "
+                  "(default: 0.5)"))
+        parser.add_argument(
+            "--iaa-failure-threshold", type=int, default=5,
+            help=("Stop asking the IAA after this many consecutive failed "
+                  "checks, 0 never stops (default: 5)"))
+        parser.add_argument(
+            "--iaa-reset-timeout", type=float, default=30,
+            help=("Seconds before asking the IAA again after it was "
+                  "stopped (default: 30)"))
+        parser.add_argument(
+            "--provision-entries", type=int, default=100000,
+            help=("Maximum number of provisioned tokens, 0 ignores "
+                  "provisioning (default: 100000)"))
 
     def __init__(self, args):
         super().__init__(args)
         self.url = args.iaa_server
-        self.session = aiohttp.ClientSession()
+        self.iaa = IaaClient(
+            self.url, pool_size=args.iaa_pool_size,
+            keepalive=args.iaa_keepalive, timeout=args.iaa_timeout,
+            attempts=args.iaa_attempts, hedge_delay=args.iaa_hedge_delay,
+            breaker=CircuitBreaker(args.iaa_failure_threshold,
+                                   args.iaa_reset_timeout))
+        self.iaa_fallback = args.iaa_fallback
+        self.revocations = RevocationList()
+        self.allowlist = TokenAllowlist(args.provision_entries)
+        self.verifier = None
+        prefix = getattr(args, 'prefix', '')
+
+        if args.provision_entries > 0 and ('+' in prefix or '#' in prefix):
+            # entries are keyed by token only, a token provisioned for
+            # one locker would be allowed at all of them
+            self.log.warning("Provisioned tokens are ignored with the "
+                             "wildcard prefix %r", prefix)
+            self.allowlist = TokenAllowlist(0)
+
+        if args.as_public_key or args.jwks:
+            if not args.jwt_audience:
+                raise ValueError("--jwt-audience is required with "
+                                 "--as-public-key and --jwks")
+
+            self.verifier = JwtVerifier.from_files(
+                args.as_public_key, args.jwks,
+                audience=args.jwt_audience, leeway=args.jwt_leeway,
+                actions=all_actions, revocations=self.revocations)
+
+    def uninitialize(self):
+        super().uninitialize()
+        asyncio.ensure_future(self.iaa.close())
+
+    def stats(self):
+        stats = super().stats()
+        stats["iaa"] = self.iaa.stats()
+        stats["revocation"] = self.revocations.stats()
+        stats["provisioned"] = self.allowlist.stats()
+
+        if self.verifier is not None:
+            stats["jwt"] = self.verifier.stats()
+
+        return stats
+
+    @handler(REVOCATION_FILTER_TOPIC, FilterSchema(), trusted=True)
+    async def revocation_filter_message(self, **kwargs):
+        if self.revocations.update_filter(**kwargs):
+            self.log.info("revocation filter version %d: %d ids",
+                          kwargs['version'], kwargs['count'])
+            self.cache.invalidate()
+
+    @handler(REVOCATION_DELTA_TOPIC, DeltaSchema(), trusted=True)
+    async def revocation_delta_message(self, **kwargs):
+        if self.revocations.update_delta(**kwargs):
+            self.log.info("revocation delta version %d: %d ids",
+                          kwargs['version'], len(kwargs['revoked']))
+            self.cache.invalidate()
+
+    @handler("/access/provision", ProvisionSchema(), trusted=True)
+    async def provision_message(self, digest, actions=None, expires=None,
+                                jti=None):
+        """Token issued for this locker by the PDS, without expiry it is
+        provisioned for tokens.DEFAULT_VALIDITY"""
+        try:
+            digest = bytes.fromhex(digest)
+        except ValueError:
+            digest = None
+
+        if digest is None or len(digest) != 32:
+            self.log.warning("Invalid provisioned token digest, ignored")
+            return
+
+        if expires is None:
+            expires = time.time() + DEFAULT_VALIDITY.total_seconds()
+
+        self.allowlist.add(
+            digest, all_actions if actions is None else actions,
+            expires, jti)
 
     async def check_token(self, token):
-        self.log.debug("check_token: token=%r url=%r",
-                       token, self.url)
+        provisioned = self.allowlist.get(token)
+
+        if provisioned is not None:
+            allowed_actions, expires, jti = provisioned
+            revoked = self.revocations.check(jti)
 
-        # url = urljoin(self.url, "verifytoken")
-        url = self.url
-        data = {
-            # "token-type": "Bearer",
-            # "token": token
-        }
-        headers = {
-            "Authorization": "Bearer " + token
-        }
+            if revoked == REVOKED:
+                return (False, (), None)
+
+            if revoked == NOT_REVOKED:
+                return (True, allowed_actions,
+                        datetime.fromtimestamp(expires, tz=pytz.utc))
+
+        if self.verifier is not None:
+            try:
+                return self.verifier.verify(token)
+            except TokenError as ex:
+                self.log.debug("check_token: not verified locally: %s", ex)
+
+                if not self.iaa_fallback:
+                    return (False, (), None)
+
+        return await self.check_iaa(token)
+
+    async def check_iaa(self, token):
+        self.log.debug("check_iaa: token=%r url=%r",
+                       token, self.url)
 
         try:
-            self.log.debug("check_token: querying URL %s, data %r, headers %r",
-                           url, data, headers)
-
-            async with self.session.get(
-                    url, data=data, headers=headers) as response:
-                self.log.debug("check_token: response: %s", response)
-
-                if response.status == 200:
-                    # not really interested in the payload actually,
-                    # currently id does not have expiry header or
-                    # anything other useful
-                    # result = await response.json(content_type=None)
-
-                    # just allow all now
-                    return (
-                        True,
-                        all_actions,
-                        datetime.now(tz=pytz.utc) + timedelta(hours=1))
-        except (ClientResponseError, ClientConnectionError):
-            self.log.exception("Error from server")
+            ok = await self.iaa.check(token)
+        except IaaError as ex:
+            raise CheckError(f"IAA: {ex}")
+
+        if ok:
+            # not really interested in the payload actually, currently
+            # it does not have expiry header or anything other useful,
+            # so just allow all now
+            return (
+                True,
+                all_actions,
+                datetime.now(tz=pytz.utc) + timedelta(hours=1))
 
         # default is just to deny otherwise
         return (False, (), None)
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from marshmallow import Schema, fields
+from .metrics import Histogram
+
+
+# Topic where the lock controller publishes an acknowledgement of every
+# lock command once it has been applied
+LOCK_ACK_TOPIC = "/lock/ack"
+
+
+class AckSchema(Schema):
+    # the state the command asked for and the state achieved (1 locked, 0
+    # unlocked), these differ when a later command superseded it
+    requested = fields.Integer()
+    state = fields.Integer()
+    # whether the lock was actuated, False if it already was in the state
+    written = fields.Boolean()
+    # number of commands applied by the same actuation
+    coalesced = fields.Integer()
+    # seconds from receiving the command to the actuation
+    latency = fields.Float()
+
+
+class ActuationQueue(object):
+    """Queue of lock commands for one lock. Commands wait in the queue
+    while the lock is being actuated and until min_interval seconds have
+    passed since the previous actuation. Then all waiting commands are
+    applied at once: only the last one counts, as it supersedes the
+    others, and the lock is actuated with actuate(locked) only if it is
+    not already in that state according to is_locked().
+
+    submit waits until its command has been applied and returns the
+    acknowledgement (see AckSchema).
+
+    """
+
+    def __init__(self, actuate, is_locked, min_interval=0):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.actuate = actuate
+        self.is_locked = is_locked
+        self.min_interval = min_interval
+        # (locked, future, received)
+        self.waiting = []
+        self.task = None
+        self.last = None
+        self.max_depth = 0
+        self.commands = 0
+        self.actuations = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.latency = Histogram(Histogram.FINE_BUCKETS)
+
+    @property
+    def depth(self):
+        return len(self.waiting)
+
+    async def submit(self, locked):
+        future = asyncio.get_event_loop().create_future()
+        self.waiting.append((locked, future, time.monotonic()))
+        self.commands += 1
+        self.max_depth = max(self.max_depth, len(self.waiting))
+
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+        return await asyncio.shield(future)
+
+    async def run(self):
+        try:
+            while self.waiting:
+                if self.last is not None:
+                    delay = self.last + self.min_interval - time.monotonic()
+
+                    if delay > 0:
+                        # commands arriving meanwhile are coalesced
+                        await asyncio.sleep(delay)
+
+                self.apply()
+        finally:
+            self.task = None
+
+    def apply(self):
+        waiting, self.waiting = self.waiting, []
+        locked = waiting[-1][0]
+        written = bool(locked) != bool(self.is_locked())
+
+        if written:
+            try:
+                self.actuate(locked)
+            except Exception as ex:
+                for requested, future, received in waiting:
+                    if not future.done():
+                        future.set_exception(ex)
+
+                return
+
+            self.last = time.monotonic()
+            self.actuations += 1
+        else:
+            self.skipped += 1
+
+        self.coalesced += len(waiting) - 1
+        state = 1 if self.is_locked() else 0
+        now = time.monotonic()
+
+        for requested, future, received in waiting:
+            self.latency.observe(now - received)
+
+            if not future.done():
+                future.set_result({
+                    "requested": 1 if requested else 0,
+                    "state": state,
+                    "written": written,
+                    "coalesced": len(waiting),
+                    "latency": now - received,
+                })
+
+    def stats(self):
+        return {
+            "depth": len(self.waiting),
+            "max_depth": self.max_depth,
+            "commands": self.commands,
+            "actuations": self.actuations,
+            "skipped": self.skipped,
+            "coalesced": self.coalesced,
+            "latency": self.latency.snapshot(),
+        }
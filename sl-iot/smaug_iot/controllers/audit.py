@@ -0,0 +1,282 @@
+import asyncio
+import collections
+import gzip
+import json
+import logging
+import os
+import threading
+from marshmallow import Schema, fields
+from .codec import dumps
+
+
+class AuditRecordSchema(Schema):
+    time = fields.Float()
+    id = fields.String(allow_none=True)
+    # hex SHA-256 digest of the token
+    token = fields.String()
+    actions = fields.List(fields.String)
+    allowed_actions = fields.List(fields.String)
+    valid = fields.Boolean()
+    allowed = fields.Boolean()
+    latency = fields.Float()
+
+
+class AuditQuerySchema(Schema):
+    since = fields.Float(missing=None)
+    until = fields.Float(missing=None)
+    limit = fields.Integer(missing=100)
+    id = fields.String(missing=None)
+    token = fields.String(missing=None)
+    allowed = fields.Boolean(missing=None)
+
+
+class FileHead(object):
+    """The first size bytes of a binary file, so that a gzip file that
+    is appended to can be read as it was"""
+
+    def __init__(self, f, size):
+        self.f = f
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+class AuditLog(object):
+    """Audit trail of access decisions. record only appends the record
+    (a dict) to a bounded ring, so it never waits for I/O; if the ring
+    is full the oldest unwritten record is dropped and counted. A
+    background task started by start writes the records in batches,
+    every interval seconds or when batch records are waiting. Without a
+    file or publisher the records are only kept for queries.
+
+    Batches are appended as JSON lines to the gzip compressed file at
+    path, which is rotated to path.1, path.2, ... (keeping backups
+    files) when it grows beyond max_bytes, and passed to publisher, if
+    given, as a list of records. File writes run in a worker thread.
+
+    query returns the latest matching records from the files and the
+    records not yet written, including those being written, or without
+    a file from the last size records.
+
+    """
+
+    def __init__(self, size=10000, path=None, max_bytes=10 * 1024 * 1024,
+                 backups=5, interval=1, batch=500, publisher=None):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.size = size
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.interval = interval
+        self.batch = batch
+        self.publisher = publisher
+        self.pending = collections.deque(maxlen=size)
+        # batches taken to be written, until they are in the file
+        self.in_flight = []
+        # kept for queries when there are no files
+        self.recent = collections.deque(maxlen=size if path is None else 0)
+        self.wakeup = None
+        self.task = None
+        self.lock = threading.Lock()
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.published = 0
+        self.rotations = 0
+        self.errors = 0
+
+    def record(self, record):
+        self.recent.append(record)
+        self.recorded += 1
+
+        if self.path is None and self.publisher is None:
+            return
+
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped += 1
+
+        self.pending.append(record)
+
+        if (self.wakeup is not None and len(self.pending) >= self.batch
+                and not self.wakeup.is_set()):
+            self.wakeup.set()
+
+    def start(self):
+        if self.path is None and self.publisher is None:
+            return
+
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        """Cancel the background task and write the remaining records,
+        this blocks"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+        if self.path is not None or self.publisher is not None:
+            self.flush(self.take())
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+            self.wakeup.clear()
+
+            while self.pending:
+                records = self.take()
+
+                if self.publisher is not None:
+                    self.publish(records)
+
+                if self.path is not None:
+                    await loop.run_in_executor(None, self.write, records)
+
+    def take(self):
+        records = []
+
+        with self.lock:
+            while self.pending and len(records) < self.batch:
+                records.append(self.pending.popleft())
+
+            if self.path is not None and records:
+                self.in_flight.append(records)
+
+        return records
+
+    def flush(self, records):
+        while records:
+            if self.publisher is not None:
+                self.publish(records)
+
+            if self.path is not None:
+                self.write(records)
+
+            records = self.take()
+
+    def publish(self, records):
+        try:
+            self.publisher(records)
+            self.published += len(records)
+        except Exception:
+            self.errors += 1
+            self.log.exception("cannot publish audit records")
+
+    def write(self, records):
+        data = b''.join(dumps(record) + b'\n' for record in records)
+
+        with self.lock:
+            try:
+                with gzip.open(self.path, 'ab') as f:
+                    f.write(data)
+
+                self.written += len(records)
+
+                if os.path.getsize(self.path) >= self.max_bytes:
+                    self.rotate()
+            except OSError:
+                self.errors += 1
+                self.log.exception("cannot write audit records to %s",
+                                   self.path)
+
+            self.in_flight = [batch for batch in self.in_flight
+                              if batch is not records]
+
+    def rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+        self.rotations += 1
+
+    def files(self):
+        """Audit files, oldest first"""
+        paths = [f"{self.path}.{i}" for i in range(self.backups, 0, -1)]
+        paths.append(self.path)
+        return [path for path in paths if os.path.exists(path)]
+
+    def read(self):
+        """Yield all records, oldest first"""
+        if self.path is None:
+            yield from list(self.recent)
+            return
+
+        # open the files and take the pending records together, but do
+        # not block writes while reading; a file rotated meanwhile stays
+        # readable through its open handle, and a file appended to is
+        # read up to its size when opened
+        with self.lock:
+            files = [FileHead(open(path, 'rb'), os.path.getsize(path))
+                     for path in self.files()]
+            pending = [record for batch in self.in_flight
+                       for record in batch]
+            pending.extend(self.pending)
+
+        try:
+            for head in files:
+                with gzip.open(head, 'rt') as f:
+                    try:
+                        for line in f:
+                            try:
+                                yield json.loads(line)
+                            except ValueError:
+                                # partly written last line
+                                pass
+                    except EOFError:
+                        # truncated last gzip member
+                        pass
+        finally:
+            for head in files:
+                head.close()
+
+        yield from pending
+
+    def query(self, since=None, until=None, limit=100, **match):
+        """Return the last limit records from since to until (UNIX
+        times) whose fields equal the given values, oldest first. This
+        reads the files, so run it in an executor."""
+        found = collections.deque(maxlen=limit)
+
+        for record in self.read():
+            if since is not None and record['time'] < since:
+                continue
+
+            if until is not None and record['time'] > until:
+                continue
+
+            if all(record.get(key) == value
+                   for key, value in match.items()):
+                found.append(record)
+
+        return list(found)
+
+    def stats(self):
+        return {
+            "pending": len(self.pending),
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "written": self.written,
+            "published": self.published,
+            "rotations": self.rotations,
+            "errors": self.errors,
+        }
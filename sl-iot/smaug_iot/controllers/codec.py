@@ -0,0 +1,190 @@
+import json
+import msgpack
+import marshmallow
+from marshmallow import fields, ValidationError
+try:
+    orjson = None
+    import orjson
+except ImportError:
+    pass
+try:
+    cbor2 = None
+    import cbor2
+except ImportError:
+    pass
+
+
+# JSON backend, orjson is used if it is installed. Both take in bytes
+# (or str) and dumps always returns bytes.
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(data):
+        return orjson.dumps(data)
+else:
+    loads = json.loads
+
+    def dumps(data):
+        return json.dumps(data).encode('utf-8')
+
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+CBOR = 'application/cbor'
+
+# payload format names (as used on the command line) to content types
+FORMATS = {
+    'json': JSON,
+    'msgpack': MSGPACK,
+}
+
+# content type -> (loads, dumps)
+BACKENDS = {
+    JSON: (loads, dumps),
+    MSGPACK: (msgpack.unpackb, msgpack.packb),
+    'application/x-msgpack': (msgpack.unpackb, msgpack.packb),
+    'application/vnd.msgpack': (msgpack.unpackb, msgpack.packb),
+}
+
+if cbor2 is not None:
+    FORMATS['cbor'] = CBOR
+    BACKENDS[CBOR] = (cbor2.loads, cbor2.dumps)
+
+
+def content_type(properties):
+    """Return the content type of a received message, JSON if the message
+    does not have one"""
+    content_type = properties.get('content_type')
+    return content_type[0] if content_type else JSON
+
+
+def backend(content_type):
+    if content_type is None:
+        return BACKENDS[JSON]
+
+    try:
+        return BACKENDS[content_type]
+    except KeyError:
+        raise ValueError(f"Unsupported content type {content_type!r}")
+
+
+# Field types that are passed through as-is after a type check when
+# validating trusted messages. Other fields are deserialized normally.
+TYPE_CHECKS = (
+    (fields.String, str),
+    (fields.Boolean, bool),
+    (fields.Integer, int),
+    (fields.Number, (int, float)),
+    (fields.List, (list, tuple)),
+    (fields.Dict, dict),
+)
+
+
+def _load_default(field):
+    # marshmallow < 3.13 only has the 'missing' attribute
+    if hasattr(field, 'load_default'):
+        return field.load_default
+
+    return field.missing
+
+
+class Codec(object):
+    """Decoder and encoder for a message payload, prepared once for a
+    given schema. The schema may be None (plain JSON), a marshmallow
+    schema (instance or class) or a callable that converts the decoded
+    JSON value (e.g. int).
+
+    If trusted is set, schema validation is downgraded to checking the
+    presence and type of the declared fields. This is meant only for
+    topics where the messages are produced by other SMAUG controllers.
+
+    """
+
+    def __init__(self, schema=None, trusted=False):
+        if (isinstance(schema, type)
+                and issubclass(schema, marshmallow.Schema)):
+            schema = schema()
+
+        self.schema = schema
+        self.trusted = trusted
+
+        if schema is None:
+            self.convert = None
+        elif isinstance(schema, marshmallow.Schema):
+            self.convert = self._trusted_load if trusted else schema.load
+            self.fields = [self._compile_field(name, field)
+                           for name, field in schema.load_fields.items()]
+        else:
+            self.convert = schema
+
+    def _compile_field(self, name, field):
+        check = None
+
+        for field_cls, types in TYPE_CHECKS:
+            if isinstance(field, field_cls):
+                check = types
+                break
+
+        return (field.data_key or name, name, field, check,
+                field.required, _load_default(field))
+
+    def _trusted_load(self, raw):
+        if not isinstance(raw, dict):
+            raise ValidationError("Invalid input type", "_schema")
+
+        data = {}
+
+        for key, name, field, check, required, default in self.fields:
+            if key not in raw:
+                if required:
+                    raise ValidationError("Missing data for required field.",
+                                          key)
+                if default is not marshmallow.missing:
+                    data[name] = default() if callable(default) else default
+                continue
+
+            value = raw[key]
+
+            if value is None:
+                if not field.allow_none:
+                    raise ValidationError("Field may not be null.", key)
+                data[name] = None
+            elif check is None:
+                data[name] = field.deserialize(value, key, raw)
+            elif isinstance(value, check):
+                data[name] = value
+            else:
+                raise ValidationError(f"Invalid type {type(value)}", key)
+
+        return data
+
+    def decode(self, payload, content_type=JSON):
+        """Decode and validate a payload, raises ValidationError (or
+        ValueError for invalid or unsupported encoding)"""
+        # decoding errors of all backends are ValueErrors
+        raw = backend(content_type)[0](payload) if len(payload) else None
+
+        if self.convert is None:
+            return raw
+
+        return self.convert(raw)
+
+    def encode(self, data, content_type=JSON):
+        if isinstance(self.schema, marshmallow.Schema):
+            data = self.schema.dump(data)
+
+        return backend(content_type)[1](data)
+
+
+_codecs = {}
+
+
+def codec_for(schema=None, trusted=False):
+    """Return a shared Codec for the schema, use this instead of
+    constructing schemas for each message"""
+    key = (schema, trusted)
+
+    if key not in _codecs:
+        _codecs[key] = Codec(schema, trusted)
+
+    return _codecs[key]
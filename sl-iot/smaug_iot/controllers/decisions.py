@@ -0,0 +1,301 @@
+import asyncio
+import collections
+import hashlib
+import heapq
+import logging
+import time
+from datetime import datetime
+import pytz
+
+
+def token_digest(token):
+    """Cache key of a token, so that tokens themselves are not kept"""
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+
+class DecisionCache(object):
+    """LRU cache of token check results (valid, allowed_actions, expires)
+    keyed by token digest. Valid tokens are cached until they expire,
+    but at most max_ttl seconds, and denials for negative_ttl seconds.
+    The cache is bounded both by the number of entries and by their
+    estimated size in bytes, and the least recently used entries are
+    evicted first.
+
+    Valid decisions are kept for max_stale seconds past their cache
+    lifetime, unless the token has expired, so that get_stale can
+    return them when the token cannot be checked.
+
+    """
+
+    # rough per entry size of the key, tuples and ordered dict node
+    ENTRY_OVERHEAD = 300
+
+    def __init__(self, max_entries=10000, max_bytes=4 * 1024 * 1024,
+                 max_ttl=300, negative_ttl=5, max_stale=0):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.max_stale = max_stale
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_hits = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, token):
+        """Return the cached decision for the token or None"""
+        key = token_digest(token)
+        entry = self.entries.get(key)
+
+        if entry is not None:
+            deadline, size, decision = entry
+
+            if deadline > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return decision
+
+            if not self.usable_stale(deadline, decision):
+                self._remove(key)
+
+        self.misses += 1
+        return None
+
+    def get_stale(self, token):
+        """Return the cached valid decision for the token if it is at
+        most max_stale seconds past its cache lifetime, or None"""
+        key = token_digest(token)
+        entry = self.entries.get(key)
+
+        if entry is None:
+            return None
+
+        deadline, size, decision = entry
+
+        if not self.usable_stale(deadline, decision):
+            return None
+
+        self.stale_hits += 1
+        return decision
+
+    def usable_stale(self, deadline, decision):
+        valid, allowed_actions, expires = decision
+
+        return (valid
+                and time.monotonic() < deadline + self.max_stale
+                and (expires is None
+                     or expires > datetime.now(tz=pytz.utc)))
+
+    def put(self, token, decision):
+        valid, allowed_actions, expires = decision
+
+        if valid:
+            ttl = self.max_ttl
+
+            if expires is not None:
+                ttl = min(ttl, (expires
+                                - datetime.now(tz=pytz.utc)).total_seconds())
+        else:
+            ttl = self.negative_ttl
+
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+
+        key = token_digest(token)
+        size = self.ENTRY_OVERHEAD + sum(len(a) for a in allowed_actions)
+
+        if key in self.entries:
+            self._remove(key)
+
+        self.entries[key] = (time.monotonic() + ttl, size, decision)
+        self.bytes += size
+
+        while (len(self.entries) > self.max_entries
+               or self.bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def invalidate(self, token=None):
+        """Forget the decision for the token, or all decisions"""
+        if token is None:
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.bytes = 0
+        elif token_digest(token) in self.entries:
+            self.invalidations += 1
+            self._remove(token_digest(token))
+
+    def _remove(self, key):
+        deadline, size, decision = self.entries.pop(key)
+        self.bytes -= size
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "stale_hits": self.stale_hits,
+        }
+
+
+class TokenAllowlist(object):
+    """Tokens provisioned before their first use, keyed by token digest
+    with their allowed actions, expiry (a UNIX timestamp) and optional
+    token id. At most max_entries are kept; when full, the entries that
+    expire first are evicted. Expired entries are dropped when looked
+    up and when adding.
+
+    Entries are kept compact for large allowlists: equal action tuples
+    are shared, and expiry order is kept in a heap of (expires, digest)
+    that shares the digests with the dict. Replaced and removed entries
+    leave their heap items behind until they reach the top or the heap
+    is rebuilt.
+
+    """
+
+    def __init__(self, max_entries=100000):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.max_entries = max_entries
+        # digest -> (expires, allowed_actions, jti)
+        self.entries = {}
+        self.expiry = []
+        self.actions = {}
+        self.provisioned = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, digest, allowed_actions, expires, jti=None):
+        now = time.time()
+
+        if expires <= now or self.max_entries <= 0:
+            return
+
+        allowed_actions = tuple(allowed_actions)
+        allowed_actions = self.actions.setdefault(allowed_actions,
+                                                  allowed_actions)
+        self.entries[digest] = (expires, allowed_actions, jti)
+        heapq.heappush(self.expiry, (expires, digest))
+        self.provisioned += 1
+
+        self.expire(now)
+
+        while len(self.entries) > self.max_entries:
+            if self._pop():
+                self.evictions += 1
+
+        if len(self.expiry) > 2 * len(self.entries) + 64:
+            self.expiry = [(entry[0], digest)
+                           for digest, entry in self.entries.items()]
+            heapq.heapify(self.expiry)
+
+    def get(self, token):
+        """Return (allowed_actions, expires, jti) of the token if it is
+        provisioned and has not expired, or None"""
+        digest = token_digest(token)
+        entry = self.entries.get(digest)
+
+        if entry is not None:
+            if entry[0] > time.time():
+                self.hits += 1
+                return entry[1], entry[0], entry[2]
+
+            del self.entries[digest]
+            self.expired += 1
+
+        self.misses += 1
+        return None
+
+    def remove(self, digest):
+        self.entries.pop(digest, None)
+
+    def expire(self, now=None):
+        """Drop the entries that have expired"""
+        now = time.time() if now is None else now
+
+        while self.expiry and self.expiry[0][0] <= now:
+            if self._pop():
+                self.expired += 1
+
+    def _pop(self):
+        """Remove the entry expiring first, returns False if the heap
+        item was for a replaced or removed entry"""
+        expires, digest = heapq.heappop(self.expiry)
+        entry = self.entries.get(digest)
+
+        if entry is None or entry[0] != expires:
+            return False
+
+        del self.entries[digest]
+        return True
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "provisioned": self.provisioned,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expired": self.expired,
+        }
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls with the same key: while a call is in
+    flight, further calls with its key wait for and return its result
+    (or raise its exception) instead of making calls of their own. The
+    call is shielded, so cancelling a caller does not cancel it for the
+    others."""
+
+    def __init__(self):
+        self.flights = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def run(self, key, fn, *args):
+        future = self.flights.get(key)
+
+        if future is None:
+            self.calls += 1
+            future = asyncio.ensure_future(fn(*args))
+            self.flights[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(future)
+
+    def _done(self, key, future):
+        del self.flights[key]
+
+        # all callers may have been cancelled, avoid warnings about
+        # unretrieved exceptions
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self):
+        return {
+            "in_flight": len(self.flights),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,199 @@
+import asyncio
+import logging
+
+
+class TopicTrie(object):
+    """Maps MQTT topic filters, which may contain the `+` and `#`
+    wildcards, to values. Matching a topic name walks the trie one level
+    at a time, so the cost depends on the topic depth and not on the
+    number of filters.
+
+    """
+
+    class Node(object):
+        __slots__ = ('children', 'values')
+
+        def __init__(self):
+            self.children = {}
+            self.values = []
+
+    def __init__(self):
+        self.root = TopicTrie.Node()
+
+    def insert(self, topic_filter, value):
+        node = self.root
+
+        for level in topic_filter.split('/'):
+            node = node.children.setdefault(level, TopicTrie.Node())
+
+        node.values.append(value)
+
+    def remove(self, topic_filter, value):
+        node = self.root
+
+        for level in topic_filter.split('/'):
+            node = node.children.get(level)
+
+            if node is None:
+                return
+
+        if value in node.values:
+            node.values.remove(value)
+
+    def match(self, topic):
+        """Return values of all filters matching the topic name"""
+        levels = topic.split('/')
+        result = []
+
+        # per MQTT spec, wildcards on the first level do not match
+        # topics starting with $ (e.g. $SYS)
+        wildcards = not topic.startswith('$')
+        self._match(self.root, levels, 0, wildcards, result)
+
+        return result
+
+    def _match(self, node, levels, index, wildcards, result):
+        children = node.children
+
+        if wildcards and '#' in children:
+            # "a/#" also matches "a"
+            result.extend(children['#'].values)
+
+        if index == len(levels):
+            result.extend(node.values)
+            return
+
+        child = children.get(levels[index])
+
+        if child is not None:
+            self._match(child, levels, index + 1, True, result)
+
+        if wildcards and '+' in children:
+            self._match(children['+'], levels, index + 1, True, result)
+
+
+class Route(object):
+    """A single subscription: the controller topic, the actual (prefixed)
+    topic filter, subscription identifier and the tuple of handlers.
+    The priority and concurrency limit of the route are the strictest
+    ones declared by its handlers (see handler). The route has a share
+    group only if all its handlers declare the same one, as otherwise
+    some handlers would miss messages."""
+
+    __slots__ = ('topic', 'topic_filter', 'subid', 'handlers', 'sub',
+                 'priority', 'limit', 'share', 'queue')
+
+    def __init__(self, topic, topic_filter, subid):
+        self.topic = topic
+        self.topic_filter = topic_filter
+        self.subid = subid
+        self.handlers = ()
+        self.sub = None
+        self.priority = None
+        self.limit = None
+        self.share = None
+        self.queue = None
+
+    def add(self, fn):
+        self.handlers += (fn,)
+        share = getattr(fn, 'share', None)
+
+        if len(self.handlers) == 1:
+            self.share = share
+        elif share != self.share:
+            self.share = None
+
+        priority = getattr(fn, 'priority', None)
+        limit = getattr(fn, 'concurrency', None)
+
+        if priority is not None:
+            self.priority = (priority if self.priority is None
+                             else min(self.priority, priority))
+
+        if limit is not None:
+            self.limit = limit if self.limit is None else min(self.limit,
+                                                              limit)
+
+    def __repr__(self):
+        return (f"Route<{self.topic_filter!r} subid={self.subid} "
+                f"share={self.share} handlers={len(self.handlers)}>")
+
+
+class Dispatcher(object):
+    """Dispatches incoming messages to handlers. Messages carrying MQTT 5
+    subscription identifiers are looked up directly by identifier,
+    otherwise the topic name is matched against the subscribed topic
+    filters.
+
+    """
+
+    def __init__(self, prefix=''):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.prefix = prefix
+        self.routes = {}
+        self.by_subid = {}
+        self.trie = TopicTrie()
+
+    def add(self, topic, fn):
+        route = self.routes.get(topic)
+
+        if route is None:
+            route = Route(topic, self.prefix + topic, len(self.routes) + 1)
+            self.routes[topic] = route
+            self.trie.insert(route.topic_filter, route)
+
+        route.add(fn)
+        self.by_subid[route.subid] = route
+
+        return route
+
+    def __iter__(self):
+        return iter(self.routes.values())
+
+    def __len__(self):
+        return len(self.routes)
+
+    def routes_for(self, topic, properties):
+        subids = properties.get('subscription_identifier')
+
+        if subids:
+            return [self.by_subid[subid]
+                    for subid in subids if subid in self.by_subid]
+
+        return self.trie.match(topic)
+
+    def handlers(self, topic, properties):
+        routes = self.routes_for(topic, properties)
+
+        if len(routes) == 1:
+            return routes[0].handlers
+
+        return tuple(fn for route in routes for fn in route.handlers)
+
+    async def run(self, handlers, topic, payload, properties):
+        if len(handlers) == 1:
+            # common case, no need to create tasks
+            try:
+                await handlers[0](payload, properties)
+            except Exception:
+                self.log.exception("handler %r failed for topic %r",
+                                   handlers[0], topic)
+        elif handlers:
+            results = await asyncio.gather(
+                *(fn(payload, properties) for fn in handlers),
+                return_exceptions=True)
+
+            for fn, result in zip(handlers, results):
+                if isinstance(result, Exception):
+                    self.log.error("handler %r failed for topic %r",
+                                   fn, topic, exc_info=result)
+        else:
+            self.log.debug("no handlers for topic %r properties %r",
+                           topic, properties)
+
+    async def dispatch(self, topic, payload, properties):
+        """Run all handlers for the message, returns the number of
+        handlers"""
+        handlers = self.handlers(topic, properties)
+        await self.run(handlers, topic, payload, properties)
+        return len(handlers)
@@ -0,0 +1,455 @@
+"""Locker fleet simulator: runs N virtual lockers, each a lock controller
+and a load generator under its own topic prefix with its own MQTT
+connection, and reports end-to-end latencies of access checks, lock
+commands and state queries, MQTT message rates and CPU usage. Large
+fleets are split into shards run in separate processes.
+
+The access checks need an access controller serving all lockers, e.g.
+access-controller --mock --prefix '/fleet/+', or give --access to run
+a mock access controller in its own process. With --access-processes N
+the requests are split between N access controllers with a shared
+subscription (the broker must support MQTT 5 shared subscriptions),
+and --access-cost and --access-latency make the token checks take CPU
+time or wait like an IAA request, to measure how the access path
+scales.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .abstract import Controller, MultiController, RpcError
+from .access import AccessSchema, MockAccessController
+from .codec import FORMATS
+from .lock import AbstractLockController
+from .main import Main, parse_host
+from .metrics import Histogram
+from .state import LOCK_STATE_TOPIC
+
+POISSON = 'poisson'
+UNIFORM = 'uniform'
+
+KINDS = ('access', 'lock', 'state')
+
+
+class SimulatedLockController(AbstractLockController):
+    """Lock controller keeping its state in memory, without output"""
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.locked = None
+
+    def enable_lock(self):
+        self.locked = True
+
+    def disable_lock(self):
+        self.locked = False
+
+    def is_locked(self):
+        return self.locked
+
+
+class FleetAccessController(MockAccessController):
+    """Mock access controller whose token checks use --access-cost
+    seconds of CPU time and then wait --access-latency seconds"""
+
+    @classmethod
+    def augment_parser(cls, parser):
+        super().augment_parser(parser)
+        parser.add_argument('--access-cost', type=float, default=0)
+        parser.add_argument('--access-latency', type=float, default=0)
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.cost = args.access_cost
+        self.latency = args.access_latency
+
+    async def check_token(self, token):
+        end = time.process_time() + self.cost
+
+        while time.process_time() < end:
+            pass
+
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+        return await super().check_token(token)
+
+
+class LoadController(Controller):
+    """Generates the requests of one virtual locker with independent
+    arrival processes per request kind, and measures the time to their
+    response: the access response, the /lock/status update following a
+    lock command, or the /lock/state response. Lock commands alternate
+    between locking and unlocking, and one is in flight at a time."""
+
+    @classmethod
+    def augment_parser(cls, parser):
+        parser.add_argument('--access-rate', type=float, default=1,
+                            help="Access checks per second (default: 1)")
+        parser.add_argument('--lock-rate', type=float, default=0.1,
+                            help="Lock commands per second (default: 0.1)")
+        parser.add_argument('--state-rate', type=float, default=0.5,
+                            help="State queries per second (default: 0.5)")
+        parser.add_argument('--arrival', choices=(POISSON, UNIFORM),
+                            default=POISSON,
+                            help=("Request arrival process, exponential or "
+                                  "constant intervals (default: poisson)"))
+        parser.add_argument('--token', default="1;all;9999",
+                            help="Token to check (default: 1;all;9999)")
+        parser.add_argument('--timeout', type=float, default=10,
+                            help="Request timeout in seconds (default: 10)")
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.rates = {'access': args.access_rate,
+                      'lock': args.lock_rate,
+                      'state': args.state_rate}
+        self.arrival = args.arrival
+        self.token = args.token
+        self.timeout = args.timeout
+        self.rpc = self.create_rpc_client(args.timeout)
+        self.lock_state = self.create_state_cache(LOCK_STATE_TOPIC, int)
+        self.locking = False
+        self.latency = {kind: Histogram() for kind in KINDS}
+        self.failures = {kind: 0 for kind in KINDS}
+        self.skipped = 0
+        self.tasks = set()
+
+    def initialize(self):
+        requests = {'access': self.access,
+                    'lock': self.lock,
+                    'state': self.state}
+
+        for kind, rate in self.rates.items():
+            if rate > 0:
+                self.spawn(self.generate(kind, rate, requests[kind]))
+
+    def uninitialize(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def interval(self, rate):
+        if self.arrival == POISSON:
+            return random.expovariate(rate)
+
+        return 1 / rate
+
+    async def generate(self, kind, rate, request):
+        # start at a random phase, so lockers do not run in step
+        await asyncio.sleep(random.uniform(0, 1 / rate))
+
+        while True:
+            self.spawn(self.measure(kind, request))
+            await asyncio.sleep(self.interval(rate))
+
+    async def measure(self, kind, request):
+        start = time.monotonic()
+
+        try:
+            if await request() is False:
+                return
+        except (asyncio.TimeoutError, RpcError):
+            self.failures[kind] += 1
+            return
+
+        self.latency[kind].observe(time.monotonic() - start)
+
+    async def access(self):
+        await self.rpc.call("/access",
+                            {"token": self.token, "actions": ["unlock"]},
+                            AccessSchema)
+
+    async def state(self):
+        await self.rpc.call("/lock/state", response_schema=int)
+
+    async def lock(self):
+        if self.locking or not self.lock_state.known:
+            self.skipped += 1
+            return False
+
+        self.locking = True
+        locked = 0 if self.lock_state.get() else 1
+        deadline = time.monotonic() + self.timeout
+        changed = asyncio.ensure_future(self.lock_state.changed())
+
+        try:
+            self.publish_data("/lock", locked)
+
+            while await asyncio.wait_for(
+                    changed, deadline - time.monotonic()) != locked:
+                changed = asyncio.ensure_future(self.lock_state.changed())
+        finally:
+            changed.cancel()
+            self.locking = False
+
+
+def locker_argv(args, i):
+    """Command line of the Main of locker i"""
+    return ['--quiet',
+            '--server', f"{args.server[0]}:{args.server[1]}",
+            '--mqtt-client-id', f"{args.client_id}-{i}",
+            '--prefix', f"{args.prefix}/{i}",
+            '--access-rate', str(args.access_rate),
+            '--lock-rate', str(args.lock_rate),
+            '--state-rate', str(args.state_rate),
+            '--arrival', args.arrival,
+            '--token', args.token,
+            '--timeout', str(args.timeout),
+            '--payload-format', args.payload_format]
+
+
+def access_argv(args, index):
+    """Command line of the Main of access controller index"""
+    argv = ['--quiet',
+            '--server', f"{args.server[0]}:{args.server[1]}",
+            '--mqtt-client-id', f"{args.client_id}-access-{index}",
+            '--prefix', f"{args.prefix}/+",
+            '--access-cost', str(args.access_cost),
+            '--access-latency', str(args.access_latency)]
+
+    if args.access_processes > 1:
+        argv += ['--share-group', f"{args.client_id}-access"]
+
+    if args.access_cost > 0 or args.access_latency > 0:
+        # all lockers use the same token, every request should be checked
+        argv += ['--cache-entries', '0']
+
+    return argv
+
+
+def shard_result(mains, cpu, elapsed):
+    """Collect the measurements of the lockers of a shard"""
+    result = {
+        'latency': {kind: Histogram() for kind in KINDS},
+        'failures': {kind: 0 for kind in KINDS},
+        'skipped': 0,
+        'received': 0,
+        'published': 0,
+        'connected': 0,
+        'cpu': cpu,
+        'elapsed': elapsed,
+    }
+
+    for main in mains:
+        result['received'] += main.received
+        result['published'] += main.published
+
+        if not hasattr(main, 'controller'):
+            continue
+
+        load = main.controller.controllers[1]
+        result['connected'] += 1 if load.lock_state.known else 0
+        result['skipped'] += load.skipped
+
+        for kind in KINDS:
+            result['latency'][kind].merge(load.latency[kind])
+            result['failures'][kind] += load.failures[kind]
+
+    return result
+
+
+def merge(results):
+    """Merge the shard results, the shards run side by side so the
+    elapsed time is the longest one and the rest add up"""
+    total = shard_result([], sum(result['cpu'] for result in results),
+                         max(result['elapsed'] for result in results))
+
+    for result in results:
+        for kind in KINDS:
+            total['latency'][kind].merge(result['latency'][kind])
+            total['failures'][kind] += result['failures'][kind]
+
+        for name in ('skipped', 'received', 'published', 'connected'):
+            total[name] += result[name]
+
+    return total
+
+
+def split(args):
+    """Split the lockers into at most --processes shard jobs of
+    (args, first, count)"""
+    shards = []
+    size = -(-args.lockers // args.processes)
+
+    for first in range(0, args.lockers, size):
+        shards.append((args, first, min(size, args.lockers - first)))
+
+    return shards
+
+
+def run_shard(job):
+    """Run lockers first..first+count-1 for the duration and return the
+    merged measurements"""
+    args, first, count = job
+    logging.basicConfig(level=logging.ERROR)
+
+    async def run():
+        mains = []
+
+        for i in range(first, first + count):
+            main = Main(f"fleet-{i}",
+                        MultiController(SimulatedLockController,
+                                        LoadController))
+            mains.append((main, asyncio.ensure_future(
+                main.main(locker_argv(args, i)))))
+
+        await asyncio.sleep(args.duration)
+
+        for main, task in mains:
+            main.stop.set()
+
+        await asyncio.gather(*(task for main, task in mains),
+                             return_exceptions=True)
+
+        return mains
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.monotonic()
+    mains = asyncio.run(run())
+    elapsed = time.monotonic() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    return shard_result([main for main, task in mains],
+                        after.ru_utime - usage.ru_utime
+                        + after.ru_stime - usage.ru_stime,
+                        elapsed)
+
+
+def run_access(job):
+    """Run a mock access controller serving all lockers, returns its CPU
+    time and the number of requests it answered"""
+    args, index = job
+    logging.basicConfig(level=logging.ERROR)
+    main = Main("fleet-access", FleetAccessController)
+    argv = access_argv(args, index)
+
+    async def run():
+        task = asyncio.ensure_future(main.main(argv))
+        await asyncio.sleep(args.duration + 2)
+        main.stop.set()
+        await task
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    asyncio.run(run())
+    after = resource.getrusage(resource.RUSAGE_SELF)
+
+    return (after.ru_utime - usage.ru_utime
+            + after.ru_stime - usage.ru_stime,
+            main.received)
+
+
+def format_ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.1f}"
+
+
+def report(args, results, access):
+    total = merge(results)
+    latency = total['latency']
+    failures = total['failures']
+    elapsed = total['elapsed']
+    received = total['received']
+    published = total['published']
+    cpu = total['cpu']
+
+    print(f"{args.lockers} lockers in {len(results)} shards, "
+          f"{total['connected']} "
+          f"received their lock state")
+    print(f"{'request':<8} {'count':>8} {'failed':>7} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+
+    for kind in KINDS:
+        h = latency[kind]
+        print(f"{kind:<8} {h.count:8d} {failures[kind]:7d} "
+              f"{h.count / args.duration:8.1f} "
+              f"{format_ms(h.percentile(50)):>8} "
+              f"{format_ms(h.percentile(90)):>8} "
+              f"{format_ms(h.percentile(99)):>8} "
+              f"{format_ms(h.max if h.count else None):>8}")
+
+    skipped = total['skipped']
+
+    if skipped:
+        print(f"{skipped} lock commands skipped, previous one in flight "
+              f"or lock state not known")
+
+    print(f"messages: {published / elapsed:.0f} published/s, "
+          f"{received / elapsed:.0f} received/s")
+    print(f"locker CPU: {cpu:.1f} s ({100 * cpu / elapsed:.0f}% of one "
+          f"core, {1000 * cpu / args.lockers / elapsed:.2f} ms/s per "
+          f"locker)")
+
+    for index, (cpu, requests) in enumerate(access):
+        print(f"access controller {index}: {requests} requests, "
+              f"CPU {cpu:.1f} s ({100 * cpu / elapsed:.0f}% of one core)")
+
+
+def main():
+    parser = argparse.ArgumentParser('fleet-simulator',
+                                     description=__doc__.split('\n\n')[0])
+    parser.add_argument('--lockers', '-n', type=int, default=100,
+                        help="Number of virtual lockers (default: 100)")
+    parser.add_argument('--processes', '-j', type=int, default=1,
+                        help="Number of shard processes (default: 1)")
+    parser.add_argument('--duration', '-t', type=float, default=30,
+                        help="Seconds to run (default: 30)")
+    parser.add_argument('--mqtt-server', '--server', '-s',
+                        type=parse_host, dest='server',
+                        default=parse_host("localhost:1883"),
+                        help=("Address of the MQTT server "
+                              "(default: localhost:1883)"))
+    parser.add_argument('--mqtt-client-id', dest='client_id',
+                        default='fleet',
+                        help=("MQTT client id prefix, the locker number is "
+                              "appended (default: fleet)"))
+    parser.add_argument('--prefix', '-p', default='/fleet',
+                        help=("Topic prefix, the locker number is appended "
+                              "(default: /fleet)"))
+    parser.add_argument('--payload-format', choices=list(FORMATS),
+                        default='json',
+                        help="Encoding of published messages (default: json)")
+    parser.add_argument('--access', action='store_true', default=False,
+                        help=("Run a mock access controller for the fleet "
+                              "in a separate process"))
+    parser.add_argument('--access-processes', type=int, default=None,
+                        help=("Number of access controller processes "
+                              "sharing the requests, implies --access "
+                              "(default: 1)"))
+    parser.add_argument('--access-cost', type=float, default=0,
+                        help=("CPU seconds used by each token check of "
+                              "the access controllers (default: 0)"))
+    parser.add_argument('--access-latency', type=float, default=0,
+                        help=("Seconds each token check of the access "
+                              "controllers waits, like an IAA request "
+                              "(default: 0)"))
+    LoadController.augment_parser(parser)
+    args = parser.parse_args()
+    args.access = args.access or args.access_processes is not None
+    args.access_processes = args.access_processes or 1
+    accessors = args.access_processes if args.access else 0
+
+    shards = split(args)
+
+    with ProcessPoolExecutor(len(shards) + accessors) as pool:
+        access = [pool.submit(run_access, (args, index))
+                  for index in range(accessors)]
+
+        if access:
+            # let them subscribe before the lockers start
+            time.sleep(1)
+
+        results = list(pool.map(run_shard, shards))
+        access = [future.result() for future in access]
+
+    report(args, results, access)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import time
+import aiohttp
+from .metrics import Histogram
+
+
+class IaaError(Exception):
+    """The IAA server could not be asked or did not answer properly"""
+    pass
+
+
+class CircuitOpen(IaaError):
+    pass
+
+
+class CircuitBreaker(object):
+    """Stops calls to an unhealthy server: after threshold consecutive
+    failures the circuit opens and calls fail immediately. After
+    reset_timeout seconds a single trial call is let through (half
+    open), and its success closes the circuit again while a failure
+    opens it for another reset_timeout. A threshold of 0 disables the
+    breaker."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.opens = 0
+
+    def allow(self):
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened < self.reset_timeout:
+                return False
+
+            self.state = self.HALF_OPEN
+            self.trial = False
+
+        if self.state == self.HALF_OPEN:
+            if self.trial:
+                return False
+
+            self.trial = True
+
+        return True
+
+    def success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trial = False
+
+    def abandon(self):
+        """The call allowed last was not completed"""
+        self.trial = False
+
+    def failure(self):
+        self.failures += 1
+
+        if self.threshold <= 0:
+            return
+
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            self.state = self.OPEN
+            self.opened = time.monotonic()
+            self.opens += 1
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opens": self.opens,
+        }
+
+
+class IaaClient(object):
+    """Client of the IAA token validation endpoint, using a pool of
+    keep-alive connections. Each check has a deadline of timeout
+    seconds, during which up to attempts requests are made: a new one
+    when the previous failed, or when none has answered within
+    hedge_delay seconds (0 disables hedging), and the first answer
+    wins. Failed checks are counted by a CircuitBreaker. The latency
+    of each request, answered or not, is measured.
+
+    """
+
+    def __init__(self, url, pool_size=10, keepalive=30, timeout=2,
+                 attempts=2, hedge_delay=0.5, breaker=None):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.url = url
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.attempts = max(1, attempts)
+        self.hedge_delay = hedge_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.session = None
+        self.latency = Histogram()
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def get_session(self):
+        if self.session is None:
+            # created on first use, as it must be created in the loop
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.pool_size,
+                    keepalive_timeout=self.keepalive),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def check(self, token):
+        """Return True if the IAA accepts the token and False if it
+        rejects it, raises IaaError if it cannot tell (CircuitOpen when
+        the circuit breaker is open)"""
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpen("IAA circuit breaker is open")
+
+        try:
+            status = await asyncio.wait_for(self.hedged(token),
+                                            self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.breaker.failure()
+            raise IaaError(f"No response within {self.timeout} seconds")
+        except IaaError:
+            self.breaker.failure()
+            raise
+        except asyncio.CancelledError:
+            self.breaker.abandon()
+            raise
+
+        self.breaker.success()
+
+        return status == 200
+
+    async def hedged(self, token):
+        pending = set()
+        launched = 0
+        error = None
+        launch = True
+
+        try:
+            while True:
+                if launch and launched < self.attempts:
+                    pending.add(asyncio.ensure_future(self.request(token)))
+                    launched += 1
+
+                if not pending:
+                    raise error
+
+                hedge = (self.hedge_delay
+                         if self.hedge_delay > 0 and launched < self.attempts
+                         else None)
+                done, pending = await asyncio.wait(
+                    pending, timeout=hedge,
+                    return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    try:
+                        return task.result()
+                    except IaaError as ex:
+                        error = ex
+
+                # retry when an attempt failed, hedge when the delay
+                # passed without an answer
+                launch = launched < self.attempts
+
+                if launch and done:
+                    self.retries += 1
+                elif launch:
+                    self.hedges += 1
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def request(self, token):
+        self.requests += 1
+        start = time.monotonic()
+        headers = {
+            "Authorization": "Bearer " + token
+        }
+
+        try:
+            async with self.get_session().get(
+                    self.url, headers=headers) as response:
+                self.log.debug("request: response: %s", response)
+
+                if response.status >= 500:
+                    raise IaaError(f"IAA server error {response.status}")
+
+                return response.status
+        except IaaError:
+            self.errors += 1
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+            self.errors += 1
+            raise IaaError(str(ex) or ex.__class__.__name__)
+        finally:
+            self.latency.observe(time.monotonic() - start)
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "retries": self.retries,
+            "rejected": self.rejected,
+            "breaker": self.breaker.stats(),
+            "latency": self.latency.snapshot(),
+        }
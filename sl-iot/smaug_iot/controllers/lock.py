@@ -1,6 +1,9 @@
 import abc
 import sys
 from .abstract import Controller, handler, Response
+from .actuation import ActuationQueue, AckSchema, LOCK_ACK_TOPIC
+from .scheduler import ACTUATION, QUERY
+from .state import LOCK_STATE_TOPIC
 try:
     wiringpi = None
     import wiringpi
@@ -9,9 +12,19 @@ except ImportError:
 
 
 class AbstractLockController(Controller):
+    """Lock commands on /lock go through an ActuationQueue: commands
+    that arrive while the lock is being actuated, or within
+    --min-actuation-interval seconds of the previous actuation, are
+    coalesced and only the last one is applied. The lock is not
+    actuated if it already is in the requested state. Every command is
+    acknowledged on /lock/ack (and to the response topic of the
+    command, if any) with the achieved state and actuation latency."""
+
     def __init__(self, args):
         super().__init__(args)
         self.start_locked = args.locked
+        self.actuation = ActuationQueue(self.set_locked, self.is_locked,
+                                        args.min_actuation_interval)
 
     @classmethod
     def augment_parser(cls, parser):
@@ -21,29 +34,49 @@ class AbstractLockController(Controller):
         parser.add_argument("--start-unlocked", action='store_false',
                             dest='locked',
                             help="Start in unlocked state")
+        parser.add_argument("--min-actuation-interval", type=float,
+                            default=0,
+                            help=("Minimum seconds between actuations of "
+                                  "the lock, commands arriving meanwhile "
+                                  "are coalesced (default: 0)"))
 
     def initialize(self):
         self.log.debug("initialize: locked=%s", self.start_locked)
+        self.set_locked(self.start_locked, force=True)
+
+    def set_locked(self, locked, force=False):
+        """Lock or unlock, and publish the new state on the retained state
+        topic if it changed"""
+        was_locked = self.is_locked()
 
-        if self.start_locked:
+        if locked:
             self.enable_lock()
         else:
             self.disable_lock()
 
-    @handler("/lock", int)
-    async def received(self, lock: int):
-        self.log.debug("received: lock=%d", lock)
+        if force or bool(self.is_locked()) != bool(was_locked):
+            self.publish_data(LOCK_STATE_TOPIC, 1 if self.is_locked() else 0,
+                              retain=True)
 
-        if lock:
-            self.enable_lock()
-        else:
-            self.disable_lock()
+    @handler("/lock", int, AckSchema(), priority=ACTUATION,
+             optional_response=True)
+    async def received(self, lock: int):
+        self.log.debug("received: lock=%d depth=%d", lock,
+                       self.actuation.depth)
+        ack = await self.actuation.submit(lock)
+        self.publish_data(LOCK_ACK_TOPIC, ack, AckSchema)
+        return Response(ack)
 
-    @handler("/lock/state")
+    @handler("/lock/state", priority=QUERY)
     async def received_state(self):
         self.log.debug("received state query, return: %r", self.is_locked())
         return Response(1 if self.is_locked() else 0)
 
+    def stats(self):
+        stats = super().stats()
+        stats["actuation"] = self.actuation.stats()
+        return stats
+
     @abc.abstractmethod
     def enable_lock(self):
         ...
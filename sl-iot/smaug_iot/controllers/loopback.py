@@ -0,0 +1,92 @@
+import logging
+import json
+
+
+def to_payload(payload):
+    """Convert a publish payload to bytes the same way gmqtt does"""
+    if isinstance(payload, (list, tuple, dict)):
+        payload = json.dumps(payload, ensure_ascii=False)
+
+    if isinstance(payload, (int, float)):
+        return str(payload).encode('ascii')
+    if isinstance(payload, str):
+        return payload.encode('utf-8', errors='replace')
+    if payload is None:
+        return b''
+
+    return bytes(payload)
+
+
+def to_properties(kwargs):
+    """Convert publish keyword arguments to properties as received from
+    gmqtt, e.g. response_topic="x" -> {'response_topic': ['x']}"""
+    return {name: [value]
+            for name, value in kwargs.items()
+            if name not in ('qos', 'retain')}
+
+
+class Loopback(object):
+    """Delivers messages published by co-hosted controllers directly to
+    the handlers of the controllers in the same process. Messages
+    without local subscribers are passed to the broker publisher, and
+    with mirror set locally delivered messages are also sent to the
+    broker. Retained messages are always sent to the broker too, as
+    they carry state for other (later) subscribers.
+
+    Local messages are submitted to the Scheduler of Main like messages
+    received from the broker, so they are subject to the priority,
+    queue bound and concurrency limit of their topic.
+
+    The broker subscriptions must use the MQTT 5 no local option, so
+    that mirrored (or otherwise published) messages are not delivered a
+    second time through the broker. Shared subscriptions cannot use it,
+    so messages to routes for which shared(route) is true are not
+    mirrored, and if sent to the broker anyway (retained) they are left
+    to the broker to deliver.
+
+    Topics are matched as published, with the prefix of Main, so
+    absolute topics (e.g. responses to requests received through the
+    broker) are delivered locally only if a handler subscribed to that
+    exact topic, such as the RpcClient of a co-hosted controller.
+
+    """
+
+    def __init__(self, dispatcher, scheduler, publisher, mirror=False,
+                 shared=lambda route: False):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.dispatcher = dispatcher
+        self.scheduler = scheduler
+        self.publisher = publisher
+        self.mirror = mirror
+        self.shared = shared
+        self.local = 0
+        self.remote = 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False, **kwargs):
+        routes = self.dispatcher.trie.match(topic)
+        shared = [route for route in routes if self.shared(route)]
+        forward = not routes or retain or (self.mirror and not shared)
+
+        if forward and shared:
+            # the broker delivers these back to us
+            routes = [route for route in routes if route not in shared]
+
+        if routes:
+            self.local += 1
+            self.log.debug("loopback: topic=%r routes=%r", topic, routes)
+            data = to_payload(payload)
+            properties = to_properties(kwargs)
+
+            for route in routes:
+                self.scheduler.submit(route.queue, self.dispatcher.run,
+                                      route.handlers, topic, data,
+                                      properties)
+
+        if forward:
+            self.remote += 1
+            self.publisher(topic, payload, qos=qos, retain=retain, **kwargs)
+
+    __call__ = publish
+
+    def stats(self):
+        return {"local": self.local, "remote": self.remote}
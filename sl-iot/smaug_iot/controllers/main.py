@@ -5,8 +5,34 @@ import sys
 import signal
 import json
 import logging
+import time
 from marshmallow import Schema, fields, post_load
 import argparse
+from .dispatch import Dispatcher
+from .loopback import Loopback
+from .codec import FORMATS
+from .scheduler import Scheduler, NORMAL, DROP, DROP_OLDEST
+from .offline import Backoff, OfflineQueue, DiskOfflineQueue
+from .replay import Recorder, ReplayClient, RECEIVED, PUBLISHED
+
+
+# gmqtt reconnects on its own with a fixed delay unless the number of
+# allowed reconnects is below the count of failed attempts, this turns
+# it off as Main reconnects with backoff
+NO_RECONNECTS = -2
+
+
+class ReconnectErrorFilter(logging.Filter):
+    """With its reconnects turned off gmqtt logs "max number of failed
+    connection attempts achieved" at ERROR level on every disconnect,
+    although Main reconnects as intended, this drops that record"""
+
+    def filter(self, record):
+        return "max number of failed connection attempts" not in \
+            record.getMessage()
+
+
+RECONNECT_ERROR_FILTER = ReconnectErrorFilter()
 
 
 def parse_host(s):
@@ -17,6 +43,20 @@ def parse_host(s):
     return s, 1883
 
 
+def parse_limit(s):
+    topic, limit = s.rsplit('=', 1)
+    return topic, int(limit)
+
+
+def format_ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.3f}"
+
+
+def parse_message(s):
+    topic, payload = s.split('=', 1)
+    return topic, payload.encode('utf-8')
+
+
 class Main(object):
     """Generic main handler taking in real controller and an optional mock
     controller class. The main handler (this one) handles generic common
@@ -34,6 +74,11 @@ class Main(object):
         self.mock_cls = mock_cls
         self.log = logging.getLogger(name)
         self.stop = asyncio.Event()
+        self.prefix = ''
+        self.received = 0
+        self.published = 0
+        self.skipped = set()
+        self.loopback = None
 
     def get_parser(self):
         parser = argparse.ArgumentParser(self.name,
@@ -60,10 +105,79 @@ class Main(object):
                 dest='use_mock', help="Use the real implementation (default)")
         parser.add_argument(
             '--prefix', '-p', type=str, default='',
-            help="Subscription address prefix (default: '')")
+            help=("Topic prefix of subscriptions and published messages, "
+                  "may contain wildcards if the controller only responds "
+                  "to requests, other messages are then not published "
+                  "(default: '')"))
+        parser.add_argument(
+            '--shared', action='store_true', default=False,
+            help=("Subscribe to the topics of handlers that declare a "
+                  "share group with MQTT 5 shared subscriptions, so that "
+                  "several instances split the requests"))
+        parser.add_argument(
+            '--share-group', type=str, default=None,
+            help=("Use this share group instead of the ones declared by "
+                  "the handlers, implies --shared"))
+        parser.add_argument(
+            '--payload-format', choices=list(FORMATS), default='json',
+            help=("Encoding of published messages, sent as the MQTT 5 "
+                  "content type (default: json)"))
+        parser.add_argument(
+            '--max-handlers', type=int, default=32,
+            help=("Maximum number of messages handled concurrently "
+                  "(default: 32)"))
+        parser.add_argument(
+            '--queue-size', type=int, default=100,
+            help=("Maximum number of messages waiting per topic "
+                  "(default: 100)"))
+        parser.add_argument(
+            '--overflow', choices=(DROP, DROP_OLDEST), default=DROP_OLDEST,
+            help=("What to drop when a topic queue is full, the incoming "
+                  "or the oldest message (default: drop-oldest)"))
+        parser.add_argument(
+            '--concurrency', default=[], action='append', type=parse_limit,
+            metavar='TOPIC=N',
+            help=("Override the concurrency limit of a topic, may be "
+                  "given more than once"))
+        parser.add_argument(
+            '--stats-interval', type=float, default=0,
+            help=("Log runtime statistics every N seconds "
+                  "(default: 0, disabled)"))
+        parser.add_argument(
+            '--reconnect-min', type=float, default=1,
+            help=("Initial upper bound of the randomized reconnect delay "
+                  "in seconds, doubled on each failed attempt "
+                  "(default: 1)"))
         parser.add_argument(
-            '--inject-message', '-i', default=[], action='append', type=str,
-            help="Inject messages to the client")
+            '--reconnect-max', type=float, default=60,
+            help="Maximum reconnect delay in seconds (default: 60)")
+        parser.add_argument(
+            '--offline-queue-size', type=int, default=1000,
+            help=("Maximum number of messages published while "
+                  "disconnected that are kept and sent on reconnect "
+                  "(default: 1000)"))
+        parser.add_argument(
+            '--offline-queue-file', type=str, default=None,
+            help=("Keep the offline messages in this SQLite file, so they "
+                  "are also kept over restarts (default: in memory)"))
+        parser.add_argument(
+            '--inject-message', '-i', default=[], action='append',
+            type=parse_message, metavar='TOPIC=PAYLOAD',
+            help=("Handle the message as if received from the MQTT "
+                  "server, may be given more than once"))
+        parser.add_argument(
+            '--record', type=str, default=None, metavar='FILE',
+            help=("Record received and published messages to FILE "
+                  "(compressed if it ends in .gz)"))
+        parser.add_argument(
+            '--replay', type=str, default=None, metavar='FILE',
+            help=("Replay the received messages of a recording to the "
+                  "controller without a MQTT server, report handler "
+                  "latencies and exit"))
+        parser.add_argument(
+            '--replay-speed', type=float, default=1,
+            help=("Replay speed relative to the recording, 0 for as fast "
+                  "as possible (default: 1)"))
         parser.add_argument(
             '--once', dest='run_once', default=False, action='store_true',
             help="Run only once, e.g. process incoming messages and then exit")
@@ -108,50 +222,211 @@ class Main(object):
         except KeyboardInterrupt:
             self.log.info("Exiting...")
 
-    def publish(self, topic, data=None, **kwargs):
+    def publish(self, topic, data=None, absolute=False, **kwargs):
+        """Publish to the topic under the prefix, or as is if absolute
+        (e.g. responses to the response topic of a request). The
+        response topic of requests is prefixed the same way.
+
+        Topics under a wildcard prefix are not valid topic names, so
+        only absolute topics are published then."""
+        if not absolute:
+            if '+' in self.prefix or '#' in self.prefix:
+                if topic not in self.skipped:
+                    self.skipped.add(topic)
+                    self.log.warning("Not publishing %r under the wildcard "
+                                     "prefix %r", topic, self.prefix)
+                return
+
+            topic = self.prefix + topic
+
+            if 'response_topic' in kwargs:
+                kwargs['response_topic'] = (self.prefix
+                                            + kwargs['response_topic'])
+
+        if self.loopback is not None:
+            self.loopback.publish(topic, data, **kwargs)
+        else:
+            self.send(topic, data, **kwargs)
+
+    def send(self, topic, data=None, **kwargs):
+        """Publish to the broker, or queue until connected"""
         self.log.debug("publishing: topic=%r data=%r kwargs=%r",
                        topic, data, kwargs)
-        self.client.publish(topic, data, **kwargs)
+        self.published += 1
+
+        if self.recorder is not None:
+            self.recorder.record(PUBLISHED, topic, data, kwargs)
+
+        # keep the order, queued messages go first
+        if len(self.offline) or not self.client.is_connected:
+            self.offline.put(topic, data, kwargs)
+        else:
+            self.client.publish(topic, data, **kwargs)
 
     def subscribe(self):
-        for topic, (fns, sub, subid) in self.subscriptions.items():
-            if sub is not None:
-                self.client.resubscribe(sub)
+        for route in self.dispatcher:
+            if route.sub is not None:
+                self.client.resubscribe(route.sub)
                 continue
 
-            sub = Subscription(self.prefix + topic)
+            group = self.share_group(route)
+
+            if group is not None:
+                # no local is not allowed on shared subscriptions
+                route.sub = Subscription(
+                    f"$share/{group}/{route.topic_filter}")
+            else:
+                route.sub = Subscription(
+                    route.topic_filter,
+                    no_local=getattr(self.controller, 'no_local', False))
+
+            self.client.subscribe(route.sub,
+                                  subscription_identifier=route.subid)
+
+            self.log.debug("subscribed: route=%r sub=%r mid=%r",
+                           route, route.sub, route.sub.mid)
 
-            self.subscriptions[topic] = (fns, sub, subid)
-            self.client.subscribe(sub, subscription_identifier=subid)
+    def share_group(self, route):
+        if route.share is None or not self.shared:
+            return None
 
-            self.log.debug("subscribed: topic=%r sub=%r subid=%r mid=%r",
-                           topic, sub, subid, sub.mid)
+        return self.share_override or route.share
 
     def on_connect(self, *args, **kwargs):
         self.log.debug(f"on_connect: self=%r args=%r kwargs=%r",
                        self, args, kwargs)
+        self.disconnected.clear()
         self.subscribe()
 
+        if len(self.offline):
+            count = self.offline.flush(
+                self.client.publish, lambda: self.client.is_connected)
+            self.log.info("sent %d messages queued while offline", count)
+
+    def on_disconnect(self, client, packet, exc=None):
+        if self.stop.is_set():
+            return
+
+        self.log.warning("Warning: Disconnected from the MQTT server")
+        self.disconnections += 1
+        self.disconnected.set()
+
+    async def connect(self, server, retry=False):
+        """Connect to the MQTT server, retrying with exponential backoff
+        and jitter. With retry set, the first attempt is delayed too.
+        Returns False if stopped before connecting."""
+        while not self.stop.is_set():
+            if retry:
+                delay = self.backoff.delay()
+                self.log.info("Connecting to %s:%d in %.1f seconds",
+                              *server, delay)
+
+                # wait either until stop is set, or for the delay
+                try:
+                    await asyncio.wait_for(self.stop.wait(), delay)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+
+            retry = True
+
+            try:
+                await self.client.connect(*server, keepalive=60)
+                self.backoff.reset()
+                return True
+            except OSError:
+                self.log.warning(
+                    "Warning: Unable to connect to %s:%d, retrying...",
+                    *server)
+
+        return False
+
+    async def wait_disconnect(self):
+        """Wait until stopped or disconnected, returns False if
+        stopped"""
+        waiters = [asyncio.ensure_future(self.stop.wait()),
+                   asyncio.ensure_future(self.disconnected.wait())]
+
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+        return not self.stop.is_set()
+
     async def on_message(self, client, topic, payload, qos, properties):
         self.log.debug("on_message: client=%r topic=%r payload=%r "
                        "qos=%r properties=%r",
                        client, topic, payload, qos, properties)
 
-        # look for matching handler and call it
-        for subid in properties['subscription_identifier']:
-            for topic, (fns, sub, subid2) in self.subscriptions.items():
-                if subid == subid2:
-                    self.log.debug("subid=%r match, fns=%r", subid, fns)
-                    await asyncio.wait([fn(payload, properties) for fn in fns])
+        self.received += 1
+
+        if self.recorder is not None:
+            self.recorder.record(RECEIVED, topic, payload, properties)
+
+        for route in self.dispatcher.routes_for(topic, properties):
+            self.scheduler.submit(route.queue, self.dispatcher.run,
+                                  route.handlers, topic, payload, properties)
 
         return 0
 
-    async def main(self):
+    def stats(self):
+        stats = {f"queue {name}": value
+                 for name, value in self.scheduler.stats().items()}
+
+        stats["offline"] = self.offline.stats()
+        stats["connection"] = {"connected": self.client.is_connected,
+                               "disconnections": self.disconnections,
+                               "received": self.received,
+                               "published": self.published}
+
+        if self.loopback is not None:
+            stats["loopback"] = self.loopback.stats()
+
+        if hasattr(self.controller, 'stats'):
+            stats.update(self.controller.stats())
+
+        return stats
+
+    async def replay(self, path, speed):
+        start = time.monotonic()
+        count = await self.client.replay(path, speed,
+                                         self.scheduler.wait_for_room)
+        await self.scheduler.join()
+        elapsed = time.monotonic() - start
+
+        self.log.info("replayed %d messages in %.3f seconds (%.0f msg/s), "
+                      "%d published", count, elapsed,
+                      count / elapsed if elapsed else 0,
+                      self.client.published)
+
+        for tq in self.scheduler.queues:
+            if not tq.handled and not tq.dropped:
+                continue
+
+            latency = tq.latency
+            self.log.info("%s: handled %d dropped %d, latency ms "
+                          "p50 %s p90 %s p99 %s max %.3f",
+                          tq.name, tq.handled, tq.dropped,
+                          *(format_ms(latency.percentile(p))
+                            for p in (50, 90, 99)),
+                          latency.max * 1000)
+
+    async def log_stats(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+
+            for name, value in self.stats().items():
+                self.log.info("stats: %s: %s", name,
+                              json.dumps(value, default=str))
+
+    async def main(self, argv=None):
         # Parse args twice, first with the default parser, then with
         # the augmented parser once we know whether we use real or
         # mock controller.
         parser = self.get_parser()
-        args, unknown = parser.parse_known_args()
+        args, unknown = parser.parse_known_args(argv)
         logging.basicConfig()
 
         for logger, level in args.debug_level.items():
@@ -159,13 +434,15 @@ class Main(object):
 
         controller_cls = self.mock_cls if args.use_mock else self.real_cls
         controller_cls.augment_parser(parser)
-        args = parser.parse_args()
+        args = parser.parse_args(argv)
 
         if args.help:
             parser.print_help()
             sys.exit(0)
 
         self.prefix = args.prefix
+        self.shared = args.shared or args.share_group is not None
+        self.share_override = args.share_group
 
         # Create controller---it has now a chance to fail on invalid
         # arguments etc., but actual initialization occurs only once
@@ -175,19 +452,50 @@ class Main(object):
         self.log.debug("controller_cls=%r controller=%r args=%r",
                        controller_cls, self.controller, args)
 
-        self.client = MQTTClient(args.client_id)
+        if args.replay:
+            self.client = ReplayClient(args.client_id)
+        else:
+            self.client = MQTTClient(args.client_id)
+
+        self.recorder = Recorder(args.record) if args.record else None
 
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
+        self.client.set_config({'reconnect_retries': NO_RECONNECTS})
+        logging.getLogger("gmqtt.client").addFilter(RECONNECT_ERROR_FILTER)
+
+        self.backoff = Backoff(args.reconnect_min, args.reconnect_max)
+        self.disconnected = asyncio.Event()
+        self.disconnections = 0
+
+        if args.offline_queue_file:
+            self.offline = DiskOfflineQueue(args.offline_queue_file,
+                                            args.offline_queue_size)
+        else:
+            self.offline = OfflineQueue(args.offline_queue_size)
 
-        # subscriptions: key = topic, value = ([fns], sub, sid)
-        self.subscriptions = {}
+        self.dispatcher = Dispatcher(self.prefix)
+        self.scheduler = Scheduler(args.max_handlers, args.queue_size,
+                                   args.overflow)
+        limits = dict(args.concurrency)
 
         for topic, fn in self.controller.subscriptions:
-            self.subscriptions.setdefault(
-                topic, ([], None, len(self.subscriptions) + 1))[0].append(fn)
+            self.dispatcher.add(topic, fn)
 
-        self.log.debug("subscriptions=%r", self.subscriptions)
+        for route in self.dispatcher:
+            route.queue = self.scheduler.queue(
+                route.topic_filter,
+                NORMAL if route.priority is None else route.priority,
+                limits.get(route.topic, route.limit))
+
+        self.log.debug("routes=%r", list(self.dispatcher))
+
+        if getattr(self.controller, 'loopback', False):
+            self.loopback = Loopback(
+                self.dispatcher, self.scheduler, self.send,
+                mirror=getattr(self.controller, 'loopback_mirror', False),
+                shared=lambda route: self.share_group(route) is not None)
 
         # hook up the publisher before initialize, it might be called there
         self.controller.set_publisher(self.publish)
@@ -195,48 +503,61 @@ class Main(object):
         # # initialize the client now
         # self.controller.initialize()
 
-        while not (self.stop.is_set() or self.client.is_connected):
-            try:
-                await self.client.connect(*args.server, keepalive=60)
-            except OSError:
-                self.log.warning(
-                    "Warning: Unable to connect to %s:%d, retrying...",
-                    *args.server)
+        if not await self.connect(args.server):
+            self.offline.close()
 
-                # wait either until stop is set, or for the reconnect
-                # timeout
-                try:
-                    await asyncio.wait_for(self.stop.wait(), 30)
-                except asyncio.TimeoutError:
-                    pass
+            if self.recorder is not None:
+                self.recorder.close()
 
-        if not self.client.is_connected:
             return
 
+        stats_task = None
+
         try:
             self.log.info("Note: Connected to %s:%d", *args.server)
             self.controller.initialize()
 
-            for message in args.inject_message:
-                assert False, "NOT IMPLEMENTED"
+            if args.stats_interval > 0:
+                stats_task = asyncio.ensure_future(
+                    self.log_stats(args.stats_interval))
 
-                # # not clean re-use of Namespace thought...
-                # self.handle_message(controller, argparse.Namespace(
-                #     payload=message.encode('utf-8')))
+            for topic, payload in args.inject_message:
+                await self.on_message(self.client, self.prefix + topic,
+                                      payload, 0, {})
+
+            if args.replay:
+                await self.replay(args.replay, args.replay_speed)
+                self.stop.set()
 
             if args.run_once:
+                await self.scheduler.join()
                 self.stop.set()
 
             self.log.debug("waiting for stop signal")
-            await self.stop.wait()
+
+            while await self.wait_disconnect():
+                if not await self.connect(args.server, retry=True):
+                    break
+
+                self.log.info("Note: Reconnected to %s:%d", *args.server)
+
             self.log.debug("stopped")
         except KeyboadInterrupt:
             self.log.info("^C detected, stopping...")
         except:
             self.log.exception("exception during controller operation")
         finally:
+            if stats_task is not None:
+                stats_task.cancel()
+
+            self.scheduler.cancel()
+
             self.log.debug("uninitializing controller")
             self.controller.uninitialize()
 
             self.log.debug("disconnecting")
             await self.client.disconnect()
+            self.offline.close()
+
+            if self.recorder is not None:
+                self.recorder.close()
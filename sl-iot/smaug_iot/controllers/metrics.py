@@ -0,0 +1,69 @@
+import bisect
+
+
+class Histogram(object):
+    """Fixed bucket histogram of durations in seconds (or any other
+    positive values if buckets are given)"""
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1, 2.5, 5, 10, 30, 60)
+
+    # for in-process durations such as handler run times
+    FINE_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005) + BUCKETS
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        """Add the observations of another histogram with the same
+        buckets"""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """Return the upper bound of the bucket containing the p'th
+        percentile (0-100), or the maximum if that is smaller"""
+        if self.count == 0:
+            return None
+
+        rank = self.count * p / 100
+        seen = 0
+
+        for i, count in enumerate(self.counts):
+            seen += count
+
+            if seen >= rank and count:
+                if i < len(self.buckets):
+                    return min(self.buckets[i], self.max)
+
+                return self.max
+
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": dict(zip(self.buckets + (float('inf'),),
+                                self.counts)),
+        }
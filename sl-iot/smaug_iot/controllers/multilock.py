@@ -0,0 +1,263 @@
+import argparse
+import asyncio
+import logging
+import sys
+from .abstract import Controller
+from .lock import AbstractLockController
+try:
+    wiringpi = None
+    import wiringpi
+except ImportError:
+    pass
+
+
+def parse_door(s):
+    name, _, pin = s.rpartition('=')
+
+    if not name or any(c in name for c in '/+#'):
+        raise argparse.ArgumentTypeError(f"invalid door {s!r}, expected "
+                                         f"NAME=PIN")
+
+    return name, int(pin)
+
+
+class GpioBatch(object):
+    """Batches the GPIO writes of the doors of a MultiLockController:
+    write only records the level of the pin, and all pins written during
+    one event loop iteration are set together by flush, which is called
+    soon after the first write. Only the last level of a pin is written.
+
+    When the batch drives all of WiringPi pins 0-7 (see setup), changes
+    to more than one of them are written with a single digitalWriteByte
+    call (pins not written yet are set low), and other pins with
+    digitalWrite each.
+
+    """
+
+    def __init__(self, gpio):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.gpio = gpio
+        self.byte = False
+        # pin -> last written level
+        self.levels = {}
+        self.pending = {}
+        self.handle = None
+        self.writes = 0
+        self.calls = 0
+        self.flushes = 0
+
+    def setup(self, pins):
+        """Set the pins to output mode"""
+        for pin in pins:
+            self.gpio.pinMode(pin, 1)
+
+        self.byte = (hasattr(self.gpio, 'digitalWriteByte')
+                     and all(pin in pins for pin in range(8)))
+
+    def write(self, pin, level):
+        self.pending[pin] = level
+
+        if self.handle is None:
+            self.handle = asyncio.get_event_loop().call_soon(self.flush)
+
+    def flush(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, {}
+        self.levels.update(pending)
+        self.writes += len(pending)
+        self.flushes += 1
+
+        if self.byte and sum(1 for pin in pending if pin < 8) > 1:
+            self.gpio.digitalWriteByte(
+                sum(self.levels.get(pin, 0) << pin for pin in range(8)))
+            self.calls += 1
+            pending = {pin: level for pin, level in pending.items()
+                       if pin >= 8}
+
+        for pin, level in pending.items():
+            self.gpio.digitalWrite(pin, level)
+            self.calls += 1
+
+    def stats(self):
+        return {
+            "writes": self.writes,
+            "calls": self.calls,
+            "flushes": self.flushes,
+        }
+
+
+class MockGpio(object):
+    """Stand-in for wiringpi that prints the pin writes"""
+
+    def __init__(self):
+        self.modes = {}
+        self.levels = {}
+
+    def pinMode(self, pin, mode):
+        self.modes[pin] = mode
+
+    def digitalWrite(self, pin, level):
+        self.levels[pin] = level
+        print(f"Mock GPIO: pin {pin} {'HIGH' if level else 'LOW'}")
+
+    def digitalWriteByte(self, value):
+        for pin in range(8):
+            self.levels[pin] = (value >> pin) & 1
+
+        print(f"Mock GPIO: pins 0-7 {value:08b}")
+
+
+class Door(AbstractLockController):
+    """The lock of one door of a MultiLockController. It works like a
+    lock controller run with the prefix /<name>: its topics and state
+    are under /<name> (e.g. /<name>/lock and the retained
+    /<name>/lock/status), and its pin is written through the shared
+    GpioBatch."""
+
+    def __init__(self, args, name, pin, batch):
+        super().__init__(args)
+        self.name = name
+        self.namespace = f"/{name}"
+        self.pin = pin
+        self.batch = batch
+        self.signal_locked = 1 if args.active_high else 0
+        self.signal_unlocked = 0 if args.active_high else 1
+        self.current_signal = None
+        self._subscriptions = [(self.namespace + topic, fn)
+                               for topic, fn in self._subscriptions]
+
+    def publish(self, topic, *args, absolute=False, **kwargs):
+        if not absolute:
+            topic = self.namespace + topic
+
+            if 'response_topic' in kwargs:
+                kwargs['response_topic'] = (self.namespace
+                                            + kwargs['response_topic'])
+
+        super().publish(topic, *args, absolute=absolute, **kwargs)
+
+    def enable_lock(self):
+        self.log.info("Enabling lock %s: setting pin %s to %s", self.name,
+                      self.pin, "HIGH" if self.signal_locked else "LOW")
+        self.current_signal = self.signal_locked
+        self.batch.write(self.pin, self.signal_locked)
+
+    def disable_lock(self):
+        self.log.info("Disabling lock %s: setting pin %s to %s", self.name,
+                      self.pin, "HIGH" if self.signal_unlocked else "LOW")
+        self.current_signal = self.signal_unlocked
+        self.batch.write(self.pin, self.signal_unlocked)
+
+    def is_locked(self):
+        return self.current_signal == self.signal_locked
+
+
+class MultiLockController(Controller):
+    """Drives the locks of many doors, e.g. the doors of a locker
+    cabinet, from one process and MQTT connection. Doors are given with
+    --door NAME=PIN (or --doors N for doors 0..N-1 on pins 0..N-1), and
+    each door has the topics of a lock controller under its own
+    namespace /NAME (see Door). Run it with --prefix /cabinet and door
+    3 is locked with /cabinet/3/lock, just like a lock controller run
+    with --prefix /cabinet/3.
+
+    Commands to different doors are handled concurrently, and the pin
+    writes they cause during one event loop iteration are done in one
+    batch (see GpioBatch).
+
+    """
+
+    @classmethod
+    def augment_parser(cls, parser):
+        AbstractLockController.augment_parser(parser)
+        parser.add_argument("--door", type=parse_door, action='append',
+                            default=[], metavar='NAME=PIN',
+                            help=("Door named NAME using WiringPi pin PIN, "
+                                  "may be given more than once"))
+        parser.add_argument("--doors", type=int, default=0,
+                            help=("Doors 0..N-1 using WiringPi pins "
+                                  "0..N-1, instead of --door"))
+        parser.add_argument("--active-high", action='store_true',
+                            dest='active_high', default=False,
+                            help="Pin high is locked")
+        parser.add_argument("--active-low", action='store_false',
+                            dest='active_high',
+                            help="Pin low is locked (default)")
+
+    def __init__(self, args):
+        super().__init__(args)
+        doors = args.door or [(str(i), i) for i in range(args.doors)]
+
+        if not doors:
+            raise ValueError("no doors given, use --door or --doors")
+
+        if len({name for name, pin in doors}) != len(doors):
+            raise ValueError("door names must be unique")
+
+        if len({pin for name, pin in doors}) != len(doors):
+            raise ValueError("door pins must be unique")
+
+        self.batch = GpioBatch(self.create_gpio())
+        self.doors = {name: Door(args, name, pin, self.batch)
+                      for name, pin in doors}
+
+        for door in self.doors.values():
+            self._subscriptions.extend(door.subscriptions)
+
+    def create_gpio(self):
+        return wiringpi
+
+    def set_publisher(self, publisher):
+        super().set_publisher(publisher)
+
+        for door in self.doors.values():
+            door.set_publisher(publisher)
+
+    def initialize(self):
+        if wiringpi is None:
+            self.log.critical("WiringPi is not installed on this computer. "
+                              "Please install it (pip3 install wiringpi)")
+            sys.exit(1)
+
+        wiringpi.wiringPiSetup()
+        self.setup()
+
+    def setup(self):
+        self.batch.setup({door.pin for door in self.doors.values()})
+
+        for door in self.doors.values():
+            door.initialize()
+
+        # set the initial state of all pins at once
+        self.batch.flush()
+
+    def uninitialize(self):
+        self.batch.flush()
+
+    def stats(self):
+        stats = super().stats()
+        stats["gpio"] = self.batch.stats()
+        stats["doors"] = {
+            name: {"locked": 1 if door.is_locked() else 0,
+                   "depth": door.actuation.depth,
+                   "max_depth": door.actuation.max_depth,
+                   "actuations": door.actuation.actuations,
+                   "coalesced": door.actuation.coalesced}
+            for name, door in self.doors.items()}
+        return stats
+
+
+class MockMultiLockController(MultiLockController):
+    """Multi-lock controller printing the pin writes"""
+
+    def create_gpio(self):
+        return MockGpio()
+
+    def initialize(self):
+        self.setup()
@@ -1,105 +1,33 @@
 import abc
 import sys
 import platform
-import uuid
-from .abstract import Controller, handler
+from .abstract import Controller, RpcError
 from smaug_iot.nfc.messages import Announce, Echo, EchoSuccess, \
     Verify, VerifySuccess, VerifyFailure, \
     Open, OpenSuccess, OpenFailure, \
     Close, CloseSuccess, CloseFailure, \
     Query, QuerySuccess, QueryFailure
 from smaug_iot.nfc.comm import Nfc
+from smaug_iot.nfc.framing import FRAME_SIZE
 import threading
 import logging
 import asyncio
-import concurrent
 import time
 from .access import AccessSchema
-
-
-# stab at a bit more generic async wrapper...
-class Picket(object):
-    def __init__(self):
-        self.id = str(uuid.uuid4())
-        self.event = asyncio.Event()
-        self.result = None
-
-    def complete(self, result):
-        self.result = result
-        self.event.set()
-
-
-class Fence(object):
-    class result(object):
-        def __init__(self, ok, result=None, error=None):
-            self.ok = ok
-            self.result = result
-            self.error = error
-
-        def __bool__(self):
-            return self.ok
-
-        def __str__(self):
-            if (self.ok):
-                return f"ok<{self.result!r}>"
-            else:
-                return f"fail<{self.error}>"
-
-        __repr__ = __str__
-
-    def complete(self, id, result):
-        if id not in self.requests:
-            return
-
-        self.requests[id].complete(result)
-
-    def __init__(self, timeout=60):
-        self.timeout = timeout
-        self.requests = {}
-        self.log = logging.getLogger(self.__class__.__name__)
-
-    async def fire(self, action, null=None, timeout=None):
-        """Call action with the given timeout (or default from constructor if
-not given), and returns a RESULT object which evaluates to False if
-there was a failure or a timeout, and True if there is a successfull
-result.
-
-The result object has fields .value on success, and .error on error."""
-
-        timeout = self.timeout if timeout is None else timeout
-
-        call = Picket()
-        assert call.id not in self.requests
-        self.requests[call.id] = call
-        await action(call)
-        try:
-            start = time.time()
-            await asyncio.wait_for(action(call), timeout)
-            left = max(0, timeout, timeout - (time.time() - start))
-            await asyncio.wait_for(call.event.wait(), left)
-            total = time.time() - start
-            # TODO: check exception status!
-            self.log.debug("%s: Finished: call %ss, wait %ss, total %ss: %r",
-                           call.id, timeout - left, total - (timeout - left),
-                           total, call.result)
-            return Fence.result(True, result=call.result)
-        except asyncio.TimeoutError as err:
-            self.log.debug("%s: Operation %r timeouted (timeout=%r)",
-                           call.id, action, timeout)
-            return Fence.result(False, result=null, error=str(err))
-        finally:
-            del self.requests[call.id]
+from .state import LOCK_STATE_TOPIC
 
 
 class NfcController(Controller):
     def __init__(self, args):
         super().__init__(args)
         self.nfc_device = args.nfc_device
+        self.frame_size = args.nfc_frame_size
         self.dummy_lock = args.dummy_lock
         self.running = False
         self.stopped = threading.Event()
         self.nfc = None
-        self.fence = Fence()
+        self.rpc = self.create_rpc_client()
+        self.lock_state = self.create_state_cache(LOCK_STATE_TOPIC, int)
         self.was_open = True
         self.reset()
 
@@ -122,6 +50,11 @@ class NfcController(Controller):
         parser.add_argument('--nfc-device', type=str,
                             default="tty:ttyS0:pn532",
                             help="nfcpy device (default tty:serial0:pn542)")
+        parser.add_argument('--nfc-frame-size', type=int,
+                            default=FRAME_SIZE,
+                            help=("Largest frame sent to the phone, longer "
+                                  "messages are split (default: "
+                                  f"{FRAME_SIZE})"))
         parser.add_argument('--locker-id',
                             default=platform.node(),
                             help='Locker identifier to announce')
@@ -153,71 +86,60 @@ class NfcController(Controller):
         self.log.debug(f"Echo, replying back")
         return EchoSuccess(message=r.message)
 
-    @handler("/access_result", AccessSchema())
-    async def access_result(self, id, allowed, actions, **kwargs):
-        self.log.debug("got access result: id=%r allowed=%r actions=%r",
-                       id, allowed, actions)
-        self.fence.complete(id, (allowed, None, actions))
-
     async def handle_verify(self, r):
         self.log.debug(f"Verify: token={r.token}")
-        # in reality, we would need to send a message to token
-        # controller, wait for response (with timeout), then send
-        # response back --- and all of that in another thread,
-        # probably
 
-        async def query(call):
-            self.publish(
+        try:
+            result = await self.rpc.call(
                 "/access",
-                AccessSchema().dumps({
-                    "id": call.id,
+                {
                     "token": r.token,
                     "actions": []
-                }),
-                response_topic="/access_result")
-
-        result = await self.fence.fire(query, (False, "unknown error", []))
+                },
+                AccessSchema)
+            error = None
+        except (asyncio.TimeoutError, RpcError) as err:
+            result = None
+            error = str(err) or err.__class__.__name__
 
         self.log.info(
             "Verified token %r: %s = %s",
             r.token,
             "SUCCESS" if result else "FAILURE",
-            (f"VALID for {', '.join(result.result[2])}" if result.result[0]
+            (f"VALID for {', '.join(result['actions'])}" if result['allowed']
              else "INVALID") if result
-            else result.error or "-" )
+            else error or "-")
 
         if not result:
             return VerifyFailure(
-                message=result.error or "Failed to check authentication oken")
+                message=error or "Failed to check authentication token")
 
-        if not result.result[0]:
+        if not result['allowed']:
             return VerifyFailure(
-                message=(result.result[1]
-                         or "Invalid or expired authentication token"))
+                message="Invalid or expired authentication token")
 
         self.has_access = True
-        self.allowed_ops = result.result[2]
+        self.allowed_ops = result['actions']
         return VerifySuccess()
 
-    @handler("/lock_result", int)
-    async def lock_result(self, locked):
-        self.log.debug("got lock result: locked=%r", locked)
-        self.fence.complete(self.lock_query_id, locked)
-
     async def refresh_lock_state(self):
         self.log.debug("refresh_lock_state: is_open=%r", self.is_open)
 
         if self.dummy_lock:
             self.is_open = self.was_open
+        elif self.is_open is None and self.lock_state.known:
+            # the lock controller keeps the retained state topic current
+            self.is_open = not self.lock_state.get()
         elif self.is_open is None:
             self.log.debug("need to query state from lock")
 
-            async def query(call):
-                self.lock_query_id = call.id  # baaaad
-                self.publish("/lock/state", response_topic="/lock_result")
+            try:
+                locked = await self.rpc.call(
+                    "/lock/state", response_schema=int, timeout=1)
+            except (asyncio.TimeoutError, RpcError):
+                locked = None
 
-            result = await self.fence.fire(query, None, timeout=1)
-            self.is_open = False if result.result else True
+            self.is_open = False if locked else True
 
         self.log.info("Queried lock: %s", "OPEN" if self.is_open else "CLOSED")
 
@@ -225,7 +147,7 @@ class NfcController(Controller):
 
     async def set_lock_locked(self, locked):
         if not self.dummy_lock:
-            self.publish("/lock", 1 if locked else 0)
+            self.publish_data("/lock", 1 if locked else 0)
 
         self.is_open = not locked
         self.was_open = self.is_open
@@ -333,7 +255,8 @@ class NfcController(Controller):
     def initialize(self):
         self.log.debug("contacting NFC device: %r", self.nfc_device)
 
-        self.nfc = Nfc(self.nfc_device, timeout=5)
+        self.nfc = Nfc(self.nfc_device, timeout=5,
+                       frame_size=self.frame_size)
         self.log.debug("nfc=%r", self.nfc)
 
         loop = asyncio.get_running_loop()
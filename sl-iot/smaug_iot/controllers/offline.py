@@ -0,0 +1,135 @@
+import collections
+import logging
+import random
+import sqlite3
+import msgpack
+from .loopback import to_payload
+
+
+class Backoff(object):
+    """Exponential backoff with full jitter: the n'th consecutive retry
+    waits a random time between zero and min(maximum, initial * 2**n)
+    seconds. The randomization spreads out the reconnects of many
+    clients that lost their connection at the same time."""
+
+    def __init__(self, initial=1, maximum=60, factor=2):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.attempts = 0
+
+    def delay(self):
+        ceiling = min(self.maximum,
+                      self.initial * self.factor ** min(self.attempts, 32))
+        self.attempts += 1
+        return random.uniform(0, ceiling)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class OfflineQueue(object):
+    """Bounded FIFO of messages published while not connected to the
+    broker. When full the oldest message is dropped."""
+
+    def __init__(self, size=1000):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.size = size
+        self.queue = collections.deque()
+        self.queued = 0
+        self.dropped = 0
+        self.flushed = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def put(self, topic, payload, kwargs):
+        if self.size <= 0:
+            self.dropped += 1
+            return
+
+        if len(self) >= self.size:
+            self.log.warning("offline queue full, dropping oldest message")
+            self._drop()
+            self.dropped += 1
+
+        self._append(topic, to_payload(payload), kwargs)
+        self.queued += 1
+
+    def flush(self, publisher, connected=lambda: True):
+        """Publish queued messages in order while connected() is true,
+        returns the number of messages published"""
+        count = 0
+
+        while len(self) and connected():
+            topic, payload, kwargs = self._peek()
+            publisher(topic, payload, **kwargs)
+            self._drop()
+            count += 1
+
+        self.flushed += count
+        return count
+
+    def _append(self, topic, payload, kwargs):
+        self.queue.append((topic, payload, kwargs))
+
+    def _peek(self):
+        return self.queue[0]
+
+    def _drop(self):
+        self.queue.popleft()
+
+    def close(self):
+        pass
+
+    def stats(self):
+        return {
+            "depth": len(self),
+            "queued": self.queued,
+            "dropped": self.dropped,
+            "flushed": self.flushed,
+        }
+
+
+class DiskOfflineQueue(OfflineQueue):
+    """OfflineQueue stored in a SQLite database, so that messages queued
+    before a restart are sent once connected again"""
+
+    def __init__(self, path, size=1000):
+        super().__init__(size)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS queue ("
+                        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                        "topic TEXT, payload BLOB, properties BLOB)")
+        self.db.commit()
+        self.length = self.db.execute(
+            "SELECT COUNT(*) FROM queue").fetchone()[0]
+
+        if self.length:
+            self.log.info("%d queued messages in %s", self.length, path)
+
+    def __len__(self):
+        return self.length
+
+    def _append(self, topic, payload, kwargs):
+        self.db.execute(
+            "INSERT INTO queue (topic, payload, properties) VALUES (?, ?, ?)",
+            (topic, payload, msgpack.packb(kwargs, use_bin_type=True)))
+        self.db.commit()
+        self.length += 1
+
+    def _peek(self):
+        topic, payload, properties = self.db.execute(
+            "SELECT topic, payload, properties FROM queue "
+            "ORDER BY id LIMIT 1").fetchone()
+        return topic, payload, msgpack.unpackb(properties, raw=False)
+
+    def _drop(self):
+        self.db.execute(
+            "DELETE FROM queue WHERE id = (SELECT MIN(id) FROM queue)")
+        self.db.commit()
+        self.length -= 1
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,155 @@
+import asyncio
+import gzip
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import msgpack
+from .loopback import to_payload
+
+# Direction of recorded messages
+RECEIVED = 0
+PUBLISHED = 1
+
+
+def open_capture(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+
+    return open(path, mode)
+
+
+class Recorder(object):
+    """Writes MQTT traffic to a capture file as a stream of msgpack
+    arrays [timestamp, direction, topic, payload, properties]. Files
+    ending in .gz are compressed.
+
+    record only packs the message into a buffer, which is written by a
+    worker thread when it holds buffer_size bytes or interval seconds
+    have passed since the last write, so that the event loop does not
+    wait for the file."""
+
+    def __init__(self, path, buffer_size=64 * 1024, interval=1):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.buffer_size = buffer_size
+        self.interval = interval
+        self.file = open_capture(path, 'ab')
+        self.packer = msgpack.Packer(use_bin_type=True)
+        self.writer = ThreadPoolExecutor(1)
+        self.buffer = []
+        self.buffered = 0
+        self.flushed = time.monotonic()
+        self.count = 0
+        self.errors = 0
+
+    def record(self, direction, topic, payload, properties):
+        data = self.packer.pack(
+            [time.time(), direction, topic, to_payload(payload),
+             properties])
+        self.buffer.append(data)
+        self.buffered += len(data)
+        self.count += 1
+
+        if (self.buffered >= self.buffer_size
+                or time.monotonic() - self.flushed >= self.interval):
+            self.flush()
+
+    def flush(self):
+        """Hand the buffered messages to the worker thread"""
+        if self.buffer:
+            self.writer.submit(self.write, b''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+        self.flushed = time.monotonic()
+
+    def write(self, data):
+        try:
+            self.file.write(data)
+        except OSError:
+            self.errors += 1
+            self.log.exception("cannot write to %s", self.path)
+
+    def close(self):
+        """Write the remaining messages and close the file, this
+        blocks"""
+        self.flush()
+        self.writer.shutdown()
+        self.file.close()
+        self.log.info("recorded %d messages to %s", self.count, self.path)
+
+
+def read_capture(path):
+    """Yield (timestamp, direction, topic, payload, properties) records of
+    a capture file"""
+    with open_capture(path, 'rb') as f:
+        yield from msgpack.Unpacker(f, raw=False, strict_map_key=False)
+
+
+class ReplayClient(object):
+    """Stands in for the MQTT client when replaying a capture, so that
+    controllers run without a broker. Published messages are only
+    counted."""
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.is_connected = False
+        self.published = 0
+        self.on_connect = None
+        self.on_message = None
+        self.on_disconnect = None
+
+    def set_config(self, config):
+        pass
+
+    async def connect(self, host, port, **kwargs):
+        self.is_connected = True
+        self.on_connect(self, 0, 0, {})
+
+    async def disconnect(self):
+        self.is_connected = False
+
+    def subscribe(self, subscription, **kwargs):
+        pass
+
+    def resubscribe(self, subscription):
+        pass
+
+    def publish(self, topic, payload=None, **kwargs):
+        self.published += 1
+
+    async def replay(self, path, speed=1, wait=None):
+        """Feed received messages of the capture to on_message, with
+        the original timing divided by speed, or as fast as possible if
+        speed is 0, awaiting wait() (if given) before each message so
+        that the handlers keep up. Returns the number of messages."""
+        count = 0
+        first = None
+        start = time.monotonic()
+
+        for timestamp, direction, topic, payload, properties in \
+                read_capture(path):
+            if direction != RECEIVED:
+                continue
+
+            if first is None:
+                first = timestamp
+
+            if speed > 0:
+                delay = start + (timestamp - first) / speed - time.monotonic()
+
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif wait is not None:
+                await wait()
+            else:
+                await asyncio.sleep(0)
+
+            # subscription identifiers of the recording process need not
+            # match ours, so dispatch by topic
+            properties.pop('subscription_identifier', None)
+
+            await self.on_message(self, topic, payload, 0, properties)
+            count += 1
+
+        return count
@@ -0,0 +1,349 @@
+import base64
+import hashlib
+import logging
+import math
+import time
+from datetime import datetime
+import pytz
+from marshmallow import Schema, fields
+from .abstract import Controller, handler
+
+# Retained topics of the revocation publisher: the Bloom filter of all
+# revoked token ids, and the exact list of ids revoked since the filter
+# was published
+REVOCATION_FILTER_TOPIC = "/revocation/filter"
+REVOCATION_DELTA_TOPIC = "/revocation/delta"
+# Topic to revoke a token id on
+REVOKE_TOPIC = "/revocation/revoke"
+
+# RevocationList.check results
+NOT_REVOKED = 0
+REVOKED = 1
+MAYBE_REVOKED = 2
+
+
+def revocation_key(jti):
+    """Token ids are compared as strings, the PDS issues them as 256 bit
+    integers that do not fit all encodings"""
+    return str(jti)
+
+
+class BloomFilter(object):
+    """Bloom filter of size bits using hashes bit positions per key,
+    derived from the SHA-256 digest of the key by double hashing. Use
+    for_capacity to size it for a number of keys and false positive
+    rate."""
+
+    def __init__(self, size, hashes, bits=None):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray(bits if bits is not None else -(-size // 8))
+        self.count = 0
+
+        if len(self.bits) * 8 < size:
+            raise ValueError(f"{len(self.bits)} bytes for {size} bits")
+
+    @classmethod
+    def for_capacity(cls, capacity, error_rate):
+        capacity = max(1, capacity)
+        size = math.ceil(-capacity * math.log(error_rate)
+                         / math.log(2) ** 2)
+        size = -(-size // 8) * 8
+        hashes = max(1, round(size / capacity * math.log(2)))
+        return cls(size, hashes)
+
+    def positions(self, key):
+        digest = hashlib.sha256(revocation_key(key).encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self.positions(key))
+
+    @property
+    def error_rate(self):
+        """Expected false positive rate with count keys added"""
+        return (1 - math.exp(-self.hashes * self.count / self.size)) \
+            ** self.hashes
+
+
+class FilterSchema(Schema):
+    version = fields.Integer(required=True)
+    size = fields.Integer(required=True)
+    hashes = fields.Integer(required=True)
+    count = fields.Integer(missing=0)
+    # base64 encoded, so that the filter can be sent in any payload
+    # format
+    bits = fields.String(required=True)
+
+
+class DeltaSchema(Schema):
+    base = fields.Integer(required=True)
+    version = fields.Integer(required=True)
+    revoked = fields.List(fields.String, missing=[])
+
+
+class RevokeSchema(Schema):
+    jti = fields.Raw(required=True)
+    expires = fields.DateTime(missing=None)
+
+
+class RevocationList(object):
+    """Revoked token ids as published by a RevocationPublisher: a Bloom
+    filter of the ids revoked when the filter was built (version) and
+    the exact list of ids revoked since (the delta, with the filter
+    version it is based on). Deltas are cumulative, so only the latest
+    one is kept.
+
+    check tells whether a token id is revoked for certain (it is in the
+    delta), may be revoked (it is in the filter, which has false
+    positives) or is not revoked. Before the filter is received no ids
+    are known to be revoked.
+
+    While the delta is not based on the filter held (one of them was
+    lost or they arrived out of order) ids revoked between the two
+    versions are in neither, so any id not in the delta may be revoked.
+
+    """
+
+    def __init__(self):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.filter = None
+        self.version = None
+        self.delta = frozenset()
+        self.delta_base = None
+        self.delta_version = None
+        self.updated = None
+        self.updates = 0
+        self.checks = 0
+        self.revoked = 0
+        self.maybe_revoked = 0
+
+    def update_filter(self, version, size, hashes, bits, count=0):
+        """Returns False if the filter is older than the current one"""
+        if self.version is not None and version < self.version:
+            return False
+
+        self.filter = BloomFilter(size, hashes, base64.b64decode(bits))
+        self.filter.count = count
+        self.version = version
+        self.updated = time.time()
+        self.updates += 1
+        return True
+
+    def update_delta(self, base, version, revoked):
+        """Returns False if the delta is older than the current one"""
+        if (self.delta_base is not None
+                and (base, version) < (self.delta_base, self.delta_version)):
+            return False
+
+        self.delta = frozenset(revoked)
+        self.delta_base = base
+        self.delta_version = version
+        self.updated = time.time()
+        self.updates += 1
+        return True
+
+    def check(self, jti):
+        self.checks += 1
+
+        if jti is None:
+            return NOT_REVOKED
+
+        key = revocation_key(jti)
+
+        if key in self.delta:
+            self.revoked += 1
+            return REVOKED
+
+        if (self.filter is not None and key in self.filter
+                or self.stale):
+            self.maybe_revoked += 1
+            return MAYBE_REVOKED
+
+        return NOT_REVOKED
+
+    @property
+    def stale(self):
+        return self.delta_base != self.version
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "filter_bytes": (len(self.filter.bits)
+                             if self.filter is not None else 0),
+            "filter_count": (self.filter.count
+                             if self.filter is not None else 0),
+            "error_rate": (self.filter.error_rate
+                           if self.filter is not None else None),
+            "delta": len(self.delta),
+            "delta_base": self.delta_base,
+            "stale": self.stale,
+            "updated": self.updated,
+            "updates": self.updates,
+            "checks": self.checks,
+            "revoked": self.revoked,
+            "maybe_revoked": self.maybe_revoked,
+        }
+
+
+class RevocationPublisher(Controller):
+    """Publishes revoked token ids for the access controllers. Token ids
+    are revoked by messages on /revocation/revoke ({"jti": ...,
+    "expires": ...}) and kept in the --revoked file, one "jti [expiry
+    timestamp]" per line.
+
+    All revoked ids are published as a Bloom filter on the retained
+    /revocation/filter topic, and ids revoked after that as an exact
+    list on the retained /revocation/delta topic. The filter is
+    rebuilt and published again, without the ids of expired tokens,
+    only when the delta grows beyond --max-delta ids, so that most
+    revocations send just the delta. Versions are millisecond
+    timestamps, so that they keep increasing over restarts.
+
+    """
+
+    @classmethod
+    def augment_parser(cls, parser):
+        parser.add_argument(
+            "--revoked", default=None,
+            help=("File of revoked token ids, new revocations are "
+                  "appended to it (default: kept only in memory)"))
+        parser.add_argument(
+            "--filter-capacity", type=int, default=10000,
+            help=("Number of revoked ids the filter is sized for, it is "
+                  "sized for more if needed (default: 10000)"))
+        parser.add_argument(
+            "--filter-error-rate", type=float, default=0.001,
+            help=("False positive rate of the filter at capacity "
+                  "(default: 0.001)"))
+        parser.add_argument(
+            "--max-delta", type=int, default=1000,
+            help=("Rebuild the filter when more ids than this have been "
+                  "revoked since it was published (default: 1000)"))
+
+    def __init__(self, args):
+        super().__init__(args)
+        self.path = args.revoked
+        self.capacity = args.filter_capacity
+        self.error_rate = args.filter_error_rate
+        self.max_delta = args.max_delta
+        # revoked id -> expiry timestamp or None
+        self.revoked = {}
+        self.delta = []
+        self.version = None
+        self.delta_version = None
+        self.filters = 0
+        self.deltas = 0
+
+        if self.path is not None:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    jti, _, expires = line.strip().partition(' ')
+
+                    if jti:
+                        self.revoked[jti] = (float(expires) if expires
+                                             else None)
+        except FileNotFoundError:
+            pass
+
+        self.log.info("%d revoked token ids in %s",
+                      len(self.revoked), self.path)
+
+    def initialize(self):
+        self.publish_filter()
+
+    def build_filter(self):
+        now = time.time()
+        self.revoked = {jti: expires for jti, expires in self.revoked.items()
+                        if expires is None or expires > now}
+
+        bloom = BloomFilter.for_capacity(
+            max(self.capacity, len(self.revoked)), self.error_rate)
+
+        for jti in self.revoked:
+            bloom.add(jti)
+
+        return bloom
+
+    def publish_filter(self):
+        bloom = self.build_filter()
+        self.version = max(int(time.time() * 1000), (self.version or 0) + 1)
+        self.delta = []
+        self.filters += 1
+
+        self.log.info("publishing filter version %d: %d ids in %d bytes",
+                      self.version, bloom.count, len(bloom.bits))
+
+        self.publish_data(REVOCATION_FILTER_TOPIC,
+                          {"version": self.version,
+                           "size": bloom.size,
+                           "hashes": bloom.hashes,
+                           "count": bloom.count,
+                           "bits": base64.b64encode(bloom.bits).decode()},
+                          FilterSchema, retain=True)
+        self.publish_delta()
+
+    def publish_delta(self):
+        self.delta_version = (self.version if not self.delta
+                              else self.delta_version + 1)
+        self.deltas += 1
+        self.publish_data(REVOCATION_DELTA_TOPIC,
+                          {"base": self.version,
+                           "version": self.delta_version,
+                           "revoked": self.delta},
+                          DeltaSchema, retain=True)
+
+    @handler(REVOKE_TOPIC, RevokeSchema())
+    async def revoke_message(self, jti, expires=None):
+        jti = revocation_key(jti)
+
+        if jti in self.revoked:
+            return
+
+        if expires is not None:
+            if expires.tzinfo is None:
+                expires = expires.replace(tzinfo=pytz.utc)
+
+            if expires <= datetime.now(tz=pytz.utc):
+                return
+
+            expires = expires.timestamp()
+
+        self.log.info("revoking %s", jti)
+        self.revoked[jti] = expires
+
+        if self.path is not None:
+            with open(self.path, 'a') as f:
+                f.write(jti if expires is None else f"{jti} {expires}")
+                f.write("\n")
+
+        if len(self.delta) >= self.max_delta:
+            self.publish_filter()
+        else:
+            self.delta.append(jti)
+            self.publish_delta()
+
+    def stats(self):
+        stats = super().stats()
+        stats["revocation"] = {
+            "revoked": len(self.revoked),
+            "delta": len(self.delta),
+            "version": self.version,
+            "filters": self.filters,
+            "deltas": self.deltas,
+        }
+        return stats
@@ -0,0 +1,163 @@
+import asyncio
+import collections
+import logging
+import time
+from .metrics import Histogram
+
+
+# Priority classes of handlers, lower runs first when handlers have to
+# wait for their turn
+ACTUATION = 0
+NORMAL = 1
+QUERY = 2
+
+PRIORITY_NAMES = {ACTUATION: "actuation", NORMAL: "normal", QUERY: "query"}
+
+# Overflow policies of full queues: drop the incoming message, or the
+# oldest queued message
+DROP = 'drop'
+DROP_OLDEST = 'drop-oldest'
+
+
+class TopicQueue(object):
+    """Bounded queue and running handler count of a single topic"""
+
+    def __init__(self, name, priority=NORMAL, limit=None, size=100,
+                 policy=DROP_OLDEST):
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.size = size
+        self.policy = policy
+        self.queue = collections.deque()
+        self.running = 0
+        self.handled = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.wait = Histogram()
+        self.latency = Histogram(Histogram.FINE_BUCKETS)
+
+    @property
+    def runnable(self):
+        return self.limit is None or self.running < self.limit
+
+    def stats(self):
+        return {
+            "priority": PRIORITY_NAMES.get(self.priority, self.priority),
+            "limit": self.limit,
+            "depth": len(self.queue),
+            "max_depth": self.max_depth,
+            "running": self.running,
+            "handled": self.handled,
+            "dropped": self.dropped,
+            "wait": self.wait.snapshot(),
+            "latency": self.latency.snapshot(),
+        }
+
+
+class Scheduler(object):
+    """Runs message handlers as tasks with per-topic concurrency limits
+    and a global limit. Messages that cannot be started immediately wait
+    in bounded per-topic queues, and when a handler finishes the next
+    message is taken from the highest priority topic that is allowed to
+    run.
+
+    """
+
+    def __init__(self, max_running=32, queue_size=100, policy=DROP_OLDEST):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.max_running = max_running
+        self.queue_size = queue_size
+        self.policy = policy
+        self.queues = []
+        self.running = 0
+        self.tasks = set()
+
+    def queue(self, name, priority=NORMAL, limit=None, size=None):
+        tq = TopicQueue(name, priority, limit,
+                        self.queue_size if size is None else size,
+                        self.policy)
+        self.queues.append(tq)
+        self.queues.sort(key=lambda q: q.priority)
+        return tq
+
+    def submit(self, tq, fn, *args):
+        """Run fn(*args) now or queue it, returns False if the message (or
+        the oldest message in the queue) had to be dropped"""
+        if not tq.queue and tq.runnable and self.running < self.max_running:
+            tq.wait.observe(0)
+            self._start(tq, fn, args)
+            return True
+
+        accepted = True
+
+        if len(tq.queue) >= tq.size:
+            tq.dropped += 1
+            accepted = False
+
+            if tq.policy == DROP or tq.size == 0:
+                self.log.warning("queue %s full, dropping message", tq.name)
+                return False
+
+            self.log.warning("queue %s full, dropping oldest message",
+                             tq.name)
+            tq.queue.popleft()
+
+        tq.queue.append((time.monotonic(), fn, args))
+        tq.max_depth = max(tq.max_depth, len(tq.queue))
+
+        return accepted
+
+    def _start(self, tq, fn, args):
+        tq.running += 1
+        self.running += 1
+        started = time.monotonic()
+        task = asyncio.get_event_loop().create_task(fn(*args))
+        self.tasks.add(task)
+        task.add_done_callback(lambda task: self._done(tq, task, started))
+
+    def _done(self, tq, task, started):
+        self.tasks.discard(task)
+        tq.running -= 1
+        tq.handled += 1
+        tq.latency.observe(time.monotonic() - started)
+        self.running -= 1
+
+        if not task.cancelled() and task.exception() is not None:
+            self.log.error("handler for %s failed", tq.name,
+                           exc_info=task.exception())
+
+        self._next()
+
+    def _next(self):
+        while self.running < self.max_running:
+            for tq in self.queues:
+                if tq.queue and tq.runnable:
+                    queued, fn, args = tq.queue.popleft()
+                    tq.wait.observe(time.monotonic() - queued)
+                    self._start(tq, fn, args)
+                    break
+            else:
+                return
+
+    async def wait_for_room(self):
+        """Let the handlers run, and wait while a queue is full so that
+        the next message is not dropped"""
+        await asyncio.sleep(0)
+
+        while self.tasks and any(tq.queue and len(tq.queue) >= tq.size
+                                 for tq in self.queues):
+            await asyncio.wait(list(self.tasks),
+                               return_when=asyncio.FIRST_COMPLETED)
+
+    async def join(self):
+        """Wait until all queued and running handlers have finished"""
+        while self.tasks:
+            await asyncio.wait(list(self.tasks))
+
+    def cancel(self):
+        for task in list(self.tasks):
+            task.cancel()
+
+    def stats(self):
+        return {tq.name: tq.stats() for tq in self.queues}
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import time
+import marshmallow
+from .codec import codec_for, content_type
+
+
+# Retained topic where the lock controller publishes its actual state (1
+# locked, 0 unlocked) whenever it changes
+LOCK_STATE_TOPIC = "/lock/status"
+
+
+class StateCache(object):
+    """Keeps the latest value published on a retained state topic. As the
+    broker sends the retained value on subscription, the value is known
+    shortly after connecting and reading it needs no broker round trip.
+
+    Use Controller.create_state_cache to create one, it also subscribes
+    to the topic.
+
+    """
+
+    def __init__(self, topic, schema=None):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.topic = topic
+        self.codec = codec_for(schema, trusted=True)
+        self.value = None
+        self.known = False
+        self.updated = None
+        self.updates = 0
+        self.waiters = []
+
+    async def receive(self, payload, properties):
+        if not len(payload):
+            # retained value was cleared
+            self.value = None
+            self.known = False
+            return
+
+        try:
+            self.value = self.codec.decode(payload, content_type(properties))
+        except (marshmallow.exceptions.ValidationError, ValueError) as ex:
+            self.log.warning("invalid state on %s: %s", self.topic, ex)
+            return
+
+        self.known = True
+        self.updated = time.time()
+        self.updates += 1
+
+        self.log.debug("state %s = %r", self.topic, self.value)
+
+        waiters, self.waiters = self.waiters, []
+
+        for future in waiters:
+            if not future.done():
+                future.set_result(self.value)
+
+    async def changed(self):
+        """Wait for the next update and return the new value"""
+        future = asyncio.get_event_loop().create_future()
+        self.waiters.append(future)
+
+        try:
+            return await future
+        finally:
+            if future in self.waiters:
+                self.waiters.remove(future)
+
+    def get(self, default=None):
+        return self.value if self.known else default
+
+    def stats(self):
+        return {
+            "known": self.known,
+            "value": self.value,
+            "updated": self.updated,
+            "updates": self.updates,
+        }
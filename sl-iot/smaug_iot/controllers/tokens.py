@@ -0,0 +1,181 @@
+import json
+import logging
+from datetime import datetime, timedelta
+import pytz
+from .revocation import REVOKED, MAYBE_REVOKED
+try:
+    jwt = None
+    import jwt
+    from jwt.algorithms import RSAAlgorithm
+except ImportError:
+    pass
+
+
+# validity of provisioned tokens without an expiry
+DEFAULT_VALIDITY = timedelta(hours=1)
+
+
+class TokenError(Exception):
+    """The token cannot be verified locally"""
+    pass
+
+
+class JwtVerifier(object):
+    """Verifies RS256 JWTs issued by the AS against its public keys,
+    without contacting any server. Tokens with a valid signature are
+    decided locally: they are denied if expired (exp), not yet valid
+    (nbf) or for another audience (aud) than the one given. The allowed
+    actions come from the `actions` claim (a list or a comma separated
+    string) or the `scope` claim (space separated), and otherwise all
+    actions are allowed. Tokens without an expiry are not verified
+    locally, as nothing would limit how long they are allowed.
+
+    If a RevocationList is given, tokens whose id (jti) is revoked are
+    denied, and tokens whose id may be revoked (a filter match, which
+    can be a false positive) are not verified locally.
+
+    verify raises TokenError for tokens that are not JWTs, are signed
+    with an unknown key or whose signature does not verify, so that
+    the caller can fall back to other means of checking.
+
+    """
+
+    def __init__(self, keys, audience, leeway=0, actions=(),
+                 revocations=None):
+        if jwt is None:
+            raise RuntimeError("Local token verification requires PyJWT "
+                               "(pip3 install 'PyJWT[crypto]')")
+
+        if not audience:
+            raise ValueError("Local token verification requires an "
+                             "audience")
+
+        self.log = logging.getLogger(self.__class__.__name__)
+        # list of (kid, key), kid is None for keys from PEM files
+        self.keys = list(keys)
+        self.audience = audience
+        self.leeway = leeway
+        self.actions = tuple(actions)
+        self.revocations = revocations
+        self.verified = 0
+        self.denied = 0
+        self.unverifiable = 0
+
+    @classmethod
+    def from_files(cls, pem_files=(), jwks_files=(), **kwargs):
+        keys = []
+
+        for path in pem_files:
+            with open(path, 'rb') as f:
+                keys.append((None, RSAAlgorithm(RSAAlgorithm.SHA256)
+                             .prepare_key(f.read())))
+
+        for path in jwks_files:
+            with open(path) as f:
+                for jwk in json.load(f)['keys']:
+                    if jwk.get('kty') == 'RSA':
+                        keys.append((jwk.get('kid'),
+                                     RSAAlgorithm.from_jwk(jwk)))
+
+        return cls(keys, **kwargs)
+
+    def candidates(self, token):
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.exceptions.DecodeError as ex:
+            raise TokenError(f"Not a JWT: {ex}")
+
+        if header.get('alg') != 'RS256':
+            raise TokenError(f"Unsupported algorithm {header.get('alg')}")
+
+        kid = header.get('kid')
+        keys = [key for key_id, key in self.keys
+                if kid is None or key_id is None or key_id == kid]
+
+        if not keys:
+            raise TokenError(f"Unknown key {kid}")
+
+        return keys
+
+    def claims(self, token):
+        """Return the claims of the token if its signature verifies and
+        its time and audience claims are valid, raises TokenError if it
+        cannot be verified and jwt.InvalidTokenError if it is not
+        valid"""
+        keys = self.candidates(token)
+
+        # the PDS issues integer jti claims (see jwt_token.py), newer
+        # PyJWT versions reject them unless told not to check
+        options = {'require': ['exp'], 'verify_jti': False}
+
+        for key in keys:
+            try:
+                return jwt.decode(
+                    token, key, algorithms=['RS256'],
+                    audience=self.audience, leeway=self.leeway,
+                    options=options)
+            except jwt.exceptions.InvalidSignatureError:
+                continue
+            except jwt.exceptions.MissingRequiredClaimError as ex:
+                # the PDS only adds exp if asked to, leave those to the
+                # IAA, but deny tokens without an audience
+                if ex.claim == 'exp':
+                    raise TokenError("Token has no expiry")
+                raise
+
+        raise TokenError("Signature verification failed")
+
+    def verify(self, token):
+        """Return (valid, allowed_actions, expires) of the token"""
+        try:
+            claims = self.claims(token)
+        except TokenError:
+            self.unverifiable += 1
+            raise
+        except jwt.exceptions.InvalidTokenError as ex:
+            self.log.info("Denied token: %s", ex)
+            self.denied += 1
+            return (False, (), None)
+
+        if self.revocations is not None:
+            revoked = self.revocations.check(claims.get('jti'))
+
+            if revoked == REVOKED:
+                self.log.info("Denied token: revoked")
+                self.denied += 1
+                return (False, (), None)
+
+            if revoked == MAYBE_REVOKED:
+                self.unverifiable += 1
+                raise TokenError("Token may be revoked")
+
+        self.verified += 1
+
+        return (True, self.allowed_actions(claims), self.expires(claims))
+
+    def allowed_actions(self, claims):
+        actions = claims.get('actions')
+        scope = claims.get('scope')
+
+        if actions is None and scope is not None:
+            # a malformed scope allows nothing rather than everything
+            actions = scope.split() if isinstance(scope, str) else ()
+
+        if isinstance(actions, str):
+            actions = actions.split(',')
+
+        if actions is None:
+            return self.actions
+
+        return tuple(actions)
+
+    def expires(self, claims):
+        return datetime.fromtimestamp(int(claims['exp']), tz=pytz.utc)
+
+    def stats(self):
+        return {
+            "keys": len(self.keys),
+            "verified": self.verified,
+            "denied": self.denied,
+            "unverifiable": self.unverifiable,
+        }
@@ -1,10 +1,10 @@
 import abc
 import asyncio
-import uuid
-from ..abstract import Controller, handler
+from ..abstract import Controller, RpcError
 from ..main import parse_host
 from ..lock import LockController
 from ..access import AccessSchema
+from ..state import LOCK_STATE_TOPIC
 from quart import Quart, Blueprint, jsonify, current_app, request
 from quart import abort, render_template
 
@@ -78,8 +78,8 @@ class WotController(Controller):
         super().__init__(args)
         self.address = args.address
 
-        self.locked_str = "unknown"
-        self.locked_num = "null"
+        self.rpc = self.create_rpc_client()
+        self.lock_state = self.create_state_cache(LOCK_STATE_TOPIC, int)
 
         self.app = Quart(__name__)
         self.app.controller = self
@@ -101,65 +101,45 @@ class WotController(Controller):
 
         self.log.debug("started %r on %r", self.task, self.address)
 
-    # this needs later to be refactored into more generic approach,
-    # this is not a bit of a kludge
-    reqs = {}
-
-    @handler("/access_result", AccessSchema())
-    async def check_result(self, id, allowed, **kwargs):
-        if id not in self.reqs:
-            self.log.debug("access result for %r received, not in reqs", id)
-            return
-
-        event = self.reqs[id][0]
-        self.reqs[id] = event, True, allowed
-        event.set()
-
     async def check_access(self, token, *actions):
-        id = str(uuid.uuid4())
+        self.log.debug("check_access: token=%r actions=%r",
+                       token, actions)
 
-        self.log.debug("check_access: token=%r actions=%r id=%r",
-                       token, actions, id)
-
-        event = asyncio.Event()
-        self.reqs[id] = event, False, False
+        try:
+            response = await self.rpc.call("/access",
+                                           {"token": token,
+                                            "actions": actions},
+                                           AccessSchema)
+            result = True, response['allowed']
+        except (asyncio.TimeoutError, RpcError):
+            result = False, False
 
-        self.publish("/access",
-                     AccessSchema().dumps({
-                         "id": id,
-                         "token": token,
-                         "actions": actions}),
-                     response_topic="/access_result")
+        self.log.debug("token=%r result: %r", token, result)
 
-        self.log.debug("published, wait event %r", event)
+        return result
 
-        try:
-            await asyncio.wait_for(event.wait(), 60)
-            result = self.reqs[id][1:]
-        except asyncio.TimeoutError:
-            result = False, False
+    @property
+    def locked_str(self):
+        locked = self.lock_state.get()
 
-        del self.reqs[id]
+        if locked is None:
+            return "unknown"
 
-        self.log.debug("id=%r result: %r", id, result)
+        return "locked" if locked else "unlocked"
 
-        return result
+    @property
+    def locked_num(self):
+        locked = self.lock_state.get()
 
-    @handler("/lock", int)
-    async def lock_message(self, locked):
-        self.log.debug("lock message, locked=%r", locked)
+        if locked is None:
+            return "null"
 
-        if locked == 0:
-            self.locked_str = "unlocked"
-            self.locked_num = "0"
-        else:
-            self.locked_str = "locked"
-            self.locked_num = "1"
+        return "1" if locked else "0"
 
     def lock_action(self):
         self.log.debug("lock_action called")
-        self.publish("/lock", "1")
+        self.publish_data("/lock", 1)
 
     def unlock_action(self):
         self.log.debug("unlock_action called")
-        self.publish("/lock", "0")
+        self.publish_data("/lock", 0)
@@ -5,7 +5,17 @@ except ImportError:
     nfc = None
 
 import logging
-from .messages import Message, DecodeError
+from .messages import Message, DecodeError, PROTOCOL_MAP, PROTOCOL_ARRAY
+from .framing import Framer, FRAME_SIZE
+
+
+# AIDs the phone selects, with the protocol version each one selects.
+# Phones that know the array encoding select the version 2 AID, others
+# the original one.
+AIDS = {
+    "eu.sofie-iot.smaug.locker.1".encode('iso-8859-1'): PROTOCOL_MAP,
+    "eu.sofie-iot.smaug.locker.2".encode('iso-8859-1'): PROTOCOL_ARRAY,
+}
 
 
 def ok(req, data):
@@ -15,9 +25,10 @@ def ok(req, data):
 
 
 class Proto(object):
-    def __init__(self, clf, aid, timeout=0):
+    def __init__(self, clf, aids, timeout=0):
         self.clf = clf
-        self.aid = aid
+        self.aids = aids
+        self.protocol = PROTOCOL_MAP
         self.timeout = timeout
         self.log = logging.getLogger(self.__class__.__name__)
 
@@ -87,18 +98,21 @@ class Proto(object):
                 name = tt4_cmd[6:6 + lc]
                 self.log.debug(f"SELECT DF NAME={name}")
 
-                if name != self.aid:
+                if name not in self.aids:
                     self.log.warning(
-                        f"NAME is not our AID ({self.aid}), rejecting")
+                        f"NAME is not our AID ({list(self.aids)}), "
+                        f"rejecting")
                     continue
 
+                self.protocol = self.aids[name]
                 match = True
 
             if not match:
                 self.log.info("Incorrect protocol start, rejecting")
                 continue
 
-            self.log.info("SELECT DF: Expected AID detected")
+            self.log.info("SELECT DF: Expected AID detected, protocol %d",
+                          self.protocol)
             return True
 
     def send(self, data):
@@ -119,48 +133,32 @@ class Proto(object):
 
 class Nfc(object):
     def __init__(self, device,
-                 aid="eu.sofie-iot.smaug.locker.1".encode('iso-8859-1'),
-                 timeout=0):
+                 aids=AIDS, timeout=0, frame_size=FRAME_SIZE):
         self.clf = nfc.ContactlessFrontend(device)
-        self.proto = Proto(self.clf, aid, timeout)
+        self.proto = Proto(self.clf, aids, timeout)
+        self.framer = Framer(self.proto.send, frame_size)
         self.log = logging.getLogger(self.__class__.__name__)
 
     def listen(self):
         return self.proto.listen()
 
     def send(self, msg):
-        encoded = msg.encode()
+        encoded = msg.encode(self.proto.protocol)
         self.log.debug(">>> %r = %r (%d bytes)", msg, encoded, len(encoded))
 
-        data = bytearray()
-        frame = self.proto.send(encoded)
+        try:
+            data = self.framer.exchange(encoded)
 
-        while True:
-            if frame is None or len(frame) == 0:
-                self.log.debug("<<< received null frame, dropping")
+            if data is None:
                 return None
 
-            # continuation frame in response?
-            type = frame[0]
-
-            if type & 0b00100000:
-                self.log.debug("0x%02x CONT: %d bytes", type, len(frame) - 1)
-                data = data + frame[1:]
-                frame = self.proto.send(bytearray([type]))
-                continue
-
-            self.log.debug("0x%02x FIN:  %d bytes", type, len(frame) - 1)
-            data = bytearray([type]) + data + frame[1:]
-
-            self.log.debug("<<< %r (%d bytes)", data, len(data))
-
-            try:
-                msg = Message.decode(data)
-                self.log.debug("<<< = %r", msg)
-                return msg
-            except DecodeError as err:
-                self.log.debug("Error decoding message %r: %s", data, err)
-                return None
+            self.log.debug("<<< %d bytes", len(data))
+            msg = Message.decode(data)
+            self.log.debug("<<< = %r", msg)
+            return msg
+        except DecodeError as err:
+            self.log.debug("Error decoding message: %s", err)
+            return None
 
     def close(self):
         self.clf.close()
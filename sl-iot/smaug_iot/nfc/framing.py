@@ -0,0 +1,126 @@
+import logging
+from .messages import DecodeError
+
+# Set in the type byte of all but the last frame of a message
+CONTINUATION = 0b00100000
+
+# Largest frame sent, the ISO-DEP default frame size of 256 bytes less
+# the block header and CRC
+FRAME_SIZE = 253
+
+# Largest message accepted from the phone
+MAX_MESSAGE_SIZE = 64 * 1024
+
+
+def fragment(data, frame_size=FRAME_SIZE):
+    """Split an encoded message (type byte and payload) into frames of at
+    most frame_size bytes. Each frame starts with the type byte, with
+    CONTINUATION set on all but the last frame. A message that fits in
+    one frame is returned as is."""
+    if len(data) <= frame_size:
+        return [data]
+
+    if frame_size < 2:
+        raise ValueError(f"Frame size {frame_size} too small")
+
+    payload = memoryview(data)[1:]
+    last = bytes([data[0]])
+    continuation = bytes([data[0] | CONTINUATION])
+    chunk = frame_size - 1
+    frames = []
+
+    for start in range(0, len(payload), chunk):
+        end = start + chunk
+        frames.append((continuation if end < len(payload) else last)
+                      + payload[start:end])
+
+    return frames
+
+
+class Reassembler(object):
+    """Reassembles a message from the frames received from the phone:
+    continuation frames carry parts of the payload, and the last frame
+    the rest and the type of the message. The frames are kept as
+    received and joined once, when the last one arrives, so the cost is
+    linear in the message size. Messages longer than max_size bytes are
+    rejected.
+
+    """
+
+    def __init__(self, max_size=MAX_MESSAGE_SIZE):
+        self.max_size = max_size
+        self.frames = []
+        self.length = 0
+
+    def reset(self):
+        self.frames = []
+        self.length = 0
+
+    def add(self, frame):
+        """Add a frame, returns True if it was the last frame of the
+        message. Raises DecodeError if the message grows too large."""
+        self.length += len(frame)
+
+        if self.length > self.max_size:
+            self.reset()
+            raise DecodeError(f"Message longer than {self.max_size} bytes")
+
+        self.frames.append(frame)
+        return not frame[0] & CONTINUATION
+
+    def message(self):
+        """Join the frames added since reset into the message"""
+        frames = self.frames
+
+        if len(frames) == 1:
+            return frames[0]
+
+        return b''.join([frames[-1][:1]] + [frame[1:] for frame in frames])
+
+
+class Framer(object):
+    """Sends messages in frames of at most frame_size bytes and
+    reassembles the reply. send is called with each frame and returns
+    the next frame from the phone, or None if the connection was lost.
+
+    A continuation frame is acknowledged by a frame holding only the
+    type byte before the next frame is sent, in both directions.
+
+    """
+
+    def __init__(self, send, frame_size=FRAME_SIZE,
+                 max_size=MAX_MESSAGE_SIZE):
+        self.log = logging.getLogger(self.__class__.__name__)
+        self.send = send
+        self.frame_size = frame_size
+        self.reassembler = Reassembler(max_size=max_size)
+
+    def exchange(self, data):
+        """Send the encoded message and return the reply, or None"""
+        frames = fragment(data, self.frame_size)
+
+        for frame in frames[:-1]:
+            self.log.debug("0x%02x CONT: sending %d bytes",
+                           frame[0], len(frame) - 1)
+
+            if not self.send(frame):
+                self.log.debug("<<< no acknowledgement, dropping")
+                return None
+
+        frame = self.send(frames[-1])
+        self.reassembler.reset()
+
+        while True:
+            if frame is None or len(frame) == 0:
+                self.log.debug("<<< received null frame, dropping")
+                return None
+
+            type = frame[0]
+
+            if not self.reassembler.add(frame):
+                self.log.debug("0x%02x CONT: %d bytes", type, len(frame) - 1)
+                frame = self.send(bytes([type]))
+                continue
+
+            self.log.debug("0x%02x FIN:  %d bytes", type, len(frame) - 1)
+            return self.reassembler.message()
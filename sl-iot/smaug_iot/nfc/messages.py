@@ -1,90 +1,142 @@
-from abc import ABC
+from operator import itemgetter
 import msgpack
 
+# Payload encodings of the NFC protocol versions: version 1 encodes the
+# fields of a message as a msgpack map, version 2 as a msgpack array in
+# the order of FIELDS. The version is selected by the phone with the AID
+# it selects (see comm.AIDS).
+PROTOCOL_MAP = 1
+PROTOCOL_ARRAY = 2
+
 
 class DecodeError(Exception):
     pass
 
 
-class Message(ABC):
+class MessageType(type):
+    """Metaclass of messages: adds a read-only attribute for each of the
+    FIELDS of a message class, and the class to the type table of
+    Message"""
+
+    def __new__(mcls, name, bases, namespace, **kwargs):
+        namespace['__slots__'] = ()
+
+        for i, field in enumerate(namespace.get('FIELDS', ())):
+            namespace[field] = property(itemgetter(i))
+
+        cls = super().__new__(mcls, name, bases, namespace, **kwargs)
+
+        if 'TYPE' in namespace:
+            if cls.TYPE in Message._TYPES:
+                raise TypeError(f"Type {hex(cls.TYPE)} of {name} already "
+                                f"used by {Message._TYPES[cls.TYPE]!r}")
+
+            cls._HEADER = bytes([cls.TYPE])
+            Message._TYPES[cls.TYPE] = cls
+
+        return cls
+
+
+class Message(tuple, metaclass=MessageType):
+    """NFC message, an immutable tuple of the values of its FIELDS that
+    are also readable as attributes. Message classes are looked up by
+    their TYPE from a table when decoding."""
+
     FIELDS = ()
-    _TYPES = []
+    # message type -> class
+    _TYPES = {}
 
-    def __init_subclass__(cls, *args, **kwargs):
-        # print("__init_subclass__:", cls, args, kwargs)
-        Message._TYPES.append(cls)
-        return super().__init_subclass__(*args, **kwargs)
+    def __new__(cls, *args, **kwargs):
+        fields = cls.FIELDS
 
-    def __init__(self, *args, **kwargs):
-        super().__setattr__('_values', {})
+        if not kwargs and len(args) == len(fields):
+            return tuple.__new__(cls, args)
 
-        if len(args) > len(self.FIELDS):
+        if len(args) > len(fields):
             raise DecodeError(f"More initializer values than fields: "
-                              f"{args!r} vs {self.FIELDS!r}")
-
-        for i, value in enumerate(args):
-            self._values[self.FIELDS[i]] = value
+                              f"{args!r} vs {fields!r}")
 
-        for field, value in kwargs.items():
-            if field in self._values:
+        for field in kwargs:
+            if field not in fields:
                 raise DecodeError(
-                    f"Field {field!r} already defined by array arguments")
+                    f"Field {field!r} is not defined for this record type")
 
-            if field not in self.FIELDS:
+            if fields.index(field) < len(args):
                 raise DecodeError(
-                    f"Field {field!r} is not defined for this record type")
+                    f"Field {field!r} already defined by array arguments")
 
-            self._values[field] = value
+        missing = set(fields[len(args):]) - set(kwargs)
 
-        if len(self._values.keys()) != len(self.FIELDS):
+        if missing:
             raise DecodeError(f"Not all fields were initialized, missing: "
-                              f"{set(self.FIELDS) - set(self._values.keys())}")
+                              f"{missing}")
+
+        return tuple.__new__(cls, args + tuple(kwargs[field] for field
+                                               in fields[len(args):]))
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    def values(self):
+        return tuple(self)
 
-    def __getattr__(self, field):
-        if field not in self._values:
-            raise DecodeError(f"{field} not recognized")
-        return self._values[field]
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple.__eq__(self, other)
 
-    def __setattr__(self, field, value):
-        assert False, (field, value)
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = tuple.__hash__
 
     def __str__(self):
         return (self.__class__.__name__
                 + "{"
-                + ','.join(f"{k}={v!r}" for k, v in self._values.items())
+                + ','.join(f"{k}={v!r}" for k, v in zip(self.FIELDS, self))
                 + "}")
 
     __repr__ = __str__
 
-    def encode(self):
-        return bytes([self.TYPE]) + msgpack.packb(self._values)
+    def encode(self, protocol=PROTOCOL_MAP):
+        if protocol == PROTOCOL_ARRAY:
+            return self._HEADER + msgpack.packb(self)
+
+        return self._HEADER + msgpack.packb(dict(zip(self.FIELDS, self)))
 
     @classmethod
     def decode(cls, data):
+        """Decode a message of either protocol version"""
         if len(data) < 1:
             raise DecodeError("No message to decode")
 
-        type_value = int(data[0])
+        cls = Message._TYPES.get(data[0])
+
+        if cls is None:
+            raise DecodeError(f"Type {hex(data[0])} not a known record type")
+
+        try:
+            unpacked = msgpack.unpackb(data[1:])
+        except ValueError as ex:
+            raise DecodeError(f"Invalid payload: {ex}")
+
+        fields = cls.FIELDS
+
+        if isinstance(unpacked, dict):
+            if len(unpacked) == len(fields):
+                try:
+                    return tuple.__new__(cls, [unpacked[field]
+                                               for field in fields])
+                except KeyError:
+                    pass
 
-        for cls in Message._TYPES:
-            # print(type_value, cls, cls.TYPE)
-            if cls.TYPE == type_value:
-                unpacked = msgpack.unpackb(data[1:])
-                return cls(**unpacked)
+            return cls(**unpacked)
 
-        # # # print(Message._TYPES, type_value, data[1:].hex())
-        # # # super kludge to work around things in moshipack in the
-        # # # client I do not have time to fix
-        # # if 'type' in unpacked:
-        # #     del unpacked['type']
+        if isinstance(unpacked, list):
+            if len(unpacked) == len(fields):
+                return tuple.__new__(cls, unpacked)
 
-        # # print("unpacked:", unpacked)
-        # for cls in Message._TYPES:
-        #     # print(type_value, cls, cls.TYPE)
-        #     if cls.TYPE == type_value:
-        #         return cls(**unpacked)
+            return cls(*unpacked)
 
-        raise DecodeError(f"Type {hex(type_value)} not a known record type")
+        raise DecodeError(f"Payload is not a map or an array: {unpacked!r}")
 
 
 class Announce(Message):
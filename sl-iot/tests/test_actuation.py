@@ -0,0 +1,64 @@
+import asyncio
+import time
+import pytest
+from smaug_iot.controllers.actuation import ActuationQueue
+
+
+class Lock(object):
+    def __init__(self):
+        self.locked = True
+        self.writes = []
+
+    def actuate(self, locked):
+        self.locked = bool(locked)
+        self.writes.append((locked, time.monotonic()))
+
+
+def test_coalesce():
+    lock = Lock()
+    queue = ActuationQueue(lock.actuate, lambda: lock.locked)
+
+    async def run():
+        return await asyncio.gather(*(queue.submit(locked)
+                                      for locked in (0, 1, 0)))
+
+    acks = asyncio.run(run())
+    assert [ack["requested"] for ack in acks] == [0, 1, 0]
+    assert {ack["state"] for ack in acks} == {0}
+    assert {ack["coalesced"] for ack in acks} == {3}
+    assert len(lock.writes) == 1
+    assert queue.stats()["coalesced"] == 2
+    assert queue.stats()["max_depth"] == 3
+    assert queue.depth == 0
+
+
+def test_min_interval():
+    lock = Lock()
+    queue = ActuationQueue(lock.actuate, lambda: lock.locked, 0.05)
+
+    async def run():
+        first = await queue.submit(0)
+        # superseded within the interval, so the lock stays unlocked
+        rest = await asyncio.gather(queue.submit(1), queue.submit(0))
+        second = await queue.submit(1)
+        return first, rest, second
+
+    first, rest, second = asyncio.run(run())
+    assert first["written"]
+    assert [ack["written"] for ack in rest] == [False, False]
+    assert rest[0]["latency"] >= 0.04
+    assert second["written"] and second["state"] == 1
+    assert lock.writes[1][1] - lock.writes[0][1] >= 0.05
+    assert queue.stats()["skipped"] == 1
+
+
+def test_actuation_error():
+    def fail(locked):
+        raise OSError("no GPIO")
+
+    queue = ActuationQueue(fail, lambda: True)
+
+    with pytest.raises(OSError):
+        asyncio.run(queue.submit(0))
+
+    assert queue.task is None
@@ -0,0 +1,105 @@
+import asyncio
+import gzip
+import json
+import threading
+from smaug_iot.controllers.audit import AuditLog
+
+
+def record(i, allowed=True):
+    return {"time": 1000 + i, "id": str(i), "token": "ab", "actions": [],
+            "allowed_actions": [], "valid": allowed, "allowed": allowed,
+            "latency": 0.001}
+
+
+def test_ring():
+    audit = AuditLog(size=3)
+
+    for i in range(5):
+        audit.record(record(i))
+
+    # without a file or publisher, the last records are kept for queries
+    assert [r["id"] for r in audit.query()] == ["2", "3", "4"]
+    assert audit.query(since=1003, limit=1) == [record(4)]
+    # and nothing is waiting to be written
+    assert audit.stats()["pending"] == 0
+    assert audit.stats()["dropped"] == 0
+
+
+def test_write_and_rotate(tmp_path):
+    path = str(tmp_path / "audit.jsonl.gz")
+    batches = []
+    audit = AuditLog(path=path, max_bytes=1, backups=2, interval=0.01,
+                     batch=2, publisher=batches.append)
+
+    async def run():
+        audit.start()
+
+        for i in range(5):
+            audit.record(record(i, allowed=i % 2 == 0))
+
+        await asyncio.sleep(0.1)
+        audit.record(record(5))
+        audit.stop()
+
+    asyncio.run(run())
+    assert [len(batch) for batch in batches] == [2, 2, 1, 1]
+
+    # each write rotated, the oldest file was removed
+    assert audit.files() == [path + ".2", path + ".1"]
+    with gzip.open(path + ".1", "rt") as f:
+        assert [json.loads(line)["id"] for line in f] == ["5"]
+
+    assert [r["id"] for r in audit.query()] == ["4", "5"]
+    assert [r["id"] for r in audit.query(allowed=True, limit=1)] == ["5"]
+    assert audit.stats()["rotations"] == 4
+
+
+def test_query_pending(tmp_path):
+    audit = AuditLog(path=str(tmp_path / "audit.jsonl.gz"), batch=2)
+    audit.record(record(0))
+    audit.write(audit.take())
+    audit.record(record(1))
+    assert [r["id"] for r in audit.query()] == ["0", "1"]
+    assert audit.query(id="1") == [record(1)]
+
+
+def test_read_while_writing(tmp_path):
+    path = str(tmp_path / "audit.jsonl.gz")
+    audit = AuditLog(path=path, batch=2)
+    audit.record(record(0))
+    audit.write(audit.take())
+    records = audit.read()
+    assert next(records)["id"] == "0"
+
+    # writes are not blocked by a query in progress, and records
+    # written after the query started are not read twice
+    audit.record(record(1))
+    writer = threading.Thread(target=audit.write, args=(audit.take(),),
+                              daemon=True)
+    writer.start()
+    writer.join(1)
+    assert not writer.is_alive()
+    assert list(records) == []
+    assert [r["id"] for r in audit.query()] == ["0", "1"]
+
+    # a member cut short by a crash
+    member = gzip.compress(json.dumps(record(2)).encode() + b'\n')
+
+    with open(path, 'ab') as f:
+        f.write(member[:len(member) // 2])
+
+    assert [r["id"] for r in audit.query()] == ["0", "1"]
+
+
+def test_query_in_flight(tmp_path):
+    audit = AuditLog(path=str(tmp_path / "audit.jsonl.gz"), batch=2)
+
+    for i in range(3):
+        audit.record(record(i))
+
+    # a batch taken to be written is still found until it is written
+    records = audit.take()
+    assert [r["id"] for r in audit.query()] == ["0", "1", "2"]
+    audit.write(records)
+    assert audit.in_flight == []
+    assert [r["id"] for r in audit.query()] == ["0", "1", "2"]
@@ -0,0 +1,57 @@
+import marshmallow
+import pytest
+from smaug_iot.controllers.access import AccessSchema
+from smaug_iot.controllers.codec import Codec, codec_for, FORMATS
+
+
+@pytest.mark.parametrize("trusted", [False, True])
+def test_access_decode(trusted):
+    codec = Codec(AccessSchema, trusted=trusted)
+    data = codec.decode(b'{"id": "1", "token": "t", "actions": ["lock"]}')
+    assert data == {"id": "1", "token": "t", "actions": ["lock"],
+                    "allowed": False}
+
+    data = codec.decode(b'{"token": "t", "expires": null}')
+    assert data["id"] is None
+    assert data["actions"] == ["lock", "unlock", "state"]
+    assert data["expires"] is None
+
+
+@pytest.mark.parametrize("trusted", [False, True])
+@pytest.mark.parametrize("payload", [
+    b'{"id": "1"}',
+    b'{"token": 1}',
+    b'{"token": "t", "actions": "lock"}',
+    b'[]',
+])
+def test_access_invalid(trusted, payload):
+    with pytest.raises(marshmallow.ValidationError):
+        Codec(AccessSchema, trusted=trusted).decode(payload)
+
+
+def test_trusted_deserializes_other_fields():
+    data = Codec(AccessSchema, trusted=True).decode(
+        b'{"token": "t", "expires": "2020-01-02T03:04:05+00:00"}')
+    assert data["expires"].year == 2020
+
+
+def test_encode():
+    codec = codec_for(AccessSchema)
+    assert codec is codec_for(AccessSchema)
+    assert codec.decode(codec.encode(
+        {"id": "1", "token": "t", "actions": ("lock",)}))["actions"] == [
+            "lock"]
+    assert codec_for(int).decode(b"1") == 1
+    assert codec_for().encode(1) == b"1"
+
+
+@pytest.mark.parametrize("content_type", list(FORMATS.values()))
+def test_content_types(content_type):
+    codec = codec_for(AccessSchema)
+    payload = codec.encode({"id": "1", "token": "t", "allowed": True},
+                           content_type)
+    data = codec.decode(payload, content_type)
+    assert data["token"] == "t" and data["allowed"] is True
+
+    with pytest.raises(ValueError):
+        codec.decode(payload, "application/unknown")
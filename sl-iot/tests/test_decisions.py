@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+import pytest
+import pytz
+from smaug_iot.controllers.access import AccessController
+from smaug_iot.controllers.decisions import \
+    DecisionCache, SingleFlight, TokenAllowlist, token_digest
+
+
+def decision(valid=True, seconds=3600, actions=("lock", "unlock")):
+    return (valid, actions,
+            datetime.now(tz=pytz.utc) + timedelta(seconds=seconds))
+
+
+def test_hit_and_miss():
+    cache = DecisionCache()
+    assert cache.get("a") is None
+    cache.put("a", decision())
+    assert cache.get("a")[0] is True
+    assert cache.stats()["hit_ratio"] == 0.5
+    assert b"a" not in b"".join(cache.entries)
+
+
+def test_lifetime():
+    cache = DecisionCache(max_ttl=300, negative_ttl=0.05)
+
+    # expired and denied tokens
+    cache.put("expired", decision(seconds=-1))
+    cache.put("denied", decision(valid=False))
+    assert cache.get("expired") is None
+    assert cache.get("denied") is not None
+
+    # lifetime is bounded by the token expiry
+    cache.put("short", decision(seconds=0.05))
+    time.sleep(0.1)
+    assert cache.get("denied") is None
+    assert cache.get("short") is None
+    assert len(cache) == 0
+
+
+def test_lru_eviction():
+    cache = DecisionCache(max_entries=2)
+    cache.put("a", decision())
+    cache.put("b", decision())
+    cache.get("a")
+    cache.put("c", decision())
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["evictions"] == 1
+
+    cache = DecisionCache(max_bytes=DecisionCache.ENTRY_OVERHEAD * 3)
+    for token in "abcd":
+        cache.put(token, decision())
+    assert len(cache) == 2
+    assert cache.bytes <= cache.max_bytes
+
+
+def test_invalidate():
+    cache = DecisionCache()
+    cache.put("a", decision())
+    cache.put("b", decision())
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    cache.invalidate()
+    assert len(cache) == 0 and cache.bytes == 0
+
+
+def test_stale():
+    cache = DecisionCache(max_ttl=0.05, max_stale=60)
+    cache.put("a", decision())
+    cache.put("expiring", decision(seconds=0.15))
+    cache.put("denied", decision(valid=False))
+    assert cache.get_stale("denied") is None
+    time.sleep(0.1)
+
+    # stale results are kept, but only returned by get_stale
+    assert cache.get("a") is None
+    assert cache.get_stale("a")[0] is True
+    assert cache.get_stale("expiring") is not None
+
+    # never past the token expiry
+    time.sleep(0.1)
+    assert cache.get("expiring") is None
+    assert cache.get_stale("expiring") is None
+    assert len(cache) == 2
+    assert cache.stats()["stale_hits"] == 2
+
+
+def test_allowlist():
+    allowlist = TokenAllowlist(max_entries=3)
+    now = time.time()
+    allowlist.add(token_digest("a"), ["lock"], now + 60, "1")
+    allowlist.add(token_digest("b"), ["lock"], now + 0.05)
+    allowlist.add(token_digest("expired"), ["lock"], now - 1)
+    assert allowlist.get("a") == (("lock",), now + 60, "1")
+    assert allowlist.get("expired") is None
+    assert len(allowlist) == 2
+
+    # equal actions are shared
+    assert allowlist.entries[token_digest("a")][1] is \
+        allowlist.entries[token_digest("b")][1]
+
+    # the entries expiring first are evicted
+    allowlist.add(token_digest("c"), ["unlock"], now + 30)
+    allowlist.add(token_digest("d"), ["unlock"], now + 90)
+    assert allowlist.get("b") is None
+    assert allowlist.get("c") is not None
+    assert allowlist.stats()["evictions"] == 1
+
+    # replaced entries keep their new expiry
+    allowlist.add(token_digest("c"), ["unlock"], now + 120)
+    allowlist.add(token_digest("e"), ["unlock"], now + 100)
+    assert allowlist.get("c") is not None
+    assert allowlist.get("a") is None
+    assert len(allowlist) == 3
+
+
+def test_allowlist_expiry():
+    allowlist = TokenAllowlist()
+    allowlist.add(token_digest("a"), ["lock"], time.time() + 0.05)
+    time.sleep(0.1)
+    allowlist.add(token_digest("b"), ["lock"], time.time() + 60)
+    assert len(allowlist) == 1
+    assert allowlist.stats()["expired"] == 1
+
+
+def test_provision_wildcard_prefix():
+    async def run(prefix):
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--prefix", default="")
+        AccessController.augment_parser(parser)
+        controller = AccessController(parser.parse_args(["--prefix",
+                                                         prefix]))
+        await controller.provision_message(json.dumps({
+            "digest": token_digest("a").hex()}).encode(), {})
+        controller.uninitialize()
+        return controller.allowlist.get("a")
+
+    assert asyncio.run(run("/locker/1")) is not None
+    # a token provisioned for one locker is not allowed at all of them
+    assert asyncio.run(run("/locker/+")) is None
+
+
+def test_single_flight():
+    calls = []
+
+    async def check(token):
+        calls.append(token)
+        await asyncio.sleep(0.01)
+        return token.upper()
+
+    async def run():
+        flights = SingleFlight()
+        results = await asyncio.gather(
+            *(flights.run(token, check, token) for token in "aaab"))
+        assert results == ["A", "A", "A", "B"]
+        assert flights.stats() == {"in_flight": 0, "calls": 2,
+                                   "coalesced": 2}
+
+        # later calls are not coalesced
+        await flights.run("a", check, "a")
+        assert flights.calls == 3
+
+    asyncio.run(run())
+    assert calls == ["a", "b", "a"]
+
+
+def test_single_flight_error_and_cancel():
+    release = None
+
+    async def check():
+        await release.wait()
+        raise ValueError("failed")
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        flights = SingleFlight()
+        first = asyncio.ensure_future(flights.run("a", check))
+        second = asyncio.ensure_future(flights.run("a", check))
+        await asyncio.sleep(0)
+
+        # cancelling the first caller does not cancel the call
+        first.cancel()
+        release.set()
+
+        with pytest.raises(ValueError):
+            await second
+
+    asyncio.run(run())
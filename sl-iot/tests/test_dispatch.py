@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+from smaug_iot.controllers.dispatch import TopicTrie, Dispatcher
+
+
+@pytest.mark.parametrize(
+    "topic_filter,topic,matches",
+    [
+        ("/lock", "/lock", True),
+        ("/lock", "/lock/state", False),
+        ("/lock/+", "/lock/state", True),
+        ("/lock/+", "/lock", False),
+        ("/lock/#", "/lock", True),
+        ("/lock/#", "/lock/state/x", True),
+        ("+/lock", "/lock", True),
+        ("#", "/lock/state", True),
+        ("#", "$SYS/broker", False),
+        ("+/broker", "$SYS/broker", False),
+        ("$SYS/#", "$SYS/broker", True),
+    ])
+def test_trie_match(topic_filter, topic, matches):
+    trie = TopicTrie()
+    trie.insert(topic_filter, "value")
+    assert trie.match(topic) == (["value"] if matches else [])
+
+
+def test_trie_remove():
+    trie = TopicTrie()
+    trie.insert("a/+", 1)
+    trie.insert("a/b", 2)
+    assert sorted(trie.match("a/b")) == [1, 2]
+    trie.remove("a/+", 1)
+    assert trie.match("a/b") == [2]
+
+
+def test_dispatch():
+    calls = []
+
+    def make(name):
+        async def fn(payload, properties):
+            calls.append((name, payload))
+        return fn
+
+    dispatcher = Dispatcher("locker1")
+    a = dispatcher.add("/lock", make("a"))
+    dispatcher.add("/lock", make("b"))
+    c = dispatcher.add("/lock/+", make("c"))
+
+    assert a.topic_filter == "locker1/lock"
+    assert len(dispatcher) == 2
+
+    async def run():
+        # by subscription identifier
+        await dispatcher.dispatch(
+            "locker1/lock", b"1", {"subscription_identifier": [a.subid]})
+        assert sorted(calls) == [("a", b"1"), ("b", b"1")]
+        calls.clear()
+
+        await dispatcher.dispatch(
+            "locker1/lock/state", b"", {"subscription_identifier": [c.subid]})
+        assert calls == [("c", b"")]
+        calls.clear()
+
+        # by topic name
+        assert await dispatcher.dispatch("locker1/lock/state", b"", {}) == 1
+        assert await dispatcher.dispatch("locker2/lock", b"", {}) == 0
+
+    asyncio.run(run())
+
+
+def test_route_share():
+    def make(share):
+        async def fn(payload, properties):
+            pass
+        fn.share = share
+        return fn
+
+    dispatcher = Dispatcher()
+    assert dispatcher.add("/access", make("access")).share == "access"
+    assert dispatcher.add("/a", make(None)).share is None
+
+    # shared only if all handlers of the topic are in the same group
+    assert dispatcher.add("/access", make("access")).share == "access"
+    assert dispatcher.add("/access", make(None)).share is None
+    assert dispatcher.add("/access", make("access")).share is None
@@ -0,0 +1,99 @@
+import argparse
+import types
+from smaug_iot.controllers.abstract import MultiController
+from smaug_iot.controllers.fleet import (
+    FleetAccessController, LoadController, SimulatedLockController, KINDS,
+    access_argv, locker_argv, merge, shard_result, split)
+from smaug_iot.controllers.main import Main, parse_host
+
+
+def fleet_args(**kwargs):
+    args = dict(lockers=10, processes=3, server=parse_host("broker:1884"),
+                client_id='fleet', prefix='/fleet', payload_format='cbor',
+                access_processes=1, access_cost=0, access_latency=0,
+                access_rate=2, lock_rate=0, state_rate=0.5,
+                arrival='uniform', token="1;all;9999", timeout=5)
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def parse(main, controller, argv):
+    parser = main.get_parser()
+    controller.augment_parser(parser)
+    return parser.parse_args(argv)
+
+
+def test_locker_argv():
+    main = Main("fleet-7", None)
+    args = parse(main, MultiController(SimulatedLockController,
+                                       LoadController),
+                 locker_argv(fleet_args(), 7))
+    assert args.server == ("broker", 1884)
+    assert args.client_id == "fleet-7"
+    assert args.prefix == "/fleet/7"
+    assert args.payload_format == 'cbor'
+    assert (args.access_rate, args.lock_rate, args.state_rate) == (2, 0, 0.5)
+    assert args.arrival == 'uniform'
+    assert args.timeout == 5
+
+
+def test_access_argv():
+    main = Main("fleet-access", None)
+    args = parse(main, FleetAccessController, access_argv(fleet_args(), 0))
+    assert args.client_id == "fleet-access-0"
+    assert args.prefix == "/fleet/+"
+    assert args.share_group is None
+
+    args = parse(main, FleetAccessController,
+                 access_argv(fleet_args(access_processes=2,
+                                        access_latency=0.1), 1))
+    assert args.client_id == "fleet-access-1"
+    assert args.share_group == "fleet-access"
+    assert args.access_latency == 0.1
+    assert args.cache_entries == 0
+
+
+def test_split():
+    shards = split(fleet_args())
+    assert [(first, count) for args, first, count in shards] == [
+        (0, 4), (4, 4), (8, 2)]
+    assert len(split(fleet_args(lockers=2, processes=4))) == 2
+
+
+def locker(received, published, latencies=(), failures=0, known=True):
+    load = LoadController(fleet_args())
+    load.skipped = 1
+    load.failures['access'] = failures
+
+    for value in latencies:
+        load.latency['access'].observe(value)
+
+    if known:
+        load.lock_state.known = True
+
+    return types.SimpleNamespace(
+        received=received, published=published,
+        controller=types.SimpleNamespace(controllers=[None, load]))
+
+
+def test_merge():
+    failed = types.SimpleNamespace(received=1, published=0)
+    first = shard_result([locker(10, 20, [0.01, 0.02], failures=1),
+                          locker(5, 6, [0.03], known=False), failed],
+                         cpu=1.5, elapsed=10)
+    assert first['received'] == 16 and first['published'] == 26
+    assert first['connected'] == 1 and first['skipped'] == 2
+    assert first['latency']['access'].count == 3
+    assert first['failures']['access'] == 1
+
+    second = shard_result([locker(1, 2, [0.5], failures=2)],
+                          cpu=0.5, elapsed=12)
+    total = merge([first, second])
+    assert total['cpu'] == 2 and total['elapsed'] == 12
+    assert total['received'] == 17 and total['published'] == 28
+    assert total['connected'] == 2 and total['skipped'] == 3
+    assert total['latency']['access'].count == 4
+    assert total['latency']['access'].max == 0.5
+    assert total['failures'] == {'access': 3, 'lock': 0, 'state': 0}
+    assert all(total['latency'][kind].count == 0
+               for kind in KINDS if kind != 'access')
@@ -0,0 +1,85 @@
+import asyncio
+import time
+import pytest
+from smaug_iot.controllers.iaa import \
+    CircuitBreaker, CircuitOpen, IaaClient, IaaError
+
+
+def client(answers, **kwargs):
+    """IaaClient whose requests take (delay, status or exception) from
+    answers in turn"""
+    iaa = IaaClient("http://iaa.invalid/", **kwargs)
+    answers = iter(answers)
+
+    async def request(token):
+        iaa.requests += 1
+        delay, result = next(answers)
+        await asyncio.sleep(delay)
+
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+    iaa.request = request
+    return iaa
+
+
+def test_breaker():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0.05)
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    # a single trial call when half open, its failure opens again
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow() and breaker.allow()
+    assert breaker.stats()["opens"] == 2
+
+
+def test_retry_and_hedge():
+    async def run():
+        # a failed request is retried
+        iaa = client([(0, IaaError("down")), (0, 200)], hedge_delay=0)
+        assert await iaa.check("t") is True
+        assert (iaa.requests, iaa.retries, iaa.hedges) == (2, 1, 0)
+
+        # a slow request is hedged and the first answer wins
+        iaa = client([(1, 200), (0, 401)], hedge_delay=0.01)
+        assert await iaa.check("t") is False
+        assert (iaa.requests, iaa.retries, iaa.hedges) == (2, 0, 1)
+
+        # all attempts failing is an error
+        iaa = client([(0, IaaError("down"))] * 2, hedge_delay=0)
+        with pytest.raises(IaaError):
+            await iaa.check("t")
+
+    asyncio.run(run())
+
+
+def test_deadline_and_breaker():
+    async def run():
+        iaa = client([(1, 200)] * 2, timeout=0.02, hedge_delay=0.01,
+                     breaker=CircuitBreaker(threshold=1))
+        with pytest.raises(IaaError):
+            await iaa.check("t")
+        assert iaa.timeouts == 1
+
+        # fails fast without requests while open
+        with pytest.raises(CircuitOpen):
+            await iaa.check("t")
+        assert iaa.requests == 2 and iaa.rejected == 1
+
+    asyncio.run(run())
@@ -0,0 +1,135 @@
+import asyncio
+from smaug_iot.controllers.dispatch import Dispatcher
+from smaug_iot.controllers.loopback import Loopback
+from smaug_iot.controllers.scheduler import Scheduler
+
+
+def loopback(handlers, mirror=False, limit=None, shared=()):
+    # set up as Main does, under a prefix
+    dispatcher = Dispatcher("locker1")
+    scheduler = Scheduler()
+    published = []
+
+    for topic, fn in handlers:
+        dispatcher.add(topic, fn)
+
+    for route in dispatcher:
+        route.queue = scheduler.queue(route.topic_filter, limit=limit)
+
+    return Loopback(dispatcher, scheduler,
+                    lambda topic, payload, **kwargs:
+                    published.append((topic, payload, kwargs)),
+                    mirror=mirror,
+                    shared=lambda route: route.topic in shared), published
+
+
+def test_local():
+    received = []
+
+    async def fn(payload, properties):
+        received.append((payload, properties))
+
+    async def run():
+        lb, published = loopback([("/lock", fn)])
+        lb.publish("locker1/lock", 1, response_topic="locker1/r")
+        lb.publish("locker1/other", b"x")
+        await lb.scheduler.join()
+        return lb, published
+
+    lb, published = asyncio.run(run())
+    assert received == [(b"1", {'response_topic': ["locker1/r"]})]
+    assert published == [("locker1/other", b"x",
+                          {'qos': 0, 'retain': False})]
+    assert lb.stats() == {"local": 1, "remote": 1}
+
+
+def test_mirror_and_retain():
+    received = []
+
+    async def fn(payload, properties):
+        received.append(payload)
+
+    async def run(mirror, retain):
+        lb, published = loopback([("/lock/state", fn)], mirror=mirror)
+        lb.publish("locker1/lock/state", b"1", retain=retain)
+        await lb.scheduler.join()
+        return published
+
+    assert asyncio.run(run(False, False)) == []
+    assert asyncio.run(run(True, False)) == [
+        ("locker1/lock/state", b"1", {'qos': 0, 'retain': False})]
+    assert asyncio.run(run(False, True)) == [
+        ("locker1/lock/state", b"1", {'qos': 0, 'retain': True})]
+    assert received == [b"1"] * 3
+
+
+def test_shared():
+    received = []
+
+    async def fn(payload, properties):
+        received.append(payload)
+
+    async def run(retain):
+        lb, published = loopback([("/access", fn), ("/access/+", fn)],
+                                 mirror=True, shared={"/access"})
+        lb.publish("locker1/access", b"1", retain=retain)
+        lb.publish("locker1/access/x", b"2", retain=retain)
+        await lb.scheduler.join()
+        return published
+
+    # shared subscriptions have no no local, a mirrored request would
+    # come back from the broker and be handled twice
+    assert asyncio.run(run(False)) == [
+        ("locker1/access/x", b"2", {'qos': 0, 'retain': False})]
+    assert received == [b"1", b"2"]
+
+    # sent anyway, so it is left to the broker to deliver
+    received.clear()
+    assert asyncio.run(run(True)) == [
+        ("locker1/access", b"1", {'qos': 0, 'retain': True}),
+        ("locker1/access/x", b"2", {'qos': 0, 'retain': True})]
+    assert received == [b"2"]
+
+
+def test_absolute():
+    received = []
+
+    async def fn(payload, properties):
+        received.append(payload)
+
+    async def run():
+        lb, published = loopback([("/lock", fn)])
+        # an absolute topic is published as is, without the prefix
+        lb.publish("/lock", b"0")
+        await lb.scheduler.join()
+        return published
+
+    assert asyncio.run(run()) == [("/lock", b"0",
+                                   {'qos': 0, 'retain': False})]
+    assert received == []
+
+
+def test_scheduler():
+    running = []
+    peak = []
+
+    async def fn(payload, properties):
+        running.append(payload)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(payload)
+
+    async def run():
+        lb, published = loopback([("/access", fn)], limit=2)
+        queue = lb.dispatcher.routes["/access"].queue
+
+        for i in range(5):
+            lb.publish("locker1/access", i)
+
+        assert queue.running == 2 and len(queue.queue) == 3
+        await lb.scheduler.join()
+        return queue
+
+    queue = asyncio.run(run())
+    assert max(peak) == 2
+    assert queue.handled == 5
@@ -0,0 +1,33 @@
+from smaug_iot.controllers.abstract import Controller
+from smaug_iot.controllers.main import Main
+
+
+def main(prefix):
+    main = Main("test", Controller)
+    main.prefix = prefix
+    main.sent = []
+    main.send = lambda topic, data=None, **kwargs: main.sent.append(
+        (topic, data, kwargs))
+    return main
+
+
+def test_prefix():
+    m = main("/locker/1")
+    m.publish("/lock/state", b"1", retain=True)
+    m.publish("/access", b"{}", response_topic="/rpc/x/1")
+    m.publish("/rpc/y/2", b"{}", absolute=True)
+    assert m.sent == [
+        ("/locker/1/lock/state", b"1", {'retain': True}),
+        ("/locker/1/access", b"{}", {'response_topic': "/locker/1/rpc/x/1"}),
+        ("/rpc/y/2", b"{}", {})]
+
+
+def test_wildcard_prefix():
+    m = main("/locker/+")
+    m.publish("/audit", b"[]")
+    m.publish("/audit", b"[]")
+    m.publish("/access", b"{}", response_topic="/rpc/x/1")
+    # responses go to the full response topic of the request
+    m.publish("/locker/1/rpc/x/1", b"{}", absolute=True)
+    assert m.sent == [("/locker/1/rpc/x/1", b"{}", {})]
+    assert m.skipped == {"/audit", "/access"}
@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import pytest
+from smaug_iot.controllers.multilock import (
+    GpioBatch, MockGpio, MockMultiLockController)
+
+
+def make(*argv):
+    parser = argparse.ArgumentParser()
+    MockMultiLockController.augment_parser(parser)
+    controller = MockMultiLockController(parser.parse_args(argv))
+    published = []
+    controller.set_publisher(
+        lambda topic, payload, **kwargs: published.append((topic, payload)))
+    return controller, published
+
+
+def test_doors(caplog):
+    controller, published = make("--door", "a=3", "--door", "b=5")
+    topics = {topic for topic, fn in controller.subscriptions}
+    assert topics == {"/a/lock", "/a/lock/state", "/b/lock", "/b/lock/state"}
+
+    async def initialize():
+        controller.initialize()
+
+    # Main initializes the controller in the event loop
+    asyncio.run(initialize())
+    assert sorted(published) == [("/a/lock/status", b'1'),
+                                 ("/b/lock/status", b'1')]
+    assert controller.batch.gpio.levels == {3: 0, 5: 0}
+    published.clear()
+
+    async def unlock():
+        handlers = dict(controller.subscriptions)
+        await handlers["/b/lock"](b'0', {})
+        await asyncio.sleep(0)
+
+    asyncio.run(unlock())
+    assert [topic for topic, payload in published] == ["/b/lock/status",
+                                                       "/b/lock/ack"]
+    assert published[0][1] == b'0'
+    # acknowledged to the response topic only if the command has one
+    assert "response silently dropped" not in caplog.text
+    assert controller.batch.gpio.levels == {3: 0, 5: 1}
+    doors = controller.stats()["doors"]
+    assert doors["a"]["locked"] == 1
+    assert doors["b"]["locked"] == 0
+    assert doors["b"]["actuations"] == 1
+
+
+def test_invalid_doors():
+    with pytest.raises(ValueError):
+        make()
+
+    with pytest.raises(ValueError):
+        make("--door", "a=1", "--door", "b=1")
+
+
+def test_batch():
+    gpio = MockGpio()
+    batch = GpioBatch(gpio)
+    batch.setup(set(range(10)))
+
+    async def run():
+        for pin in (0, 1, 2, 9):
+            batch.write(pin, 1)
+
+        batch.write(0, 0)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert gpio.levels == {0: 0, 1: 1, 2: 1, 3: 0, 4: 0, 5: 0, 6: 0, 7: 0,
+                           9: 1}
+    # one digitalWriteByte for pins 0-7 and a digitalWrite for pin 9
+    assert batch.stats() == {"writes": 4, "calls": 2, "flushes": 1}
@@ -0,0 +1,66 @@
+import pytest
+from smaug_iot.nfc.framing import (
+    CONTINUATION, Framer, Reassembler, fragment)
+from smaug_iot.nfc.messages import Announce, DecodeError, Message
+
+
+def test_fragment():
+    data = bytes([0x81]) + bytes(range(10))
+    assert fragment(data, 20) == [data]
+
+    frames = fragment(data, 4)
+    assert [len(frame) for frame in frames] == [4, 4, 4, 2]
+    assert [frame[0] for frame in frames] == [0x81 | CONTINUATION] * 3 + [0x81]
+    assert b''.join(frame[1:] for frame in frames) == data[1:]
+
+
+def test_reassemble():
+    reassembler = Reassembler(max_size=100)
+    data = bytes([0x81]) + bytes(range(50))
+
+    frames = fragment(data, 8)
+    assert [reassembler.add(frame) for frame in frames] == \
+        [False] * (len(frames) - 1) + [True]
+    assert reassembler.message() == data
+
+    reassembler.reset()
+    assert reassembler.add(b'\x02\x01')
+    assert reassembler.message() == b'\x02\x01'
+
+    reassembler.reset()
+
+    with pytest.raises(DecodeError):
+        for frame in fragment(bytes([0x81]) + bytes(200), 8):
+            reassembler.add(frame)
+
+
+def test_framer():
+    announce = Announce(contract_address="addr", locker_id="id",
+                        name="locker", open_close_type="open-tap-close",
+                        image_urls=[f"https://example.com/{i}.jpg"
+                                    for i in range(20)])
+    reply = bytes([0x01]) + bytes(range(100))
+    received = []
+    replies = fragment(reply, 30)
+
+    # the phone acknowledges our continuation frames with the type byte,
+    # and sends its own frames one per acknowledgement
+    def send(frame):
+        received.append(bytes(frame))
+
+        if len(frame) > 1 and frame[0] & CONTINUATION:
+            return bytes([frame[0]])
+
+        return replies.pop(0)
+
+    framer = Framer(send, frame_size=64)
+    assert framer.exchange(announce.encode()) == reply
+
+    sent = [frame for frame in received if len(frame) > 1]
+    assert all(len(frame) <= 64 for frame in sent)
+    data = bytes([sent[-1][0]]) + b''.join(frame[1:] for frame in sent)
+    assert Message.decode(data).image_urls == announce.image_urls
+
+    # lost connection
+    framer = Framer(lambda frame: None, frame_size=64)
+    assert framer.exchange(announce.encode()) is None
@@ -0,0 +1,56 @@
+import msgpack
+import pytest
+from smaug_iot.nfc.messages import (
+    Announce, DecodeError, Message, MessageType, OpenFailure, Verify,
+    VerifySuccess, PROTOCOL_ARRAY, PROTOCOL_MAP)
+
+
+def test_encoding():
+    failure = OpenFailure(message="no access", state="closed")
+
+    # version 1 is the map encoding existing phones use
+    assert failure.encode(PROTOCOL_MAP) == bytes([OpenFailure.TYPE]) + \
+        msgpack.packb({"message": "no access", "state": "closed"})
+    assert failure.encode(PROTOCOL_ARRAY) == bytes([OpenFailure.TYPE]) + \
+        msgpack.packb(["no access", "closed"])
+
+    for protocol in (PROTOCOL_MAP, PROTOCOL_ARRAY):
+        decoded = Message.decode(failure.encode(protocol))
+        assert isinstance(decoded, OpenFailure)
+        assert decoded.message == "no access"
+        assert decoded == failure
+
+        assert Message.decode(VerifySuccess().encode(protocol)) == \
+            VerifySuccess()
+
+
+def test_decode_errors():
+    with pytest.raises(DecodeError):
+        Message.decode(b'')
+
+    with pytest.raises(DecodeError):
+        Message.decode(b'\x7f\x90')
+
+    with pytest.raises(DecodeError):
+        Message.decode(bytes([Verify.TYPE]) + msgpack.packb({"x": 1}))
+
+    with pytest.raises(DecodeError):
+        Message.decode(bytes([Verify.TYPE]) + msgpack.packb([1, 2]))
+
+    with pytest.raises(DecodeError):
+        Message.decode(bytes([Verify.TYPE]) + b'\xc1')
+
+
+def test_slots():
+    announce = Announce("addr", "id", "locker", [], "open-tap-close")
+    assert not hasattr(announce, '__dict__')
+    assert announce.locker_id == "id"
+
+    with pytest.raises(AttributeError):
+        announce.name = "other"
+
+    with pytest.raises(DecodeError):
+        Verify("token", token="token")
+
+    with pytest.raises(TypeError):
+        MessageType("Duplicate", (Message,), {"TYPE": Verify.TYPE})
@@ -0,0 +1,70 @@
+import logging
+from smaug_iot.controllers.main import RECONNECT_ERROR_FILTER
+from smaug_iot.controllers.offline import Backoff, OfflineQueue, \
+    DiskOfflineQueue
+
+
+def test_backoff():
+    backoff = Backoff(1, 10)
+
+    for ceiling in (1, 2, 4, 8, 10, 10):
+        assert 0 <= backoff.delay() <= ceiling
+
+    backoff.reset()
+    assert backoff.delay() <= 1
+
+
+def test_reconnect_error_filter():
+    def record(msg):
+        return logging.LogRecord("gmqtt.client", logging.ERROR, __file__,
+                                 1, msg, (), None)
+
+    # Main reconnects itself, gmqtt giving up is not an error
+    assert not RECONNECT_ERROR_FILTER.filter(record(
+        "[Client] max number of failed connection attempts achieved"))
+    assert RECONNECT_ERROR_FILTER.filter(record("[CONNACK] 0x5"))
+
+
+def publisher(published):
+    return lambda topic, payload, **kwargs: published.append(
+        (topic, payload, kwargs))
+
+
+def test_offline_queue_order_and_drop():
+    queue = OfflineQueue(size=2)
+    queue.put("/a", b"1", {})
+    queue.put("/b", 2, {"retain": True})
+    queue.put("/c", "3", {})
+    assert queue.stats()["dropped"] == 1
+
+    published = []
+    assert queue.flush(publisher(published)) == 2
+    assert published == [("/b", b"2", {"retain": True}),
+                         ("/c", b"3", {})]
+    assert len(queue) == 0
+
+
+def test_offline_queue_flush_stops_when_disconnected():
+    queue = OfflineQueue()
+    queue.put("/a", b"1", {})
+    assert queue.flush(publisher([]), lambda: False) == 0
+    assert len(queue) == 1
+
+
+def test_disk_offline_queue(tmp_path):
+    path = str(tmp_path / "queue.db")
+    queue = DiskOfflineQueue(path, size=2)
+    queue.put("/a", b"1", {"correlation_data": b"\x00"})
+    queue.put("/b", None, {})
+    queue.close()
+
+    # messages are kept over restarts
+    queue = DiskOfflineQueue(path, size=2)
+    assert len(queue) == 2
+    queue.put("/c", b"3", {})
+    assert queue.dropped == 1
+
+    published = []
+    queue.flush(publisher(published))
+    assert published == [("/b", b"", {}), ("/c", b"3", {})]
+    queue.close()
@@ -0,0 +1,94 @@
+import asyncio
+import time
+from smaug_iot.controllers.scheduler import Scheduler
+from smaug_iot.controllers.replay import Recorder, ReplayClient, \
+    read_capture, RECEIVED, PUBLISHED
+
+
+def record(path):
+    recorder = Recorder(path)
+    recorder.record(RECEIVED, "/access", b'{"token": "t"}',
+                    {'subscription_identifier': [3],
+                     'correlation_data': [b'\x01']})
+    recorder.record(PUBLISHED, "/r", b'{}', {'retain': False})
+    recorder.record(RECEIVED, "/lock", 1, {})
+    recorder.close()
+
+
+def test_record(tmp_path):
+    path = str(tmp_path / "capture.gz")
+    record(path)
+
+    records = list(read_capture(path))
+    assert [r[1:4] for r in records] == [
+        [RECEIVED, "/access", b'{"token": "t"}'],
+        [PUBLISHED, "/r", b'{}'],
+        [RECEIVED, "/lock", b'1']]
+    assert records[0][4]['correlation_data'] == [b'\x01']
+
+
+def test_replay(tmp_path):
+    path = str(tmp_path / "capture")
+    record(path)
+    received = []
+
+    async def on_message(client, topic, payload, qos, properties):
+        received.append((topic, payload, properties))
+
+    client = ReplayClient("test")
+    client.on_message = on_message
+    start = time.monotonic()
+    assert asyncio.run(client.replay(path, speed=0)) == 2
+    assert time.monotonic() - start < 1
+
+    # subscription identifiers are dropped, the rest is kept
+    assert received == [
+        ("/access", b'{"token": "t"}', {'correlation_data': [b'\x01']}),
+        ("/lock", b'1', {})]
+
+
+def test_record_buffered(tmp_path):
+    path = str(tmp_path / "capture")
+    recorder = Recorder(path, buffer_size=20, interval=60)
+    recorder.record(RECEIVED, "/a", b'1', {})
+    # not handed to the writer until the buffer is full
+    assert len(recorder.buffer) == 1
+
+    recorder.record(RECEIVED, "/b", b'2' * 20, {})
+    assert recorder.buffer == [] and recorder.buffered == 0
+
+    recorder.record(RECEIVED, "/c", b'3', {})
+    recorder.close()
+    assert [r[2] for r in read_capture(path)] == ["/a", "/b", "/c"]
+
+
+def test_replay_full_queue(tmp_path):
+    path = str(tmp_path / "capture")
+    recorder = Recorder(path)
+
+    for i in range(300):
+        recorder.record(RECEIVED, "/access", b'{}', {})
+
+    recorder.close()
+
+    async def run():
+        scheduler = Scheduler()
+        tq = scheduler.queue("/access", limit=1, size=10)
+
+        async def handle():
+            await asyncio.sleep(0)
+
+        async def on_message(client, topic, payload, qos, properties):
+            scheduler.submit(tq, handle)
+
+        client = ReplayClient("test")
+        client.on_message = on_message
+        count = await client.replay(path, 0, scheduler.wait_for_room)
+        await scheduler.join()
+        return count, tq
+
+    # the replay waits for the handlers, nothing is dropped
+    count, tq = asyncio.run(run())
+    assert count == 300
+    assert tq.handled == 300 and tq.dropped == 0
+    assert tq.max_depth == 10
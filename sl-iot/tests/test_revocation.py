@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import base64
+import json
+from smaug_iot.controllers.revocation import \
+    BloomFilter, RevocationList, RevocationPublisher, \
+    NOT_REVOKED, REVOKED, MAYBE_REVOKED, \
+    REVOCATION_DELTA_TOPIC, REVOCATION_FILTER_TOPIC
+
+
+def test_bloom_filter():
+    bloom = BloomFilter.for_capacity(1000, 0.01)
+    assert bloom.size % 8 == 0 and bloom.hashes == 7
+
+    for jti in range(1000):
+        bloom.add(2 ** 200 + jti)
+
+    assert all(2 ** 200 + jti in bloom for jti in range(1000))
+    assert str(2 ** 200) in bloom
+
+    false_positives = sum(jti in bloom for jti in range(10000))
+    assert false_positives < 300
+    assert 0.005 < bloom.error_rate < 0.015
+
+
+def filter_message(version, *revoked):
+    bloom = BloomFilter.for_capacity(100, 0.001)
+
+    for jti in revoked:
+        bloom.add(jti)
+
+    return {"version": version, "size": bloom.size, "hashes": bloom.hashes,
+            "count": bloom.count,
+            "bits": base64.b64encode(bloom.bits).decode()}
+
+
+def test_revocation_list():
+    revocations = RevocationList()
+    assert revocations.check("1") == NOT_REVOKED
+
+    assert revocations.update_filter(**filter_message(2, "1"))
+    assert revocations.update_delta(2, 3, ["2"])
+    assert revocations.check(1) == MAYBE_REVOKED
+    assert revocations.check("2") == REVOKED
+    assert revocations.check("3") == NOT_REVOKED
+    assert revocations.check(None) == NOT_REVOKED
+
+    # older filters and deltas are ignored
+    assert not revocations.update_filter(**filter_message(1))
+    assert not revocations.update_delta(2, 2, [])
+    assert revocations.check("2") == REVOKED
+    assert revocations.stats()["filter_count"] == 1
+
+
+def test_revocation_list_stale():
+    revocations = RevocationList()
+    assert revocations.update_filter(**filter_message(2))
+    assert revocations.update_delta(2, 3, ["2"])
+    assert revocations.check("3") == NOT_REVOKED
+
+    # the filter of version 4 was lost: "3" may have been revoked in it
+    assert revocations.update_delta(4, 5, [])
+    assert revocations.stats()["stale"]
+    assert revocations.check("3") == MAYBE_REVOKED
+
+    # the filter arrives after its delta
+    assert revocations.update_filter(**filter_message(4, "3"))
+    assert revocations.check("3") == MAYBE_REVOKED
+    assert revocations.check("4") == NOT_REVOKED
+
+    # a filter without its delta
+    assert revocations.update_filter(**filter_message(6))
+    assert revocations.check("4") == MAYBE_REVOKED
+
+
+def test_publisher(tmp_path):
+    path = tmp_path / "revoked"
+    path.write_text("1\n2 1\n")
+    parser = argparse.ArgumentParser()
+    RevocationPublisher.augment_parser(parser)
+    args = parser.parse_args(["--revoked", str(path), "--max-delta", "2",
+                              "--filter-capacity", "100"])
+
+    published = []
+    publisher = RevocationPublisher(args)
+    publisher.set_publisher(
+        lambda topic, payload, **kwargs: published.append((topic, payload)))
+    publisher.initialize()
+
+    assert [topic for topic, _ in published] == [REVOCATION_FILTER_TOPIC,
+                                                 REVOCATION_DELTA_TOPIC]
+    revocations = RevocationList()
+
+    def receive():
+        for topic, payload in published:
+            data = json.loads(payload)
+
+            if topic == REVOCATION_FILTER_TOPIC:
+                revocations.update_filter(**data)
+            else:
+                revocations.update_delta(**data)
+
+        published.clear()
+
+    # expired ids are not published
+    receive()
+    assert revocations.check("1") == MAYBE_REVOKED
+    assert revocations.filter.count == 1
+
+    # revocations are sent as deltas until there are too many
+    for jti in ("3", "4", "4"):
+        asyncio.run(publisher.revoke_message(
+            json.dumps({"jti": jti}).encode(), {}))
+    assert [topic for topic, _ in published] == [REVOCATION_DELTA_TOPIC] * 2
+    receive()
+    assert revocations.check("4") == REVOKED
+
+    asyncio.run(publisher.revoke_message(b'{"jti": 5}', {}))
+    assert [topic for topic, _ in published] == [REVOCATION_FILTER_TOPIC,
+                                                 REVOCATION_DELTA_TOPIC]
+    receive()
+    assert revocations.filter.count == 4
+    assert revocations.check("5") == MAYBE_REVOKED
+    assert not revocations.delta
+
+    assert path.read_text().split("\n")[2:] == ["3", "4", "5", ""]
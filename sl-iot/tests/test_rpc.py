@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import json
+import pytest
+from marshmallow import Schema, fields
+from smaug_iot.controllers.abstract import (
+    Controller, Response, RpcError, handler)
+
+
+class EchoSchema(Schema):
+    value = fields.Integer(required=True)
+
+
+class Echo(Controller):
+    def __init__(self, args):
+        super().__init__(args)
+        self.published = []
+        self.set_publisher(
+            lambda topic, payload, **kwargs:
+            self.published.append((topic, payload, kwargs)))
+        self.rpc = self.create_rpc_client(timeout=1)
+
+    @handler("/echo", EchoSchema())
+    async def echo(self, value):
+        return Response({"value": value})
+
+
+def test_subscription():
+    echo = Echo(argparse.Namespace())
+    assert (echo.rpc.response_topic, echo.rpc.receive) in echo.subscriptions
+    assert echo.rpc.response_topic.startswith("/rpc/Echo/")
+
+
+def test_call():
+    echo = Echo(argparse.Namespace())
+    rpc = echo.rpc
+
+    async def run():
+        call = asyncio.ensure_future(
+            rpc.call("/echo", {"value": 1}, EchoSchema()))
+        await asyncio.sleep(0)
+        topic, payload, kwargs = echo.published.pop()
+        assert topic == "/echo"
+        assert kwargs["response_topic"] == rpc.response_topic
+        assert rpc.in_flight == 1
+
+        # a reply to another request is ignored
+        await rpc.receive(b'{"value": 2}', {'correlation_data': [b'x']})
+        await rpc.receive(b'{"value": 2}', {})
+        assert not call.done()
+
+        await rpc.receive(
+            b'{"value": 3}',
+            {'correlation_data': [kwargs["correlation_data"]]})
+        assert await call == {"value": 3}
+        assert rpc.in_flight == 0
+
+        # late replies are ignored too
+        await rpc.receive(
+            b'{"value": 4}',
+            {'correlation_data': [kwargs["correlation_data"]]})
+
+    asyncio.run(run())
+    assert rpc.stats()["latency"]["count"] == 1
+
+
+def test_timeout():
+    echo = Echo(argparse.Namespace())
+    rpc = echo.rpc
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(rpc.call("/echo", {"value": 1}, EchoSchema(),
+                             timeout=0.01))
+
+    assert rpc.in_flight == 0
+    assert rpc.stats()["timeouts"] == 1
+
+
+def test_cancel():
+    echo = Echo(argparse.Namespace())
+    rpc = echo.rpc
+
+    async def run():
+        call = asyncio.ensure_future(
+            rpc.call("/echo", {"value": 1}, EchoSchema()))
+        await asyncio.sleep(0)
+        call.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await call
+
+    asyncio.run(run())
+    assert rpc.in_flight == 0
+    assert rpc.stats()["cancelled"] == 1
+
+
+def test_invalid_response():
+    echo = Echo(argparse.Namespace())
+    rpc = echo.rpc
+
+    async def run():
+        call = asyncio.ensure_future(
+            rpc.call("/echo", {"value": 1}, EchoSchema()))
+        await asyncio.sleep(0)
+        correlation_data = echo.published.pop()[2]["correlation_data"]
+        await rpc.receive(b'{"value": "x"}',
+                          {'correlation_data': [correlation_data]})
+
+        with pytest.raises(RpcError):
+            await call
+
+    asyncio.run(run())
+    assert rpc.in_flight == 0
+    assert rpc.stats()["errors"] == 1
+
+
+def test_handler_response():
+    echo = Echo(argparse.Namespace())
+
+    asyncio.run(echo.echo(b'{"value": 5}', {
+        'response_topic': ['/rpc/Client/1'],
+        'correlation_data': [b'\x01\x02']}))
+    topic, payload, kwargs = echo.published.pop()
+    assert topic == '/rpc/Client/1'
+    assert json.loads(payload) == {"value": 5}
+    assert kwargs == {'absolute': True, 'correlation_data': b'\x01\x02'}
+
+    # the reply is matched by the client that made the request
+    async def run():
+        call = asyncio.ensure_future(
+            echo.rpc.call("/echo", {"value": 6}, EchoSchema()))
+        await asyncio.sleep(0)
+        topic, payload, kwargs = echo.published.pop()
+        await echo.echo(payload, {
+            name: [value] for name, value in kwargs.items()})
+        topic, payload, kwargs = echo.published.pop()
+        assert topic == echo.rpc.response_topic
+        await echo.rpc.receive(payload, {
+            name: [value] for name, value in kwargs.items()})
+        return await call
+
+    assert asyncio.run(run()) == {"value": 6}
@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+from smaug_iot.controllers.scheduler import Scheduler, ACTUATION, QUERY, \
+    DROP, DROP_OLDEST
+
+
+def test_limits_and_priorities():
+    order = []
+
+    async def run():
+        release = asyncio.Event()
+        scheduler = Scheduler(max_running=1)
+        lock = scheduler.queue("/lock", ACTUATION, limit=1)
+        state = scheduler.queue("/lock/state", QUERY)
+
+        async def blocker():
+            await release.wait()
+
+        async def handle(name):
+            order.append(name)
+
+        scheduler.submit(state, blocker)
+        scheduler.submit(state, handle, "state 1")
+        scheduler.submit(state, handle, "state 2")
+        scheduler.submit(lock, handle, "lock")
+
+        assert scheduler.stats()["/lock/state"]["depth"] == 2
+        assert scheduler.stats()["/lock"]["depth"] == 1
+
+        release.set()
+
+        while scheduler.tasks:
+            await asyncio.sleep(0)
+
+        assert scheduler.stats()["/lock/state"]["handled"] == 3
+        assert scheduler.stats()["/lock"]["wait"]["count"] == 1
+
+    asyncio.run(run())
+
+    # queued actuation runs before the earlier queued queries
+    assert order == ["lock", "state 1", "state 2"]
+
+
+@pytest.mark.parametrize("policy,expected", [
+    (DROP, [1, 2]),
+    (DROP_OLDEST, [2, 3]),
+])
+def test_overflow(policy, expected):
+    handled = []
+
+    async def run():
+        release = asyncio.Event()
+        scheduler = Scheduler(queue_size=2, policy=policy)
+        tq = scheduler.queue("/access", limit=1)
+
+        async def handle(n):
+            await release.wait()
+            handled.append(n)
+
+        assert scheduler.submit(tq, handle, 0)
+        assert scheduler.submit(tq, handle, 1)
+        assert scheduler.submit(tq, handle, 2)
+        assert not scheduler.submit(tq, handle, 3)
+        assert tq.dropped == 1
+
+        release.set()
+
+        while scheduler.tasks:
+            await asyncio.sleep(0)
+
+    asyncio.run(run())
+
+    assert handled == [0] + expected
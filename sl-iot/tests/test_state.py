@@ -0,0 +1,46 @@
+import asyncio
+import msgpack
+from smaug_iot.controllers.codec import MSGPACK
+from smaug_iot.controllers.state import StateCache, LOCK_STATE_TOPIC
+
+
+def test_state_cache():
+    cache = StateCache(LOCK_STATE_TOPIC, int)
+    assert not cache.known
+    assert cache.get("unknown") == "unknown"
+
+    asyncio.run(cache.receive(b'1', {}))
+    assert cache.known
+    assert cache.get() == 1
+
+    asyncio.run(cache.receive(msgpack.packb(0),
+                              {'content_type': [MSGPACK]}))
+    assert cache.get() == 0
+    assert cache.stats()["updates"] == 2
+
+
+def test_state_cache_invalid_and_cleared():
+    cache = StateCache(LOCK_STATE_TOPIC, int)
+    asyncio.run(cache.receive(b'1', {}))
+
+    # invalid values are ignored, the previous value is kept
+    asyncio.run(cache.receive(b'"x"', {}))
+    assert cache.get() == 1
+
+    # empty retained message clears the state
+    asyncio.run(cache.receive(b'', {}))
+    assert not cache.known
+    assert cache.get() is None
+
+
+def test_state_cache_changed():
+    cache = StateCache(LOCK_STATE_TOPIC, int)
+
+    async def run():
+        changed = asyncio.ensure_future(cache.changed())
+        await asyncio.sleep(0)
+        await cache.receive(b'0', {})
+        return await changed
+
+    assert asyncio.run(run()) == 0
+    assert not cache.waiters
@@ -0,0 +1,123 @@
+import json
+import time
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+from smaug_iot.controllers.revocation import BloomFilter, RevocationList
+from smaug_iot.controllers.tokens import JwtVerifier, TokenError
+
+
+@pytest.fixture(scope="module")
+def keys():
+    return [rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            for _ in range(2)]
+
+
+@pytest.fixture
+def verifier(keys, tmp_path):
+    pem = tmp_path / "as_public_key.pem"
+    pem.write_bytes(keys[0].public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo))
+    return JwtVerifier.from_files([str(pem)], audience="locker-1",
+                                  actions=("lock", "unlock", "state"))
+
+
+def token(key, **claims):
+    claims.setdefault("aud", "locker-1")
+    claims.setdefault("exp", int(time.time()) + 60)
+    return jwt.encode(claims, key, algorithm="RS256")
+
+
+def test_valid(keys, verifier):
+    exp = int(time.time()) + 60
+    valid, actions, expires = verifier.verify(
+        token(keys[0], exp=exp, jti=2 ** 200))
+    assert valid
+    assert actions == ("lock", "unlock", "state")
+    assert expires.timestamp() == exp
+
+    valid, actions, expires = verifier.verify(
+        token(keys[0], actions="state,unlock"))
+    assert actions == ("state", "unlock")
+
+
+@pytest.mark.parametrize("claims", [
+    {"exp": 1},
+    {"nbf": time.time() + 3600},
+    {"aud": "locker-2"},
+])
+def test_denied(keys, verifier, claims):
+    assert verifier.verify(token(keys[0], **claims)) == (False, (), None)
+
+
+def test_no_audience(keys, verifier):
+    assert verifier.verify(jwt.encode(
+        {"exp": int(time.time()) + 60}, keys[0], algorithm="RS256")) == \
+        (False, (), None)
+
+    with pytest.raises(ValueError):
+        JwtVerifier([], audience=None)
+
+
+def test_no_expiry(keys, verifier):
+    # never expires locally, left to the IAA
+    with pytest.raises(TokenError):
+        verifier.verify(jwt.encode({"aud": "locker-1"}, keys[0],
+                                   algorithm="RS256"))
+
+
+def test_scope(keys, verifier):
+    assert verifier.verify(token(keys[0], scope="lock state"))[1] == \
+        ("lock", "state")
+    assert verifier.verify(token(keys[0], scope=["lock"]))[:2] == \
+        (True, ())
+
+
+@pytest.mark.parametrize("value", ["1;all;9999", "a.b.c"])
+def test_not_jwt(verifier, value):
+    with pytest.raises(TokenError):
+        verifier.verify(value)
+
+
+def test_other_key(keys, verifier):
+    with pytest.raises(TokenError):
+        verifier.verify(token(keys[1]))
+
+
+def test_jwks(keys, tmp_path):
+    jwk = json.loads(RSAAlgorithm.to_jwk(keys[1].public_key()))
+    jwk["kid"] = "k1"
+    path = tmp_path / "jwks.json"
+    path.write_text(json.dumps({"keys": [jwk]}))
+    verifier = JwtVerifier.from_files(jwks_files=[str(path)],
+                                      audience="locker-1")
+
+    signed = jwt.encode({"scope": "lock", "aud": "locker-1",
+                         "exp": int(time.time()) + 60}, keys[1],
+                        algorithm="RS256", headers={"kid": "k1"})
+    assert verifier.verify(signed)[:2] == (True, ("lock",))
+
+    with pytest.raises(TokenError):
+        verifier.verify(jwt.encode({}, keys[1], algorithm="RS256",
+                                   headers={"kid": "k2"}))
+
+
+def test_revoked(keys, verifier):
+    bloom = BloomFilter.for_capacity(100, 0.001)
+    bloom.add(2 ** 200)
+    revocations = RevocationList()
+    revocations.filter = bloom
+    revocations.version = 1
+    revocations.update_delta(1, 2, [str(2 ** 201)])
+    verifier.revocations = revocations
+
+    assert verifier.verify(token(keys[0], jti=2 ** 202))[0]
+    assert verifier.verify(token(keys[0], jti=2 ** 201)) == \
+        (False, (), None)
+
+    # filter matches may be false positives
+    with pytest.raises(TokenError):
+        verifier.verify(token(keys[0], jti=2 ** 200))